@@ -202,7 +202,7 @@ def interp_left(x0, x, y=None, low=None):
     return y[inds]
 
 
-def interp2d(x, xf, f):
+def interp2d(x, xf, f, out=None, chunk_size=65536):
     """
     Can interpolate a table to get an array of values in 2D
 
@@ -211,9 +211,13 @@ def interp2d(x, xf, f):
     x: array_like
         1d array of values to be interpolated
     xf: array_like
-        1d array of values
+        1d array of values (sorted in ascending order)
     f: array_like
         2d array of function values size=(len(xf), n)
+    out: np.ndarray
+        Optional array to store the output size=(len(x), n)
+    chunk_size: int
+        Number of x-values interpolated at a time, limits the size of temporary arrays
 
     Returns
     -------
@@ -236,24 +240,30 @@ def interp2d(x, xf, f):
     >>> print(f_interp[0][2])
     2.0
     """
-    x = np.array(x)
-    xf = np.array(xf)
-    f = np.array(f)
-    ind = np.argmin(np.abs(x[:, np.newaxis] - xf), axis=1)
-    x_ind = xf[ind]
-    ind0 = np.where(x_ind > x, ind - 1, ind)
-    ind1 = np.where(x_ind > x, ind, ind + 1)
-    ind0 = np.clip(ind0, 0, None)
-    ind1 = np.clip(ind1, None, len(xf) - 1)
-    f0 = f[ind0]
-    f1 = f[ind1]
-    a0 = xf[ind0]
-    a1 = xf[ind1]
-    denom = (a1 - a0)
-    denom_adj = np.clip(denom, 1e-10, None)  # to avoid divide by zero warning
-    s0 = np.where(denom > 0, (x - a0) / denom_adj, 1)  # if denom less than 0, then out of bounds
-    s1 = 1 - s0
-    return s1[:, np.newaxis] * f0 + s0[:, np.newaxis] * f1
+    x = np.asarray(x)
+    xf = np.asarray(xf)
+    f = np.asarray(f)
+    if out is None:
+        out = np.empty((len(x),) + f.shape[1:], dtype=np.result_type(f.dtype, np.float64))
+    elif out.shape != (len(x),) + f.shape[1:]:
+        raise ValueError(f'out must have shape {(len(x),) + f.shape[1:]}, not {out.shape}')
+    expand = (slice(None),) + (np.newaxis,) * (f.ndim - 1)
+    chunk_size = len(x) if chunk_size is None else max(int(chunk_size), 1)
+    for i in range(0, len(x), chunk_size):
+        xc = x[i:i + chunk_size]
+        # lower bound is the last xf <= x, values outside xf take the edge value
+        ind = np.searchsorted(xf, xc, side='right') - 1
+        ind0 = np.clip(ind, 0, len(xf) - 1)
+        ind1 = np.clip(ind + 1, 0, len(xf) - 1)
+        a0 = xf[ind0]
+        denom = xf[ind1] - a0
+        denom_adj = np.clip(denom, 1e-10, None)  # to avoid divide by zero warning
+        s0 = np.where(denom > 0, (xc - a0) / denom_adj, 1)  # if denom less than 0, then out of bounds
+        s1 = 1 - s0
+        out_c = out[i:i + chunk_size]
+        np.multiply(s1[expand], f[ind0], out=out_c)
+        out_c += s0[expand] * f[ind1]
+    return out
 
 
 def interp3d(x, y, xs, ys_at_xs, f):
@@ -262,49 +272,138 @@ def interp3d(x, y, xs, ys_at_xs, f):
 
     Parameters
     ----------
-    x: array_like
-        1d array of values to be interpolated
+    x: float or array_like
+        value or 1d array of values to be interpolated
     y: array_like
         1d array of values to be interpolated
     xs: array_like
         1d array of x-positions where points are known
     ys_at_xs: list of array_like
-        list of 1d arrays of y-positions where points are known, len=len(x)
+        list of 1d arrays of y-positions where points are known, len=len(xs), the arrays either side of each x
+        must start at or below min(y)
     f: list of array_like
-        list of 1d arrays of function values size=(len(x), (len(ys_at_xs[j]))
+        list of 1d arrays of function values size=(len(xs), (len(ys_at_xs[j]))
 
     Returns
     -------
-    returns size=(len(x), len(y))
+    returns size=(len(y)) if x is a float, else size=(len(x), len(y))
     Examples
     --------
     """
-    x_ind0 = interp_left(x, xs)
+    scalar_x = np.ndim(x) == 0
+    x = np.atleast_1d(x)[:, np.newaxis]
+    y = np.asarray(y)
+    x_ind0 = interp_left(x[:, 0], xs)
     x_ind1 = np.clip(x_ind0 + 1, None, len(xs) - 1)
-    y_ind_x0y0 = interp_left(y, ys_at_xs[x_ind0])
-    y_ind_x0y1 = np.clip(y_ind_x0y0 + 1, None, len(ys_at_xs[x_ind0]) - 1)
-    y_ind_x1y0 = interp_left(y, ys_at_xs[x_ind1])
-    y_ind_x1y1 = np.clip(y_ind_x1y0 + 1, None, len(ys_at_xs[x_ind1]) - 1)
-
-    x0 = xs[x_ind0]
-    x1 = xs[x_ind1]
-    y0_at_x0 = ys_at_xs[x_ind0][y_ind_x0y0]
-    y1_at_x0 = ys_at_xs[x_ind0][y_ind_x0y1]
-    y0_at_x1 = ys_at_xs[x_ind1][y_ind_x1y0]
-    y1_at_x1 = ys_at_xs[x_ind1][y_ind_x1y1]
-
-    fx0y0 = f[x_ind0][y_ind_x0y0]
-    fx0y1 = f[x_ind0][y_ind_x0y1]
-    fx1y0 = f[x_ind1][y_ind_x1y0]
-    f1y1 = f[x_ind1][y_ind_x1y1]
+
+    # table of the bounding indexes of each y at each xs (computed once for all x), only the tables either side
+    # of an x are used, so other tables do not need to cover y
+    n_ys = np.array([len(ys) for ys in ys_at_xs])
+    ys_table = np.full((len(xs), max(n_ys)), np.nan)
+    f_table = np.zeros((len(xs), max(n_ys)))
+    y_inds0 = np.zeros((len(xs), len(y)), dtype=int)
+    for i in np.unique(np.concatenate([x_ind0, x_ind1])):
+        ys_table[i, :n_ys[i]] = ys_at_xs[i]
+        f_table[i, :n_ys[i]] = f[i]
+        y_inds0[i] = interp_left(y, ys_at_xs[i])
+    y_inds1 = np.clip(y_inds0 + 1, None, n_ys[:, np.newaxis] - 1)
+
+    x_ind0 = x_ind0[:, np.newaxis]
+    x_ind1 = x_ind1[:, np.newaxis]
+    y_ind_x0y0 = y_inds0[x_ind0[:, 0]]
+    y_ind_x0y1 = y_inds1[x_ind0[:, 0]]
+    y_ind_x1y0 = y_inds0[x_ind1[:, 0]]
+    y_ind_x1y1 = y_inds1[x_ind1[:, 0]]
+
+    x0 = np.asarray(xs)[x_ind0]
+    x1 = np.asarray(xs)[x_ind1]
+    y0_at_x0 = ys_table[x_ind0, y_ind_x0y0]
+    y1_at_x0 = ys_table[x_ind0, y_ind_x0y1]
+    y0_at_x1 = ys_table[x_ind1, y_ind_x1y0]
+    y1_at_x1 = ys_table[x_ind1, y_ind_x1y1]
+
+    fx0y0 = f_table[x_ind0, y_ind_x0y0]
+    fx0y1 = f_table[x_ind0, y_ind_x0y1]
+    fx1y0 = f_table[x_ind1, y_ind_x1y0]
+    f1y1 = f_table[x_ind1, y_ind_x1y1]
     x_w = (x - x0) / ((x1 - x0) + 1e-16 * x1)
     y_w_x0 = (y - y0_at_x0) / ((y1_at_x0 - y0_at_x0) + 1e-16 * y1_at_x0)
     y_w_x1 = (y - y0_at_x1) / ((y1_at_x1 - y0_at_x1) + 1e-16 * y1_at_x1)
     fvs = (fx0y0 * (1 - x_w) * (1 - y_w_x0)) + (fx0y1 * (1 - x_w) * y_w_x0) \
            + (fx1y0 * x_w * (1 - y_w_x1)) + (f1y1 * x_w * y_w_x1)
-
+    if scalar_x:
+        return fvs[0]
     return fvs
 
+
+def _get_stretched_knots(x_start, x_end, x_scale_pos, x_scale_vals):
+    """Positions where the scale changes and the stretched coordinate (integral of 1 / scale) at each"""
+    x_scale_pos = np.asarray(x_scale_pos, dtype=float)
+    inner = x_scale_pos[(x_scale_pos > x_start) & (x_scale_pos < x_end)]
+    knots = np.concatenate([[x_start], inner, [x_end]])
+    scales = interp_left(knots[:-1], x_scale_pos, x_scale_vals)
+    u_knots = np.zeros(len(knots))
+    np.cumsum(np.diff(knots) / scales, out=u_knots[1:])
+    return knots, u_knots
+
+
+def get_stretched_coords(x, x_scale_pos, x_scale_vals):
+    """
+    Integral of 1 / scale from x[0] to each x, where the scale is constant from each `x_scale_pos` to the next
+
+    Parameters
+    ----------
+    x: array_like
+        Increasing positions
+    x_scale_pos: array_like
+        Positions where the scale changes, must start at or before `x[0]`
+    x_scale_vals: array_like
+        Scale from each position
+    """
+    x = np.asarray(x, dtype=float)
+    knots, u_knots = _get_stretched_knots(x[0], x[-1], x_scale_pos, x_scale_vals)
+    return np.interp(x, knots, u_knots)
+
+
+def get_graded_positions(x_bounds, n_eles, x_scale_pos, x_scale_vals):
+    """
+    Positions of nodes between boundaries where the node spacing is proportional to a piecewise constant scale
+
+    The nodes are equally spaced in the stretched coordinate (see `get_stretched_coords`) between each pair of
+    boundaries, so the spacing follows the scale exactly, without iteration.
+
+    Parameters
+    ----------
+    x_bounds: array_like
+        Increasing positions that must coincide with nodes
+    n_eles: array_like
+        Number of elements between each pair of boundaries (at least one), len=len(x_bounds) - 1
+    x_scale_pos: array_like
+        Positions where the scale changes, must start at or before `x_bounds[0]`
+    x_scale_vals: array_like
+        Scale from each position
+
+    Returns
+    -------
+    np.ndarray
+        Node positions, len=sum(n_eles) + 1
+    """
+    x_bounds = np.asarray(x_bounds, dtype=float)
+    n_eles = np.asarray(n_eles, dtype=int)
+    assert np.all(n_eles > 0), n_eles
+    knots, u_knots = _get_stretched_knots(x_bounds[0], x_bounds[-1], x_scale_pos, x_scale_vals)
+    u_bounds = np.interp(x_bounds, knots, u_knots)
+    ends = np.cumsum(n_eles)
+    zones = np.repeat(np.arange(len(n_eles)), n_eles)
+    n_in_zone = np.arange(1, ends[-1] + 1) - np.repeat(ends - n_eles, n_eles)
+    u = u_bounds[zones] + (u_bounds[zones + 1] - u_bounds[zones]) * n_in_zone / n_eles[zones]
+    xs = np.empty(ends[-1] + 1)
+    xs[0] = x_bounds[0]
+    xs[1:] = np.interp(u, u_knots, knots)
+    xs[ends] = x_bounds[1:]  # boundaries are exact
+    return xs
+
+
 #
 # if __name__ == '__main__':
 #     xs = np.array([0, 2])
@@ -1,2 +1,10 @@
+from . import cache
 from .mesh2d_orth import *
 from .mesh2d_vary_y import *
+from . import renumber
+from . import partition
+from . import ragged
+from . import active
+from . import locate
+from . import batch
+from . import export
@@ -0,0 +1,309 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from sfsimodels.functions import get_value_of_a_get_method
+from sfsimodels.num.mesh import renumber, locate
+
+
+class ActiveMeshMixin(object):
+    """
+    Queries on the active nodes and elements that are shared by the dense vary meshes and `RaggedVary2DMesh`
+
+    Subclasses provide `soils`, `nny`, `fd_ele_boxes`, `n_nodes`, `n_eles`, `_get_cached`, `get_node_coords`,
+    `get_node_grid_indexes`, `get_ele_grid_indexes`, `get_connectivity`, `get_ele_soil_ids` and
+    `_get_ele_corner_coords`, all in natural order.
+    """
+
+    def get_node_renumbering(self, node_order='rcm'):
+        """
+        Permutation arrays that renumber the active nodes
+
+        Returns
+        -------
+        perm: np.ndarray
+            Natural node id at each new position
+        inv_perm: np.ndarray
+            New node id of each natural node id
+        """
+        if node_order == 'natural':
+            natural = np.arange(self.n_nodes, dtype=np.int32)
+            return natural, natural
+        elif node_order == 'rcm':
+            def build():
+                # The level structure from a single peripheral node is wide for structured grids, so the
+                # orderings that start from the left side and from the base are also trialled,
+                # the natural order is kept if none of them reduce the bandwidth
+                conn = self.get_connectivity()
+                inds = self.get_node_grid_indexes()
+                natural = np.arange(self.n_nodes, dtype=np.int32)
+                best = (renumber.calc_bandwidth(conn), natural, natural)
+                left = np.nonzero(inds[:, 0] == 0)[0]
+                base = np.nonzero(inds[:, 1] == self.nny - 1)[0]
+                for start_nodes in [None, left, base]:
+                    perm, inv_perm = renumber.get_rcm_permutation(conn, self.n_nodes, start_nodes=start_nodes)
+                    bandwidth = renumber.calc_bandwidth(conn, inv_perm)
+                    if bandwidth < best[0]:
+                        best = (bandwidth, perm, inv_perm)
+                return best[1], best[2]
+            return self._get_cached('renumbering_rcm', build)
+        raise ValueError(f"node_order={node_order}, does not match: ['natural', 'rcm']")
+
+    def get_bandwidth(self, node_order='natural'):
+        """Half-bandwidth of the system matrix for a node ordering"""
+        return renumber.calc_bandwidth(self.get_connectivity(node_order=node_order))
+
+    def get_ele_quality(self):
+        """
+        Shape quality metrics of each active element - each size=(n_eles,)
+
+        Returns
+        -------
+        dict
+            'skew': absolute cosine of the angle between the principal axes of the element (0 for a rectangle),
+            'aspect_ratio': longest edge length divided by the shortest edge length,
+            'min_angle' and 'max_angle': smallest and largest corner angle in degrees,
+            'scaled_jacobian': minimum over the corners of the Jacobian divided by the lengths of the two edges
+            (1 for a rectangle, negative if the element is inverted or not convex)
+        """
+        def build():
+            cxs, cys = self._get_ele_corner_coords()
+            # edge i goes from corner i to corner i + 1
+            exs = [cxs[(i + 1) % 4] - cxs[i] for i in range(4)]
+            eys = [cys[(i + 1) % 4] - cys[i] for i in range(4)]
+            lens = [np.hypot(exs[i], eys[i]) for i in range(4)]
+            min_len = np.minimum(np.minimum(lens[0], lens[1]), np.minimum(lens[2], lens[3]))
+            max_len = np.maximum(np.maximum(lens[0], lens[1]), np.maximum(lens[2], lens[3]))
+            scaled_jac = None
+            min_cos = None
+            max_cos = None
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for i in range(4):  # corner i is between edge i - 1 (reversed) and edge i
+                    j = i - 1
+                    denom = lens[i] * lens[j]
+                    sj = (exs[i] * -eys[j] - eys[i] * -exs[j]) / denom
+                    cos = (exs[i] * -exs[j] + eys[i] * -eys[j]) / denom
+                    scaled_jac = sj if scaled_jac is None else np.minimum(scaled_jac, sj)
+                    min_cos = cos if min_cos is None else np.minimum(min_cos, cos)
+                    max_cos = cos if max_cos is None else np.maximum(max_cos, cos)
+                # principal axes
+                ax1x = exs[0] - exs[2]
+                ax1y = eys[0] - eys[2]
+                ax2x = exs[1] - exs[3]
+                ax2y = eys[1] - eys[3]
+                skew = np.abs(ax1x * ax2x + ax1y * ax2y) / (np.hypot(ax1x, ax1y) * np.hypot(ax2x, ax2y))
+                aspect_ratio = max_len / min_len
+            return {
+                'skew': skew,
+                'aspect_ratio': aspect_ratio,
+                'min_angle': np.degrees(np.arccos(np.clip(max_cos, -1, 1))),
+                'max_angle': np.degrees(np.arccos(np.clip(min_cos, -1, 1))),
+                'scaled_jacobian': scaled_jac,
+            }
+        return self._get_cached('ele_quality', build)
+
+    # range of the histogram of each quality metric and if higher values are worse
+    _quality_ranges = {
+        'skew': ((0, 1), True),
+        'aspect_ratio': (None, True),
+        'min_angle': ((0, 90), False),
+        'max_angle': ((90, 180), True),
+        'scaled_jacobian': ((-1, 1), False),
+    }
+
+    def get_quality_report(self, n_bins=20, n_worst=10):
+        """
+        Summary of the element shape quality metrics (see `get_ele_quality`)
+
+        Parameters
+        ----------
+        n_bins: int
+            Number of histogram bins of each metric
+        n_worst: int
+            Number of worst elements listed for each metric
+
+        Returns
+        -------
+        dict
+            'n_eles', 'n_inverted' (elements with a scaled Jacobian of zero or less) and for each metric a dict
+            of 'min', 'max', 'mean', 'hist' (counts, bin_edges) and 'worst' (element ids, worst first)
+        """
+        quality = self.get_ele_quality()
+        report = OrderedDict()
+        report['n_eles'] = self.n_eles
+        report['n_inverted'] = int(np.count_nonzero(~(quality['scaled_jacobian'] > 0)))
+        for item in quality:
+            values = quality[item]
+            rng, high_is_worse = self._quality_ranges[item]
+            finite = np.isfinite(values)
+            fvalues = values[finite]
+            if rng is None:
+                rng = (1, max(float(fvalues.max()), 1 + 1e-9)) if len(fvalues) else (1, 2)
+            # non-finite values (degenerate elements) are the worst
+            key = np.where(finite, values, np.inf if high_is_worse else -np.inf)
+            key = -key if high_is_worse else key
+            n = min(n_worst, len(key))
+            worst = np.argpartition(key, n - 1)[:n] if n else np.zeros(0, dtype=int)
+            worst = worst[np.argsort(key[worst], kind='stable')]
+            report[item] = OrderedDict([
+                ('min', float(fvalues.min()) if len(fvalues) else np.nan),
+                ('max', float(fvalues.max()) if len(fvalues) else np.nan),
+                ('mean', float(fvalues.mean()) if len(fvalues) else np.nan),
+                ('hist', np.histogram(np.clip(fvalues, *rng), bins=n_bins, range=rng)),
+                ('worst', worst.astype(np.int32)),
+            ])
+        return report
+
+    def get_ele_search_index(self):
+        """
+        Bucket grid of the active elements used to find the element that contains a point
+
+        Returns
+        -------
+        sfsimodels.num.mesh.locate.QuadSearchIndex
+        """
+        def build():
+            cxs, cys = self._get_ele_corner_coords()
+            return locate.QuadSearchIndex(np.stack([np.array(cxs).T, np.array(cys).T], axis=2))
+        return self._get_cached('ele_search_index', build)
+
+    def locate_points(self, coords, tol=1e-8):
+        """
+        Active element that contains each point and the natural coordinates of the point in the element
+
+        Parameters
+        ----------
+        coords: array_like
+            x and y coordinates - size=(n, 2)
+        tol: float
+            Tolerance on the natural coordinates for points on the edges of elements
+
+        Returns
+        -------
+        ele_ids: np.ndarray
+            Natural element id (-1 if the point is outside of the active elements)
+        xi: np.ndarray
+            Natural x-coordinate in the element (-1 to 1, nan if outside)
+        eta: np.ndarray
+            Natural y-coordinate in the element (-1 to 1, nan if outside)
+        """
+        return self.get_ele_search_index().locate(coords, tol=tol)
+
+    def get_nodal_loads(self, loads, coords=None, tol=1e-8):
+        """
+        Distributes point loads and moments to the nodes of the elements that contain them,
+        see `sfsimodels.num.mesh.locate.get_nodal_loads`
+
+        Returns
+        -------
+        np.ndarray
+            Nodal forces in the x and y directions in natural node order - size=(n_nodes, 2)
+        """
+        return locate.get_nodal_loads(self, loads, coords=coords, tol=tol)
+
+    def get_sensor_locations(self, si, wild_sensor_code=None, coords='auto', surface=None):
+        """
+        Elements, nodes and interpolation weights of the sensors of a sensor index,
+        see `sfsimodels.num.mesh.locate.get_sensor_mesh_locations`
+
+        Returns
+        -------
+        dict
+        """
+        return locate.get_sensor_mesh_locations(si, self, wild_sensor_code=wild_sensor_code, coords=coords,
+                                                surface=surface)
+
+    def _get_active_ele_property_fields(self, props, v_eff_stress=None, saturated=False):
+        """
+        Soil properties of the active elements - each size=(n_eles,), see `get_ele_property_fields`
+
+        Non stress dependent properties are looked up once per soil and saturation state.
+        """
+        soils = self.soils
+        soil_inds = self.get_ele_soil_ids()
+        sat_inds = np.broadcast_to(np.asarray(saturated, dtype=bool), (self.n_eles,)).astype(int)
+        if v_eff_stress is not None:
+            v_eff_stress = np.broadcast_to(np.asarray(v_eff_stress, dtype=float), (self.n_eles,))
+        fields = {}
+        for item in props:
+            fn0 = "get_{0}_at_v_eff_stress".format(item)
+            fn1 = "get_{0}".format(item)
+            table = np.full((len(soils), 2), np.nan)
+            stress_dep_inds = []
+            for i, sl in enumerate(soils):
+                if hasattr(sl, fn0):
+                    stress_dep_inds.append(i)
+                    continue
+                for sat in (0, 1):
+                    if hasattr(sl, fn1):
+                        value = get_value_of_a_get_method(sl, fn1, extras={"saturated": bool(sat)})
+                    else:
+                        value = getattr(sl, item, None)
+                    table[i, sat] = np.nan if value is None else value
+            field = table[soil_inds, sat_inds]
+            for i in stress_dep_inds:
+                in_sl = soil_inds == i
+                if not in_sl.any():
+                    continue
+                if v_eff_stress is None:
+                    raise ValueError(f"v_eff_stress is required to compute '{item}' of stress dependent soil {i}")
+                for sat in (0, 1):
+                    inds = in_sl & (sat_inds == sat)
+                    if inds.any():
+                        value = get_value_of_a_get_method(soils[i], fn0, extras={"saturated": bool(sat),
+                                                                                 "v_eff_stress": v_eff_stress[inds]})
+                        field[inds] = np.nan if value is None else value
+            fields[item] = field
+        return fields
+
+    def _get_active_ele_stress_fields(self, gwl=1e6, unit_water_weight=9800., x_surf=None, y_surf=None):
+        """
+        Initial vertical stresses and hydrostatic pore pressure at the centres of the active elements -
+        each size=(n_eles,), see `get_ele_stress_fields`
+
+        The overburden is summed down each column over the active elements, as inactive elements carry no weight.
+        """
+        cxs, cys = self._get_ele_corner_coords()
+        # y-position of the top and bottom of each element and the x-position of the centre
+        y_tops = (cys[3] + cys[2]) / 2
+        y_bots = (cys[0] + cys[1]) / 2
+        y_centres = (y_tops + y_bots) / 2
+        x_centres = (cxs[0] + cxs[1] + cxs[2] + cxs[3]) / 4
+
+        if x_surf is None:
+            x_surf, y_surf = locate.get_surface_coords(self, exclude_fd=True)
+        y_ground = np.interp(x_centres, x_surf, y_surf)
+        if np.ndim(gwl) == 0:
+            y_water = y_ground - gwl
+        else:
+            gwl = np.asarray(gwl, dtype=float)
+            y_water = np.interp(x_centres, gwl[:, 0], gwl[:, 1])
+
+        soil_inds = self.get_ele_soil_ids()
+        unit_weights = np.zeros((len(self.soils), 2))
+        for i, sl in enumerate(self.soils):
+            unit_weights[i] = [np.nan if sl.get_unit_weight_or('dry') is None else sl.get_unit_weight_or('dry'),
+                               np.nan if sl.unit_sat_weight is None else sl.unit_sat_weight]
+        uw_dry = unit_weights[soil_inds, 0]
+        uw_sat = unit_weights[soil_inds, 1]
+
+        def get_weight(y_top, y_bot):
+            sat_h = np.clip(np.minimum(y_top, y_water) - y_bot, 0, None)
+            dry_h = (y_top - y_bot) - sat_h
+            with np.errstate(invalid='ignore'):
+                return np.where(dry_h > 0, dry_h * uw_dry, 0) + np.where(sat_h > 0, sat_h * uw_sat, 0)
+
+        ele_weights = get_weight(y_tops, y_bots)
+        # elements are ordered top to bottom within each column, so the weight above each element is the
+        # cumulative sum less the sum up to the first element of its column
+        cols = self.get_ele_grid_indexes()[:, 0]
+        firsts = np.searchsorted(cols, cols)
+        cum_weights = np.cumsum(ele_weights) - ele_weights
+        # total stress at the top of each element, then add the upper half of the element
+        v_total = cum_weights - cum_weights[firsts] + get_weight(y_tops, y_centres)
+        v_total += np.clip(y_water - y_ground, 0, None) * unit_water_weight
+        pore_pressure = np.clip(y_water - y_centres, 0, None) * unit_water_weight
+        if np.isnan(v_total).any():
+            raise ValueError('Unit weight not defined for all soils (saturated unit weight is required below the '
+                             'ground water level)')
+        return {'v_total_stress': v_total, 'pore_pressure': pore_pressure, 'v_eff_stress': v_total - pore_pressure}
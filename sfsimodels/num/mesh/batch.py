@@ -0,0 +1,190 @@
+import traceback
+from concurrent import futures
+
+import numpy as np
+
+from sfsimodels.models.systems import TwoDSystem
+from sfsimodels.num.mesh import cache
+from sfsimodels.num.mesh.mesh2d_orth import FiniteElementOrth2DMesh, construct_femesh_orth
+from sfsimodels.num.mesh.mesh2d_vary_y import FiniteElementVary2DMeshConstructor, FiniteElementVaryY2DMesh, \
+    FiniteElementVaryXY2DMesh, construct_femesh_vary_y, construct_femesh_vary_xy
+
+
+def _construct_femesh_vary(tds, dy_target, **kwargs):
+    return FiniteElementVary2DMeshConstructor(tds, dy_target, **kwargs).femesh
+
+
+_builders = {
+    'vary_y': construct_femesh_vary_y,
+    'vary_xy': construct_femesh_vary_xy,
+    'orth': construct_femesh_orth,
+    'vary': _construct_femesh_vary,  # any FiniteElementVary2DMeshConstructor inputs
+}
+
+_mesh_classes = {
+    'orth2d': FiniteElementOrth2DMesh,
+    'vary_y2d': FiniteElementVaryY2DMesh,
+    'vary_xy2d': FiniteElementVaryXY2DMesh,
+}
+
+
+def get_mesh_arrays(femesh):
+    """
+    Compact array description of a mesh that can be sent between processes
+
+    Returns
+    -------
+    dict
+        x_nodes, y_nodes, soil_grid (int32), inactive_value, mesh_type and fd_ele_boxes (vary meshes only)
+    """
+    if isinstance(femesh, FiniteElementOrth2DMesh):
+        mesh_type = 'orth2d'
+    else:
+        mesh_type = femesh.type
+    arrays = {
+        'mesh_type': mesh_type,
+        'x_nodes': np.asarray(femesh.x_nodes, dtype=np.float64),
+        'y_nodes': np.asarray(femesh.y_nodes, dtype=np.float64),
+        'soil_grid': np.asarray(femesh.soil_grid).astype(np.int32),
+        'inactive_value': femesh.inactive_value,
+    }
+    if hasattr(femesh, 'fd_ele_boxes'):
+        arrays['fd_ele_boxes'] = np.asarray(femesh.fd_ele_boxes, dtype=np.int32)
+    return arrays
+
+
+def build_femesh_from_arrays(arrays, tds):
+    """
+    Rebuilds a mesh from the output of `get_mesh_arrays`
+
+    Parameters
+    ----------
+    arrays: dict
+        Mesh arrays
+    tds: TwoDSystem
+        The system that the mesh was built from (provides the soil objects)
+    """
+    mesh_class = _mesh_classes[arrays['mesh_type']]
+    soils = cache.get_system_soils(tds)[0]
+    femesh = mesh_class(arrays['x_nodes'], arrays['y_nodes'], np.asarray(arrays['soil_grid'], dtype=np.int64), soils,
+                        inactive_value=arrays['inactive_value'])
+    if 'fd_ele_boxes' in arrays:
+        femesh.fd_ele_boxes = np.asarray(arrays['fd_ele_boxes'], dtype=int)
+    return femesh
+
+
+class MeshBatchResult(object):
+    """
+    Outcome of building the mesh of one system in a batch
+
+    Parameters
+    ----------
+    index: int
+        Position of the system in the batch
+    arrays: dict
+        Mesh arrays (see `get_mesh_arrays`), None if the construction failed
+    error: str
+        Exception type and message, None if the construction succeeded
+    tb: str
+        Formatted traceback of the error
+    """
+    def __init__(self, index, arrays=None, error=None, tb=None):
+        self.index = index
+        self.arrays = arrays
+        self.error = error
+        self.traceback = tb
+
+    def __repr__(self):
+        if self.ok:
+            return f'MeshBatchResult({self.index}, mesh_type={self.arrays["mesh_type"]})'
+        return f'MeshBatchResult({self.index}, error={self.error})'
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get_femesh(self, tds):
+        """Mesh object, `tds` must be the system that was meshed"""
+        if not self.ok:
+            raise ValueError(f'Mesh of system {self.index} was not built: {self.error}')
+        return build_femesh_from_arrays(self.arrays, tds)
+
+
+def _build_mesh_arrays(index, tds, mesh_type, dy_target, kwargs):
+    """Worker function, exceptions are returned rather than raised so that one failure does not stop the batch"""
+    try:
+        femesh = _builders[mesh_type](tds, dy_target, **kwargs)
+        return MeshBatchResult(index, arrays=get_mesh_arrays(femesh))
+    except Exception as e:
+        return MeshBatchResult(index, error=f'{type(e).__name__}: {e}', tb=traceback.format_exc())
+
+
+def _split_system_options(item):
+    if isinstance(item, TwoDSystem):
+        return item, {}
+    tds, options = item
+    return tds, dict(options)
+
+
+def iter_mesh_batch(systems, dy_target, mesh_type='vary_y', ordered=True, max_workers=None, **kwargs):
+    """
+    Builds the meshes of many systems in a process pool
+
+    Parameters
+    ----------
+    systems: iterable
+        Each item is either a `TwoDSystem` or a tuple of (`TwoDSystem`, dict of options), where the options
+        override `dy_target` and `kwargs` for that system
+    dy_target: float
+        Target height of elements
+    mesh_type: str
+        'vary_y', 'vary_xy', 'orth' (uses the `construct_femesh_<mesh_type>` functions) or 'vary'
+        (uses `FiniteElementVary2DMeshConstructor` directly)
+    ordered: bool
+        if true then results are yielded in the order of `systems`, else as soon as they are complete
+    max_workers: int
+        Number of processes, if None then the number of processors, if 0 then meshes are built in this process
+    kwargs:
+        Inputs passed to the mesh construction function
+
+    Yields
+    ------
+    MeshBatchResult
+    """
+    if mesh_type not in _builders:
+        raise ValueError(f"mesh_type={mesh_type}, does not match: {list(_builders)}")
+    jobs = []
+    for i, item in enumerate(systems):
+        tds, options = _split_system_options(item)
+        sys_dy_target = options.pop('dy_target', dy_target)
+        sys_kwargs = dict(kwargs)
+        sys_kwargs.update(options)
+        jobs.append((i, tds, mesh_type, sys_dy_target, sys_kwargs))
+    if max_workers == 0:
+        for job in jobs:
+            yield _build_mesh_arrays(*job)
+        return
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        fut_to_ind = {executor.submit(_build_mesh_arrays, *job): job[0] for job in jobs}
+        if ordered:
+            fut_iter = sorted(fut_to_ind, key=lambda fut: fut_to_ind[fut])
+        else:
+            fut_iter = futures.as_completed(fut_to_ind)
+        for fut in fut_iter:
+            try:
+                yield fut.result()
+            except Exception as e:  # e.g. the worker process was terminated
+                yield MeshBatchResult(fut_to_ind[fut], error=f'{type(e).__name__}: {e}', tb=traceback.format_exc())
+
+
+def build_mesh_batch(systems, dy_target, mesh_type='vary_y', max_workers=None, **kwargs):
+    """
+    Builds the meshes of many systems in a process pool, see `iter_mesh_batch`
+
+    Returns
+    -------
+    list of MeshBatchResult
+        In the order of `systems`
+    """
+    return list(iter_mesh_batch(systems, dy_target, mesh_type=mesh_type, ordered=True, max_workers=max_workers,
+                                **kwargs))
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from sfsimodels.__about__ import __version__
+
+_CACHE_FORMAT = 2
+_FD_ATTRS = ('width', 'length', 'depth', 'height', 'ip_axis')
+SP_WATER_ATTRS = ('gwl', 'unit_water_weight')  # profile attributes that only change the soil properties
+
+
+def _json_default(o):
+    """Converts numpy types to json serialisable python types"""
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    return str(o)
+
+
+def _update_hash(h, value):
+    if isinstance(value, np.ndarray):
+        h.update(f'a{value.dtype.str}{value.shape}'.encode('utf-8'))
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(f'd{len(value)}'.encode('utf-8'))
+        for key in sorted(value, key=repr):
+            _update_hash(h, key)
+            _update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f'l{len(value)}'.encode('utf-8'))
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, np.generic):
+        h.update(repr(value.item()).encode('utf-8'))
+    else:
+        h.update(repr(value).encode('utf-8'))
+    h.update(b';')
+
+
+def get_content_hash(value):
+    """
+    Hash of nested dicts, lists and arrays that depends only on their contents
+
+    Parameters
+    ----------
+    value: object
+        dicts, lists, tuples, numpy arrays and scalars
+
+    Returns
+    -------
+    str
+    """
+    h = hashlib.sha256()
+    _update_hash(h, value)
+    return h.hexdigest()
+
+
+def get_system_soils(tds):
+    """
+    Unique soils of a two-dimensional system in the order used by the mesh constructors
+
+    Returns
+    -------
+    soils: list
+        Soil objects, the soil grid of a mesh stores the index of the soil in this list
+    layer_soil_inds: list of lists
+        Index in `soils` of each layer of each soil profile
+    """
+    soils = []
+    soil_hashes = []
+    layer_soil_inds = []
+    for sp in tds.sps:
+        inds = []
+        for yy in range(1, sp.n_layers + 1):
+            sl = sp.layer(yy)
+            if sl.unique_hash not in soil_hashes:
+                soil_hashes.append(sl.unique_hash)
+                soils.append(sl)
+            inds.append(soil_hashes.index(sl.unique_hash))
+        layer_soil_inds.append(inds)
+    return soils, layer_soil_inds
+
+
+def get_system_dict(tds):
+    """
+    Canonical description of the parts of a two-dimensional system that define a mesh
+
+    Object ids and names are not included, so identical systems built separately give the same description.
+    The water level of each profile is included as it changes the shear wave velocity of the soils.
+    """
+    soils, layer_soil_inds = get_system_soils(tds)
+    sps = []
+    for i, sp in enumerate(tds.sps):
+        sps.append({
+            'x': tds.x_sps[i],
+            'height': sp.height,
+            'depths': [sp.layer_depth(yy) for yy in range(1, sp.n_layers + 1)],
+            'soil_inds': layer_soil_inds[i],
+            'x_angles': getattr(sp, 'x_angles', None),
+            'gwl': sp.gwl,
+            'unit_water_weight': sp.unit_water_weight,
+        })
+    sls = []
+    for sl in soils:
+        sl_dict = sl.to_dict(with_hash=False)
+        sl_dict.pop('id', None)
+        sl_dict.pop('name', None)
+        sls.append(sl_dict)
+    bds = []
+    for i, bd in enumerate(tds.bds):
+        fd = bd.fd
+        bds.append({
+            'x': tds.x_bds[i],
+            'x_fd': getattr(bd, 'x_fd', None),
+            'fd': None if fd is None else {item: getattr(fd, item, None) for item in _FD_ATTRS},
+        })
+    return {
+        'width': tds.width,
+        'height': tds.height,
+        'x_surf': tds.x_surf,
+        'y_surf': tds.y_surf,
+        'sps': sps,
+        'soils': sls,
+        'bds': bds,
+    }
+
+
+def get_mesh_key(tds, mesh_type, **kwargs):
+    """
+    Content hash of a system, the mesh type and the constructor arguments
+
+    Parameters
+    ----------
+    tds: TwoDSystem
+        A two dimensional system of models
+    mesh_type: str
+        Name of the mesh construction method
+    kwargs:
+        Constructor arguments (must be json serialisable or numpy arrays)
+
+    Returns
+    -------
+    str
+    """
+    content = {
+        'format': _CACHE_FORMAT,
+        'version': __version__,
+        'mesh_type': mesh_type,
+        'system': get_system_dict(tds),
+        'kwargs': kwargs,
+    }
+    p_str = json.dumps(content, sort_keys=True, default=_json_default)
+    return hashlib.sha256(p_str.encode('utf-8')).hexdigest()
+
+
+class MeshCache(object):
+    """
+    Disk cache of mesh arrays stored as uncompressed numpy `.npz` files keyed by content hash
+
+    Entries are evicted in least-recently-used order once the cache exceeds `max_size` or `max_entries`.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Directory of the cache files (created if it does not exist)
+    max_size: int
+        Maximum total size of the cache files in bytes, if None then not limited
+    max_entries: int
+        Maximum number of cache files, if None then not limited
+    """
+    ext = '.npz'
+
+    def __init__(self, cache_dir, max_size=None, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_ffp(self, key):
+        return os.path.join(self.cache_dir, key + self.ext)
+
+    def load(self, key):
+        """
+        Arrays stored for a key, or None if the key is not in the cache
+
+        Returns
+        -------
+        dict
+        """
+        ffp = self.get_ffp(key)
+        try:
+            with np.load(ffp, allow_pickle=False) as data:
+                arrays = {item: data[item] for item in data.files}
+        except (OSError, ValueError, KeyError):  # missing or partially written
+            return None
+        t_now = time.time_ns()
+        try:
+            os.utime(ffp, ns=(t_now, t_now))  # mark as recently used
+        except OSError:
+            pass
+        return arrays
+
+    def save(self, key, **arrays):
+        """Stores the arrays for a key, then evicts the least recently used entries if the cache is too large"""
+        ffp = self.get_ffp(key)
+        tmp_ffp = f'{ffp}.{os.getpid()}.tmp'
+        with open(tmp_ffp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_ffp, ffp)  # atomic, so concurrent readers never see a partial file
+        self.evict()
+
+    def get_entries(self):
+        """Cache files as a list of (last used time, size, full file path) sorted from least to most recently used"""
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if not fname.endswith(self.ext):
+                continue
+            ffp = os.path.join(self.cache_dir, fname)
+            try:
+                stat = os.stat(ffp)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, ffp))
+        entries.sort()
+        return entries
+
+    @property
+    def size(self):
+        """Total size of the cache files in bytes"""
+        return sum([entry[1] for entry in self.get_entries()])
+
+    def evict(self):
+        """Removes the least recently used entries until the size and entry limits are satisfied"""
+        if self.max_size is None and self.max_entries is None:
+            return
+        entries = self.get_entries()
+        total = sum([entry[1] for entry in entries])
+        n = len(entries)
+        for mtime, size, ffp in entries:
+            if (self.max_size is None or total <= self.max_size) and (self.max_entries is None or n <= self.max_entries):
+                break
+            try:
+                os.remove(ffp)
+            except OSError:
+                continue
+            total -= size
+            n -= 1
+
+    def clear(self):
+        """Removes all entries"""
+        for entry in self.get_entries():
+            os.remove(entry[2])
@@ -0,0 +1,347 @@
+import numpy as np
+
+from sfsimodels.num.mesh import ragged
+
+_VTK_QUAD = 9
+
+
+class _FileHandle(object):
+    """Opens a file path for writing, or uses an open text file handle (which is not closed)"""
+    def __init__(self, ffp):
+        self.ffp = ffp
+        self.fh = None
+
+    def __enter__(self):
+        if hasattr(self.ffp, 'write'):
+            self.fh = self.ffp
+        else:
+            self.fh = open(self.ffp, 'w')
+        return self.fh
+
+    def __exit__(self, *args):
+        if self.fh is not self.ffp:
+            self.fh.close()
+
+
+def _get_int_fmt_parts(fmt):
+    """Text between the `%d` fields of a row format, None if the format has other fields"""
+    parts = fmt.split('%d')
+    if any('%' in part for part in parts):
+        return None
+    return [part.encode('ascii') for part in parts[:-1]] + [parts[-1].encode('ascii') + b'\n']
+
+
+def _format_int_rows(parts, rows, max_layouts=64):
+    """
+    Formats integer rows with numpy, same result as `%d` formatting
+
+    Rows with the same number of digits (and signs) in each field have the same layout, so the rows of each layout
+    are formatted as a 2d array of characters and then placed at their line positions. Node and element ids only
+    have a few layouts, if there are more than `max_layouts` then None is returned.
+
+    Parameters
+    ----------
+    parts: list of bytes
+        Text before each field and after the last field (see `_get_int_fmt_parts`)
+    rows: array_like
+        Integer values, size=(n_rows, len(parts) - 1)
+    max_layouts: int
+        Maximum number of different layouts
+
+    Returns
+    -------
+    str or None
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    vals = np.abs(rows)
+    max_val = vals.max()
+    if max_val < 2 ** 31:
+        vals = vals.astype(np.int32)  # division is faster
+    negs = rows < 0
+    n_digits = np.ones(rows.shape, dtype=np.int64)
+    for k in range(1, len(str(max_val))):
+        n_digits += vals >= 10 ** k
+    field_lens = n_digits + negs
+    codes = np.zeros(len(rows), dtype=np.int64)
+    for j in range(rows.shape[1]):
+        codes = codes * 64 + n_digits[:, j] * 2 + negs[:, j]
+    if rows.shape[1] > 10:  # codes would overflow
+        return None
+    layouts, layout_inds = np.unique(codes, return_inverse=True)
+    if len(layouts) > max_layouts:
+        return None
+    lit_chars = [np.frombuffer(part, dtype=np.uint8)[:, np.newaxis] for part in parts]
+    line_lens = sum(len(part) for part in parts) + np.sum(field_lens, axis=1)
+    out = None
+    if len(layouts) > 1:
+        out = np.empty(np.sum(line_lens), dtype=np.uint8)
+        starts = np.cumsum(line_lens) - line_lens
+    for g in range(len(layouts)):
+        inds = np.flatnonzero(layout_inds == g)
+        r0 = inds[0]
+        # characters are stored column by column, so that each write is contiguous
+        chars = np.empty((line_lens[r0], len(inds)), dtype=np.uint8)
+        pos = 0
+        for j in range(len(parts)):
+            chars[pos:pos + len(lit_chars[j])] = lit_chars[j]
+            pos += len(lit_chars[j])
+            if j == len(parts) - 1:
+                break
+            if negs[r0, j]:
+                chars[pos] = ord('-')
+            pos += field_lens[r0, j]
+            digits = vals[inds, j]
+            for k in range(n_digits[r0, j]):
+                next_digits = digits // 10
+                chars[pos - 1 - k] = digits - next_digits * 10 + ord('0')
+                digits = next_digits
+        if out is None:
+            return chars.T.tobytes().decode('ascii')
+        if inds[-1] - r0 + 1 == len(inds):  # consecutive lines
+            out[starts[r0]:starts[r0] + chars.size] = chars.T.ravel()
+        else:
+            out[starts[inds, np.newaxis] + np.arange(len(chars))] = chars.T
+    return out.tobytes().decode('ascii')
+
+
+def _write_rows(fh, fmt, n_rows, get_rows, chunk_size):
+    """
+    Writes rows in chunks, each chunk is formatted in a single operation (like `np.savetxt` with a row format)
+
+    Formats that only have `%d` fields are formatted with numpy (see `_format_int_rows`), which is faster than
+    `%` formatting, formats with float fields use `%` formatting.
+
+    Parameters
+    ----------
+    fh: file
+        Open text file
+    fmt: str
+        Format of one row (e.g. 'node %d %.10g %.10g')
+    n_rows: int
+        Total number of rows
+    get_rows: function
+        get_rows(start, end) returns the values of rows start to end as a 2d array
+    chunk_size: int
+        Number of rows per chunk
+    """
+    line_fmt = fmt + '\n'
+    int_parts = _get_int_fmt_parts(fmt)
+    for start in range(0, n_rows, chunk_size):
+        rows = get_rows(start, min(start + chunk_size, n_rows))
+        text = None
+        if int_parts is not None and np.issubdtype(rows.dtype, np.integer):
+            text = _format_int_rows(int_parts, rows)
+        if text is None:
+            text = (line_fmt * len(rows)) % tuple(rows.ravel().tolist())
+        fh.write(text)
+
+
+def get_node_fixities(femesh, node_order='natural'):
+    """
+    Boundary conditions of a mesh with a fixed base and horizontally fixed sides (see `get_boundary_sets`)
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    node_order: str
+        Node numbering (see `get_node_id_grid`)
+
+    Returns
+    -------
+    node_ids: np.ndarray
+        Ids of the fixed nodes (sorted)
+    fixities: np.ndarray
+        Fixity of the x and y degrees of freedom of each fixed node (1 if fixed) - size=(len(node_ids), 2)
+    """
+    boundaries = femesh.get_boundary_sets(node_order)
+    fix = np.zeros((femesh.n_nodes, 2), dtype=np.int32)
+    fix[boundaries['base'][0]] = 1
+    fix[boundaries['left'][0], 0] = 1
+    fix[boundaries['right'][0], 0] = 1
+    node_ids = np.where(fix.any(axis=1))[0]
+    return node_ids, fix[node_ids]
+
+
+def _get_soil_props(femesh):
+    """Shear modulus, bulk modulus, Poisson's ratio and density of each soil"""
+    props = []
+    for i, sl in enumerate(femesh.soils):
+        values = [sl.g_mod, sl.bulk_mod, sl.poissons_ratio, sl.unit_dry_mass]
+        if None in values:
+            raise ValueError(f'Soil {i} must have g_mod, bulk_mod, poissons_ratio and unit_dry_weight set to be exported')
+        props.append(values)
+    return np.array(props, dtype=float).reshape(-1, 4)
+
+
+def _write_opensees(femesh, ffp, lang, thickness, node_order, chunk_size, precision):
+    fl = f'%.{precision}g'
+    if lang == 'tcl':
+        header = 'model basic -ndm 2 -ndf 2\n'
+        node_fmt = f'node %d {fl} {fl}'
+        mat_fmt = f'nDMaterial ElasticIsotropic %d {fl} {fl} {fl}'
+        ele_fmt = f'element quad %d %d %d %d %d {fl % thickness} PlaneStrain %d'
+        fix_fmt = 'fix %d %d %d'
+    else:
+        header = "import openseespy.opensees as ops\n\nops.wipe()\nops.model('basic', '-ndm', 2, '-ndf', 2)\n"
+        node_fmt = f'ops.node(%d, {fl}, {fl})'
+        mat_fmt = f"ops.nDMaterial('ElasticIsotropic', %d, {fl}, {fl}, {fl})"
+        ele_fmt = f"ops.element('quad', %d, %d, %d, %d, %d, {fl % thickness}, 'PlaneStrain', %d)"
+        fix_fmt = 'ops.fix(%d, %d, %d)'
+    coords = femesh.get_node_coords(node_order)
+    conn = femesh.get_connectivity(node_order)
+    soil_ids = femesh.get_ele_soil_ids()
+    props = _get_soil_props(femesh)
+    fix_ids, fixities = get_node_fixities(femesh, node_order)
+
+    def get_node_rows(s, e):
+        return np.column_stack([np.arange(s + 1, e + 1), coords[s:e]])
+
+    def get_ele_rows(s, e):  # integers only, so that they are formatted quickly
+        return np.column_stack([np.arange(s + 1, e + 1), conn[s:e] + 1, soil_ids[s:e] + 1])
+
+    with _FileHandle(ffp) as fh:
+        fh.write(header)
+        _write_rows(fh, node_fmt, len(coords), get_node_rows, chunk_size)
+        e_mod = 2 * props[:, 0] * (1 + props[:, 2])
+        mat_rows = np.column_stack([np.arange(1, len(props) + 1), e_mod, props[:, 2], props[:, 3]])
+        _write_rows(fh, mat_fmt, len(mat_rows), lambda s, e: mat_rows[s:e], chunk_size)
+        _write_rows(fh, ele_fmt, len(conn), get_ele_rows, chunk_size)
+        _write_rows(fh, fix_fmt, len(fix_ids), lambda s, e: np.column_stack([fix_ids[s:e] + 1, fixities[s:e]]),
+                    chunk_size)
+
+
+def write_opensees_tcl(femesh, ffp, thickness=1.0, node_order='natural', chunk_size=100000, precision=10):
+    """
+    Writes the nodes, materials, elements and boundary conditions of a mesh as OpenSees Tcl commands
+
+    Elements are plane strain `quad` elements with an `ElasticIsotropic` material for each soil,
+    node, element and material tags start from one.
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    ffp: str or file
+        Full file path or open text file handle
+    thickness: float
+        Out-of-plane thickness of the elements
+    node_order: str
+        Node numbering (see `get_node_id_grid`)
+    chunk_size: int
+        Number of lines formatted at a time
+    precision: int
+        Number of significant figures of the floats
+    """
+    _write_opensees(femesh, ffp, 'tcl', thickness, node_order, chunk_size, precision)
+
+
+def write_opensees_py(femesh, ffp, thickness=1.0, node_order='natural', chunk_size=100000, precision=10):
+    """
+    Writes the nodes, materials, elements and boundary conditions of a mesh as an openseespy script
+
+    See `write_opensees_tcl`
+    """
+    _write_opensees(femesh, ffp, 'py', thickness, node_order, chunk_size, precision)
+
+
+def write_flac_grid(femesh, ffp, chunk_size=100000, precision=10):
+    """
+    Writes the mesh as FLAC commands for a structured grid
+
+    Grid points are numbered (i, j) from the bottom-left with j increasing upwards, inactive elements are
+    null zones and each soil is an elastic group `soil_<index>`.
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh or FiniteElementVaryXY2DMesh
+        The mesh (all grid points are written, so the active-only `RaggedVary2DMesh` is not supported)
+    ffp: str or file
+        Full file path or open text file handle
+    chunk_size: int
+        Number of lines formatted at a time
+    precision: int
+        Number of significant figures of the floats
+    """
+    if isinstance(femesh, ragged.RaggedVary2DMesh):
+        raise ValueError('FLAC grids include the inactive grid points, which are not stored by RaggedVary2DMesh')
+    fl = f'%.{precision}g'
+    nnx, nny = femesh.nnx, femesh.nny
+    x_nodes2d = np.asarray(femesh.get_x_nodes2d(), dtype=float)
+    y_nodes = np.asarray(femesh.y_nodes, dtype=float)
+    soil_grid = np.asarray(femesh.soil_grid)
+    active = femesh.get_active_ele_mask()
+    props = _get_soil_props(femesh)
+    node_grid_inds = femesh.get_node_grid_indexes()
+    fix_ids, fixities = get_node_fixities(femesh)
+
+    def get_gp_rows(s, e):
+        inds = np.arange(s, e)
+        xx, yy = inds // nny, inds % nny
+        return np.column_stack([x_nodes2d[xx, yy], y_nodes[xx, yy], xx + 1, nny - yy])
+
+    def get_zone_rows(grid_inds):
+        def get_rows(s, e):
+            xx, yy = grid_inds[s:e, 0], grid_inds[s:e, 1]
+            return np.column_stack([soil_grid[xx, yy].astype(np.int64), xx + 1, nny - 1 - yy])
+        return get_rows
+
+    with _FileHandle(ffp) as fh:
+        fh.write(f'grid {nnx - 1},{nny - 1}\n')
+        _write_rows(fh, f'ini x={fl} y={fl} i=%d j=%d', nnx * nny, get_gp_rows, chunk_size)
+        ele_inds = np.argwhere(active)
+        _write_rows(fh, "group 'soil_%d' i=%d j=%d", len(ele_inds), get_zone_rows(ele_inds), chunk_size)
+        null_inds = np.argwhere(~active)
+        _write_rows(fh, 'model null i=%d j=%d', len(null_inds),
+                    lambda s, e: get_zone_rows(null_inds)(s, e)[:, 1:], chunk_size)
+        for i in range(len(props)):
+            fh.write(f"model elastic group 'soil_{i}'\n")
+            fh.write(f"prop density={props[i, 3]:.{precision}g} bulk={props[i, 1]:.{precision}g} "
+                     f"shear={props[i, 0]:.{precision}g} group 'soil_{i}'\n")
+        for dofs, fix_str in [((1, 1), 'x y'), ((1, 0), 'x'), ((0, 1), 'y')]:
+            inds = fix_ids[(fixities[:, 0] == dofs[0]) & (fixities[:, 1] == dofs[1])]
+            _write_rows(fh, f'fix {fix_str} i=%d j=%d', len(inds),
+                        lambda s, e: np.column_stack([node_grid_inds[inds[s:e], 0] + 1,
+                                                      nny - node_grid_inds[inds[s:e], 1]]), chunk_size)
+
+
+def write_vtk(femesh, ffp, node_order='natural', chunk_size=100000, precision=10):
+    """
+    Writes the mesh as a legacy ASCII VTK unstructured grid of quad cells
+
+    The cell data contains the soil index of each element and the point data contains the node fixities
+    (see `get_node_fixities`).
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    ffp: str or file
+        Full file path or open text file handle
+    node_order: str
+        Node numbering (see `get_node_id_grid`)
+    chunk_size: int
+        Number of lines formatted at a time
+    precision: int
+        Number of significant figures of the floats
+    """
+    fl = f'%.{precision}g'
+    coords = femesh.get_node_coords(node_order)
+    conn = femesh.get_connectivity(node_order)
+    soil_ids = femesh.get_ele_soil_ids()
+    fix_ids, fixities = get_node_fixities(femesh, node_order)
+    node_fix = np.zeros((len(coords), 2), dtype=np.int32)
+    node_fix[fix_ids] = fixities
+    n_eles = len(conn)
+    with _FileHandle(ffp) as fh:
+        fh.write('# vtk DataFile Version 3.0\nsfsimodels mesh\nASCII\nDATASET UNSTRUCTURED_GRID\n')
+        fh.write(f'POINTS {len(coords)} double\n')
+        _write_rows(fh, f'{fl} {fl} 0', len(coords), lambda s, e: coords[s:e], chunk_size)
+        fh.write(f'CELLS {n_eles} {5 * n_eles}\n')
+        _write_rows(fh, '4 %d %d %d %d', n_eles, lambda s, e: conn[s:e], chunk_size)
+        fh.write(f'CELL_TYPES {n_eles}\n')
+        _write_rows(fh, '%d', n_eles, lambda s, e: np.full((e - s, 1), _VTK_QUAD), chunk_size)
+        fh.write(f'CELL_DATA {n_eles}\nSCALARS soil_id int 1\nLOOKUP_TABLE default\n')
+        _write_rows(fh, '%d', n_eles, lambda s, e: soil_ids[s:e, np.newaxis], chunk_size)
+        fh.write(f'POINT_DATA {len(coords)}\nSCALARS fixity int 2\nLOOKUP_TABLE default\n')
+        _write_rows(fh, '%d %d', len(coords), lambda s, e: node_fix[s:e], chunk_size)
@@ -0,0 +1,390 @@
+import numpy as np
+
+from sfsimodels import sensors
+
+# natural coordinates of the nodes of a bilinear element, counter-clockwise from the bottom-left node
+_QUAD_XIS = np.array([-1., 1., 1., -1.])
+_QUAD_ETAS = np.array([-1., -1., 1., 1.])
+
+
+def get_quad_shape_functions(xi, eta):
+    """
+    Bilinear shape functions and their derivatives with respect to the natural coordinates
+
+    Parameters
+    ----------
+    xi: array_like
+        Natural x-coordinates (-1 to 1)
+    eta: array_like
+        Natural y-coordinates (-1 to 1)
+
+    Returns
+    -------
+    n: np.ndarray
+        Shape function values - size=(len(xi), 4), nodes ordered counter-clockwise from the bottom-left
+    dn_dxi: np.ndarray
+        Derivatives with respect to xi - size=(len(xi), 4)
+    dn_deta: np.ndarray
+        Derivatives with respect to eta - size=(len(xi), 4)
+    """
+    xi = np.asarray(xi, dtype=float)[:, np.newaxis]
+    eta = np.asarray(eta, dtype=float)[:, np.newaxis]
+    n = (1 + _QUAD_XIS * xi) * (1 + _QUAD_ETAS * eta) / 4
+    dn_dxi = _QUAD_XIS * (1 + _QUAD_ETAS * eta) / 4
+    dn_deta = _QUAD_ETAS * (1 + _QUAD_XIS * xi) / 4
+    return n, dn_dxi, dn_deta
+
+
+def _get_jacobian(ele_coords, dn_dxi, dn_deta):
+    """Components (dx/dxi, dy/dxi, dx/deta, dy/deta) and determinant of the Jacobian"""
+    a = np.sum(dn_dxi * ele_coords[:, :, 0], axis=1)
+    c = np.sum(dn_dxi * ele_coords[:, :, 1], axis=1)
+    b = np.sum(dn_deta * ele_coords[:, :, 0], axis=1)
+    d = np.sum(dn_deta * ele_coords[:, :, 1], axis=1)
+    return a, c, b, d, a * d - b * c
+
+
+def get_quad_shape_function_gradients(ele_coords, xi, eta):
+    """
+    Derivatives of the bilinear shape functions with respect to x and y
+
+    Parameters
+    ----------
+    ele_coords: array_like
+        Coordinates of the element nodes - size=(n, 4, 2)
+    xi: array_like
+        Natural x-coordinates - size=(n,)
+    eta: array_like
+        Natural y-coordinates - size=(n,)
+
+    Returns
+    -------
+    dn_dx: np.ndarray
+        size=(n, 4)
+    dn_dy: np.ndarray
+        size=(n, 4)
+    """
+    ele_coords = np.asarray(ele_coords, dtype=float)
+    n, dn_dxi, dn_deta = get_quad_shape_functions(xi, eta)
+    a, c, b, d, det = _get_jacobian(ele_coords, dn_dxi, dn_deta)
+    dn_dx = (d[:, np.newaxis] * dn_dxi - c[:, np.newaxis] * dn_deta) / det[:, np.newaxis]
+    dn_dy = (a[:, np.newaxis] * dn_deta - b[:, np.newaxis] * dn_dxi) / det[:, np.newaxis]
+    return dn_dx, dn_dy
+
+
+def get_quad_natural_coords(ele_coords, points, n_iters=10, rtol=1e-12):
+    """
+    Natural coordinates of points in bilinear elements (inverse of the isoparametric mapping, using Newton's method)
+
+    Parameters
+    ----------
+    ele_coords: array_like
+        Coordinates of the element nodes - size=(n, 4, 2)
+    points: array_like
+        Coordinates of the points - size=(n, 2)
+    n_iters: int
+        Maximum number of Newton iterations (exact after one iteration for parallelograms)
+    rtol: float
+        Iterations stop once the change in the natural coordinates is less than this
+
+    Returns
+    -------
+    xi: np.ndarray
+    eta: np.ndarray
+    """
+    ele_coords = np.asarray(ele_coords, dtype=float)
+    points = np.asarray(points, dtype=float)
+    # x = c0 + c1 * xi + c2 * eta + c3 * xi * eta (and the same for y)
+    c0 = ele_coords.sum(axis=1) / 4
+    c1 = (-ele_coords[:, 0] + ele_coords[:, 1] + ele_coords[:, 2] - ele_coords[:, 3]) / 4
+    c2 = (-ele_coords[:, 0] - ele_coords[:, 1] + ele_coords[:, 2] + ele_coords[:, 3]) / 4
+    c3 = (ele_coords[:, 0] - ele_coords[:, 1] + ele_coords[:, 2] - ele_coords[:, 3]) / 4
+    r0 = points - c0
+    xi = np.zeros(len(points))
+    eta = np.zeros(len(points))
+    todo = np.arange(len(points))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(n_iters):
+            x_i = xi[todo, np.newaxis]
+            e_i = eta[todo, np.newaxis]
+            jxi = c1[todo] + c3[todo] * e_i  # (dx/dxi, dy/dxi)
+            jeta = c2[todo] + c3[todo] * x_i  # (dx/deta, dy/deta)
+            r = r0[todo] - jxi * x_i - c2[todo] * e_i
+            det = jxi[:, 0] * jeta[:, 1] - jeta[:, 0] * jxi[:, 1]
+            dxi = (r[:, 0] * jeta[:, 1] - jeta[:, 0] * r[:, 1]) / det
+            deta = (jxi[:, 0] * r[:, 1] - jxi[:, 1] * r[:, 0]) / det
+            # limit the range so that points far outside of an element do not diverge
+            xi[todo] = np.clip(xi[todo] + dxi, -3, 3)
+            eta[todo] = np.clip(eta[todo] + deta, -3, 3)
+            todo = todo[~((np.abs(dxi) < rtol) & (np.abs(deta) < rtol))]
+            if not len(todo):
+                break
+    return xi, eta
+
+
+class QuadSearchIndex(object):
+    """
+    Uniform grid of buckets that lists the elements whose bounding box overlaps each bucket
+
+    Parameters
+    ----------
+    ele_coords: array_like
+        Coordinates of the element nodes - size=(n_eles, 4, 2)
+    cell_size: float
+        Size of the buckets, if None then the median size of the element bounding boxes
+    """
+    def __init__(self, ele_coords, cell_size=None):
+        self.ele_coords = np.asarray(ele_coords, dtype=float)
+        self.lows = lows = self.ele_coords.min(axis=1)
+        self.highs = highs = self.ele_coords.max(axis=1)
+        if cell_size is None:
+            cell_size = float(np.median(np.max(highs - lows, axis=1))) if len(lows) else 1.
+        self.cell_size = cell_size if cell_size > 0 else 1.
+        self.origin = lows.min(axis=0) if len(lows) else np.zeros(2)
+        top = highs.max(axis=0) if len(highs) else np.zeros(2)
+        self.n_cells = (np.floor((top - self.origin) / self.cell_size)).astype(np.int64) + 1
+        c0 = np.floor((lows - self.origin) / self.cell_size).astype(np.int64)
+        c1 = np.floor((highs - self.origin) / self.cell_size).astype(np.int64)
+        # one entry for each bucket overlapped by each element
+        ncx = c1[:, 0] - c0[:, 0] + 1
+        ncy = c1[:, 1] - c0[:, 1] + 1
+        counts = ncx * ncy
+        eles = np.repeat(np.arange(len(lows)), counts)
+        k = np.arange(len(eles)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (c0[eles, 0] + k % ncx[eles]) * self.n_cells[1] + c0[eles, 1] + k // ncx[eles]
+        order = np.argsort(cells, kind='stable')
+        self.cell_ptr = np.searchsorted(cells[order], np.arange(self.n_cells[0] * self.n_cells[1] + 1))
+        self.cell_eles = eles[order].astype(np.int64)
+
+    def get_candidates(self, points):
+        """
+        Elements in the bucket of each point
+
+        Returns
+        -------
+        point_inds: np.ndarray
+            Index of the point of each candidate
+        ele_inds: np.ndarray
+            Element index of each candidate, sorted by element index for each point
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cxy = np.floor((points - self.origin) / self.cell_size)
+        inside = np.all((cxy >= 0) & (cxy < self.n_cells), axis=1)
+        cells = np.where(inside, cxy[:, 0] * self.n_cells[1] + cxy[:, 1], 0).astype(np.int64)
+        starts = self.cell_ptr[cells]
+        counts = np.where(inside, self.cell_ptr[cells + 1] - starts, 0)
+        point_inds = np.repeat(np.arange(len(points)), counts)
+        k = np.arange(len(point_inds)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return point_inds, self.cell_eles[starts[point_inds] + k]
+
+    def locate(self, points, tol=1e-8):
+        """
+        Element that contains each point and the natural coordinates of the point in the element
+
+        Points on shared edges are assigned to the element with the lowest index.
+
+        Parameters
+        ----------
+        points: array_like
+            Coordinates - size=(n, 2)
+        tol: float
+            Tolerance on the natural coordinates for points on the edges of elements
+
+        Returns
+        -------
+        ele_inds: np.ndarray
+            Index of the containing element, -1 if the point is outside of all elements
+        xi: np.ndarray
+            Natural x-coordinate in the element (nan if outside)
+        eta: np.ndarray
+            Natural y-coordinate in the element (nan if outside)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        point_inds, ele_inds = self.get_candidates(points)
+        # only elements whose bounding box contains the point
+        pad = tol * self.cell_size
+        in_box = np.all((points[point_inds] >= self.lows[ele_inds] - pad) &
+                        (points[point_inds] <= self.highs[ele_inds] + pad), axis=1)
+        point_inds = point_inds[in_box]
+        ele_inds = ele_inds[in_box]
+        xis, etas = get_quad_natural_coords(self.ele_coords[ele_inds], points[point_inds])
+        inside = (np.abs(xis) <= 1 + tol) & (np.abs(etas) <= 1 + tol)
+        found, first = np.unique(point_inds[inside], return_index=True)
+        eles = np.full(len(points), -1, dtype=np.int64)
+        xi = np.full(len(points), np.nan)
+        eta = np.full(len(points), np.nan)
+        eles[found] = ele_inds[inside][first]
+        xi[found] = np.clip(xis[inside][first], -1, 1)
+        eta[found] = np.clip(etas[inside][first], -1, 1)
+        return eles, xi, eta
+
+
+def get_nodal_loads(femesh, loads, coords=None, tol=1e-8):
+    """
+    Distributes point loads and moments to the nodes of the elements that contain them
+
+    Forces are distributed with the shape functions of the element, a moment `m` (counter-clockwise) is applied
+    as the nodal forces `f_x = -m / 2 * dN/dy` and `f_y = m / 2 * dN/dx`, which have a resultant moment of `m`
+    about the load point and no resultant force.
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    loads: list of LoadAtCoords or array_like
+        `LoadAtCoords` objects (using x, y, p_x, p_y and t_zz, unset values are taken as zero),
+        or if `coords` is set, an array of [p_x, p_y] or [p_x, p_y, t_zz] - size=(n_loads, 2 or 3)
+    coords: array_like
+        Coordinates of the loads - size=(n_loads, 2)
+    tol: float
+        Tolerance on the natural coordinates for loads on the edges of elements
+
+    Returns
+    -------
+    np.ndarray
+        Nodal forces in the x and y directions - size=(n_nodes, 2)
+    """
+    if coords is None:
+        coords = np.array([[ld.x, ld.y] for ld in loads], dtype=float).reshape(-1, 2)
+        vals = np.array([[ld.p_x, ld.p_y, ld.t_zz] for ld in loads], dtype=float).reshape(-1, 3)
+        vals = np.where(np.isnan(vals), 0.0, vals)
+    else:
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        vals = np.asarray(loads, dtype=float).reshape(len(coords), -1)
+        if vals.shape[1] == 2:
+            vals = np.column_stack([vals, np.zeros(len(vals))])
+        if vals.shape[1] != 3:
+            raise ValueError(f'loads must have 2 or 3 columns, shape={vals.shape}')
+    ele_ids, xi, eta = femesh.locate_points(coords, tol=tol)
+    if np.any(ele_ids < 0):
+        outside = np.nonzero(ele_ids < 0)[0]
+        raise ValueError(f'{len(outside)} loads are outside of the active elements, e.g. at {coords[outside[0]]}')
+    conn = femesh.get_connectivity()[ele_ids]
+    n = get_quad_shape_functions(xi, eta)[0]
+    fx = n * vals[:, :1]
+    fy = n * vals[:, 1:2]
+    has_moment = vals[:, 2] != 0
+    if np.any(has_moment):
+        ele_coords = femesh.get_node_coords()[conn[has_moment]]
+        dn_dx, dn_dy = get_quad_shape_function_gradients(ele_coords, xi[has_moment], eta[has_moment])
+        half_m = vals[has_moment, 2:3] / 2
+        fx[has_moment] -= half_m * dn_dy
+        fy[has_moment] += half_m * dn_dx
+    nodal = np.empty((femesh.n_nodes, 2))
+    nodal[:, 0] = np.bincount(conn.ravel(), weights=fx.ravel(), minlength=femesh.n_nodes)
+    nodal[:, 1] = np.bincount(conn.ravel(), weights=fy.ravel(), minlength=femesh.n_nodes)
+    return nodal
+
+
+def get_surface_coords(femesh, exclude_fd=False):
+    """
+    Coordinates of the top edges of the highest active element of each column of a mesh
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    exclude_fd: bool
+        if True then the columns under a foundation (see `fd_ele_boxes`) are skipped
+
+    Returns
+    -------
+    xs: np.ndarray
+        x-coordinates of the left and right corners of each top edge, ordered from left to right
+    ys: np.ndarray
+        y-coordinates of the left and right corners of each top edge
+    """
+    cols = femesh.get_ele_grid_indexes()[:, 0]
+    # elements are numbered from top to bottom within each column
+    tops = np.nonzero(np.diff(cols, prepend=-1) != 0)[0]
+    if exclude_fd:
+        in_fd = np.zeros(len(tops), dtype=bool)
+        for xsi, xei, ysi, yei in femesh.fd_ele_boxes:
+            in_fd |= (cols[tops] >= xsi) & (cols[tops] < xei)
+        tops = tops[~in_fd]
+    conn = femesh.get_connectivity()[tops]
+    coords = femesh.get_node_coords()
+    xs = np.column_stack([coords[conn[:, 3], 0], coords[conn[:, 2], 0]]).ravel()
+    ys = np.column_stack([coords[conn[:, 3], 1], coords[conn[:, 2], 1]]).ravel()
+    return xs, ys
+
+
+def get_surface_y(femesh, x):
+    """
+    y-coordinate of the top of the active elements of a mesh
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    x: array_like
+        x-coordinates
+
+    Returns
+    -------
+    np.ndarray
+        Linear interpolation along the top edges of the highest active element of each column
+    """
+    xs, ys = get_surface_coords(femesh)
+    return np.interp(x, xs, ys)
+
+
+def get_sensor_mesh_locations(si, femesh, wild_sensor_code=None, coords='auto', surface=None):
+    """
+    Locates the sensors of a sensor index in a mesh
+
+    The depth of each sensor is computed from its y-coordinate as in `sensors.get_depth_by_code`, and is measured
+    down from the top of the mesh at the x-coordinate of the sensor.
+
+    Parameters
+    ----------
+    si: dict
+        Sensor index json dictionary (see `sensors.read_json_sensor_file`)
+    femesh: FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh or RaggedVary2DMesh
+        The mesh
+    wild_sensor_code: str
+        Only sensors that match this code (e.g. ACCX-*-L2C-*), if None then all sensors
+    coords: str
+        Coordinate system of the sensor y-coordinates: 'auto', '+ve', '-ve' or 'rev+ve'
+    surface: float
+        Height of the surface in the sensor coordinates (see `sensors.get_depth_by_code`)
+
+    Returns
+    -------
+    dict
+        'sensor_codes': list of str,
+        'coords': mesh x and y coordinates - size=(n_sensors, 2),
+        'ele_ids': natural id of the containing element (-1 if outside of the active elements),
+        'ele_node_ids': node ids of the containing element - size=(n_sensors, 4) (-1 if outside),
+        'weights': shape function weights of the element nodes - size=(n_sensors, 4) (nan if outside),
+        'node_ids': natural id of the nearest node
+    """
+    if wild_sensor_code is None:
+        wild_sensor_code = '*-*-*-*'
+    numbers = sensors.get_all_sensor_numbers(si, wild_sensor_code)
+    codes = [sensors.get_sensor_code_by_number(si, mtype, m_number) for mtype, m_number in numbers]
+    xs = np.array([si[mtype][m_number]['x'] for mtype, m_number in numbers], dtype=float)
+    ys = np.array([si[mtype][m_number]['y'] for mtype, m_number in numbers], dtype=float)
+    depths = sensors.convert_y_to_depth(si, ys, coords=coords, surface=surface)
+    pts = np.column_stack([xs, get_surface_y(femesh, xs) - depths]) if len(xs) else np.zeros((0, 2))
+
+    ele_ids, xi, eta = femesh.locate_points(pts)
+    inside = ele_ids >= 0
+    ele_node_ids = np.full((len(pts), 4), -1, dtype=np.int64)
+    ele_node_ids[inside] = femesh.get_connectivity()[ele_ids[inside]]
+    weights = np.full((len(pts), 4), np.nan)
+    weights[inside] = get_quad_shape_functions(xi[inside], eta[inside])[0]
+    node_ids = np.full(len(pts), -1, dtype=np.int64)
+    node_ids[inside] = ele_node_ids[inside, np.argmax(weights[inside], axis=1)]
+    if not np.all(inside):  # few sensors, so a full search of the nodes is acceptable
+        node_coords = femesh.get_node_coords()
+        dists = np.linalg.norm(pts[~inside, np.newaxis] - node_coords[np.newaxis], axis=2)
+        node_ids[~inside] = np.argmin(dists, axis=1)
+    return {
+        'sensor_codes': codes,
+        'coords': pts,
+        'ele_ids': ele_ids,
+        'ele_node_ids': ele_node_ids,
+        'weights': weights,
+        'node_ids': node_ids,
+    }
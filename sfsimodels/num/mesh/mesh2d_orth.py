@@ -1,7 +1,8 @@
 import numpy as np
 
 from sfsimodels.models.systems import TwoDSystem
-from sfsimodels.functions import interp_left
+from sfsimodels.functions import interp_left, get_graded_positions
+from sfsimodels.num.mesh import cache
 
 
 class FiniteElementOrth2DMesh(object):
@@ -151,78 +152,64 @@ class FiniteElementOrth2DMeshConstructor(object):
 
     def get_actual_lims(self):
         """Find the x and y coordinates that should be maintained in the FE mesh"""
-        x_act = [0]
-        y_flat = []
-        fd_coords = []
-        for i in range(len(self.tds.bds)):
-            x_bd = self.tds.x_bds[i]
-            bd = self.tds.bds[i]
-            lip = getattr(bd.fd, bd.fd.ip_axis)
-            fd_centre_x = x_bd + bd.x_fd
-            if lip > self.dy_target:
-                fd_coords.append(fd_centre_x)
-            fd_coords.append(fd_centre_x - lip / 2)
-            fd_coords.append(fd_centre_x + lip / 2)
-        fd_coords = np.array(fd_coords)
+        bds = self.tds.bds
+        fd_centres = np.array([self.tds.x_bds[i] + bd.x_fd for i, bd in enumerate(bds)], dtype=float)
+        lips = np.array([getattr(bd.fd, bd.fd.ip_axis) for bd in bds], dtype=float)
+        fd_widths = np.array([bd.fd.width for bd in bds], dtype=float)
+        fd_depths = np.array([bd.fd.depth for bd in bds], dtype=float)
+        fd_coords = np.concatenate([fd_centres[lips > self.dy_target], fd_centres - lips / 2, fd_centres + lips / 2])
+        x_fd_lhs = fd_centres - fd_widths / 2
+        x_fd_rhs = fd_centres + fd_widths / 2
+        y_fd_bases = np.interp(fd_centres, self.tds.x_surf, self.tds.y_surf) - fd_depths
+
+        # important x-coordinates between each pair of soil profiles
+        x_currs = []
         for i in range(len(self.tds.sps)):
-            int_yy = [self.tds.sps[i].layer_depth(yy) for yy in range(1, self.tds.sps[i].n_layers + 1)]
-            int_yy.append(self.tds.sps[i].height)
-
-            # generate x_curr which stores important x-coordinates that are between two soil profiles
-            inds = np.where((self.tds.x_surf < self.xs[i + 1]) & (self.tds.x_surf >= self.xs[i]))
-            x_sf_curr = self.tds.x_surf[inds]
-            fd_inds = np.where((fd_coords < self.xs[i + 1]) & (fd_coords >= self.xs[i]))
-            x_fd_curr = fd_coords[fd_inds]
+            x_sf_curr = self.tds.x_surf[(self.tds.x_surf < self.xs[i + 1]) & (self.tds.x_surf >= self.xs[i])]
+            x_fd_curr = fd_coords[(fd_coords < self.xs[i + 1]) & (fd_coords >= self.xs[i])]
             x_curr = np.concatenate([x_sf_curr, x_fd_curr])
             x_curr.sort()
-
             if self.xs[i] not in x_curr:
                 x_curr = np.insert(x_curr, 0, self.xs[i])
             if self.xs[i + 1] not in x_curr:
                 x_curr = np.insert(x_curr, len(x_curr), self.xs[i + 1])
+            x_currs.append(x_curr)
+        # surface y-coordinates at the important x-coordinates of all profiles
+        y_surfs = np.split(np.interp(np.concatenate(x_currs), self.tds.x_surf, self.tds.y_surf),
+                           np.cumsum([len(x_curr) for x_curr in x_currs])[:-1])
 
-            for bb in range(len(self.tds.bds)):
-                x_bd = self.tds.x_bds[bb]
-                bd = self.tds.bds[bb]
-                fd = bd.fd
-                x_lhs = x_bd + bd.x_fd - fd.width / 2
-                x_rhs = x_bd + bd.x_fd + fd.width / 2
-                y_base_foundation = np.interp(x_bd + bd.x_fd, self.tds.x_surf, self.tds.y_surf) - fd.depth
-                if self.xs[i] < x_lhs < self.xs[i + 1]:
-                    y_flat.append(y_base_foundation)
-                elif self.xs[i] < x_rhs < self.xs[i + 1]:
-                    y_flat.append(y_base_foundation)
-
-            # Surface
-            y_curr_surf = np.interp(x_curr, self.tds.x_surf, self.tds.y_surf)  # array of y-pos at important x for each layer
-            x_diffs = x_curr - x_curr[0]
+        x_act = [0]
+        y_flat = []
+        for i in range(len(self.tds.sps)):
+            sp = self.tds.sps[i]
+            x_curr = x_currs[i]
+            # foundation base if either edge of the foundation is within the profile
+            in_sp = ((self.xs[i] < x_fd_lhs) & (x_fd_lhs < self.xs[i + 1])) | \
+                    ((self.xs[i] < x_fd_rhs) & (x_fd_rhs < self.xs[i + 1]))
+            y_flat.append(y_fd_bases[in_sp])
             x_act += list(x_curr[1:])
-
-            x_temp = list(x_curr)  # UNUSED
-            if i != 0:
-                x_temp[0] += 1.0e-14
-
-            for x in range(len(x_curr)):
-                y_flat.append(y_curr_surf[x])
-            for yy in range(len(int_yy) - 1):
-                y1_curr = self.y_surf_at_sps[i] - int_yy[yy + 1]
-                y_curr = y1_curr + self.tds.sps[i].x_angles[yy] * x_diffs
-                y_curr = np.clip(y_curr, -self.tds.height, None)
-                y_flat += list(y_curr)
+            y_flat.append(y_surfs[i])
+            # layer boundaries
+            depths = np.array([sp.layer_depth(yy) for yy in range(2, sp.n_layers + 1)] + [sp.height], dtype=float)
+            x_angles = np.array(sp.x_angles[:len(depths)], dtype=float)
+            y_curr = (self.y_surf_at_sps[i] - depths)[:, np.newaxis] + x_angles[:, np.newaxis] * (x_curr - x_curr[0])
+            y_flat.append(np.clip(y_curr, -self.tds.height, None).ravel())
         self.x_act = x_act
-        self.y_flat = y_flat
+        self.y_flat = np.concatenate(y_flat)
 
     def set_y_nodes(self):
         """Determine the optimal position of node y-coordinates"""
-        y_flat = np.array(list(set(self.y_flat)))
-        min_y = -1e10
+        y_flat = np.unique(self.y_flat)  # sorted
+        y_max = max(self.tds.y_surf)
+        # sweep up from the lowest level, each level is the average of the coordinates within dy_target of its lowest
         layers = []  # builds from lowest first
-        while min_y < max(self.tds.y_surf):
-            min_y = min(y_flat)
-            inds = np.where(y_flat < min_y + self.dy_target)
-            layer = np.mean(y_flat[inds])
-            y_flat[inds] = 1000
-            layers.append(layer)
+        i = 0
+        while i < len(y_flat):
+            j = np.searchsorted(y_flat, y_flat[i] + self.dy_target, side='left')
+            layers.append(np.mean(y_flat[i:j]))
+            if y_flat[i] >= y_max:
+                break
+            i = j
         dys = []
         for i in range(1, len(layers)):
             dy_lay = layers[i] - layers[i - 1]
@@ -231,31 +218,16 @@ class FiniteElementOrth2DMeshConstructor(object):
             dy_ele = dy_lay / n_eles
             dys += ([dy_ele] * n_eles)
         dys.append(0)
-        self.y_nodes = max(self.tds.y_surf) - np.cumsum(dys[::-1])
+        self.y_nodes = y_max - np.cumsum(dys[::-1])
 
     def set_x_nodes(self):
         """Determine optimal position of node x-coordinates"""
-        dxs = [0]
-        for xx in range(1, len(self.x_act)):
-            x_shift = self.x_act[xx] - self.x_act[xx - 1]
-            x_incs = np.linspace(self.x_act[xx - 1], self.x_act[xx], 20)
-            scale = interp_left(x_incs, self.x_scale_pos, self.x_scale_vals)
-            av_scale = np.mean(scale)
-            av_size = av_scale * self.dy_target
-            n_x_eles = int(x_shift / av_size + 0.99)
-            x_start = self.x_act[xx - 1]
-            x_incs = []
-            for n in range(n_x_eles):
-                prox_x_inc = interp_left([x_start], self.x_scale_pos, self.x_scale_vals)[0] * self.dy_target
-                x_temp_points = np.linspace(x_start, x_start + prox_x_inc, 5)
-                curr_scale = np.mean(interp_left(x_temp_points, self.x_scale_pos, self.x_scale_vals))
-                x_inc = curr_scale * self.dy_target
-                x_incs.append(x_inc)
-                x_start += x_inc
-            x_incs = np.array(x_incs) * x_shift / sum(x_incs)
-            dxs += list(x_incs)
-
-        self.x_nodes = np.cumsum(dxs)
+        x_act = np.unique(self.x_act)  # a foundation edge can coincide with a surface coordinate
+        # number of elements between the required x-coordinates, based on the average scale of each zone
+        x_incs = np.linspace(x_act[:-1], x_act[1:], 20, axis=1)
+        av_scale = np.mean(interp_left(x_incs, self.x_scale_pos, self.x_scale_vals), axis=1)
+        n_x_eles = (np.diff(x_act) / (av_scale * self.dy_target) + 0.99).astype(int)
+        self.x_nodes = get_graded_positions(x_act, n_x_eles, self.x_scale_pos, self.x_scale_vals)
 
     def set_to_decimal_places(self):
         """Adjusts the node coordinates to a certain number of decimal places"""
@@ -270,27 +242,25 @@ class FiniteElementOrth2DMeshConstructor(object):
         self.soil_grid = np.zeros((len(x_centres), len(y_centres)), dtype=int)
         self.x_index_to_sp_index = interp_left(x_centres, self.tds.x_sps, np.arange(0, len(self.tds.x_sps)))
         self.x_index_to_sp_index = np.array(self.x_index_to_sp_index, dtype=int)
-        for xx in range(len(self.soil_grid)):
-            for yy in range(len(self.soil_grid[0])):
-                pid = self.x_index_to_sp_index[xx]
-                sp = self.tds.sps[pid]
-                if y_centres[yy] > surf_centres[xx]:
-                    self.soil_grid[xx][yy] = self._inactive_value
-                    continue
-                x_angles = [10] + list(sp.x_angles)
-                sp_x = self.tds.x_sps[pid]
-                for ll in range(1, sp.n_layers + 1):
-                    if -y_centres[yy] > (
-                            sp.layer_depth(ll) - x_angles[ll - 1] * (x_centres[xx] - sp_x) - self.y_surf_at_sps[pid]):
-                        pass
-                    else:
-                        unique_hash = sp.layer(ll - 1).unique_hash
-                        self.soil_grid[xx][yy] = self._soil_hashes.index(unique_hash)
-                        break
-                    if ll == sp.n_layers:
-                        unique_hash = sp.layer(ll).unique_hash
-                        self.soil_grid[xx][yy] = self._soil_hashes.index(unique_hash)
-                        break
+        inactive = y_centres[np.newaxis, :] > surf_centres[:, np.newaxis]
+        for pid, sp in enumerate(self.tds.sps):
+            xinds = np.where(self.x_index_to_sp_index == pid)[0]
+            if not len(xinds):
+                continue
+            x_angles = np.array([10] + list(sp.x_angles)[:sp.n_layers - 1], dtype=float)
+            depths = np.array([sp.layer_depth(ll) for ll in range(1, sp.n_layers + 1)], dtype=float)
+            # depth of the top of each layer at each column, size=(n_layers, len(xinds))
+            y_tops = depths[:, np.newaxis] - x_angles[:, np.newaxis] * (x_centres[xinds] - self.tds.x_sps[pid]) \
+                - self.y_surf_at_sps[pid]
+            below = -y_centres[np.newaxis, np.newaxis, :] > y_tops[:, :, np.newaxis]
+            # element is in the layer above the first layer top that it is not below, else in the last layer
+            layer_ints = np.where(below.all(axis=0), sp.n_layers, np.argmin(below, axis=0))
+            if np.any((layer_ints == 0) & ~inactive[xinds]):
+                sp.layer(0)  # raises the same error as a layer look up above the first layer
+            layer_soil_ids = np.array([0] + [self._soil_hashes.index(sp.layer(ll).unique_hash)
+                                             for ll in range(1, sp.n_layers + 1)])
+            self.soil_grid[xinds] = layer_soil_ids[layer_ints]
+        self.soil_grid[inactive] = self._inactive_value
 
     def get_active_nodes(self):
         # active_nodes = np.ones((len(self.x_nodes), len(self.y_nodes)), dtype=int)  # Start with all active
@@ -358,10 +328,45 @@ class FiniteElementOrth2DMeshConstructor(object):
                     self.femesh.soil_grid[xx][yy] = self.femesh.inactive_value
 
 
-def construct_femesh_orth(tds, dy_target, x_scale_pos=None, x_scale_vals=None):
+def construct_femesh_orth(tds, dy_target, x_scale_pos=None, x_scale_vals=None, cache_dir=None, cache_max_size=None):
+    """
+    Builds an orthogonal mesh
+
+    Parameters
+    ----------
+    tds: TwoDSystem
+        A two dimensional system of models
+    dy_target: float
+        Target height of elements
+    x_scale_pos: array_like
+        x-positions used to provide scale factors for element widths
+    x_scale_vals: array_like
+        scale factors for element widths
+    cache_dir: str
+        if not None then meshes are stored in (and loaded from) this directory, keyed by a hash of the system
+        and the inputs, see `sfsimodels.num.mesh.cache.MeshCache`
+    cache_max_size: int
+        Maximum size of the cache directory in bytes, the least recently used meshes are removed first
+
+    Returns
+    -------
+    FiniteElementOrth2DMesh
+    """
+    if cache_dir is not None:
+        mesh_cache = cache.MeshCache(cache_dir, max_size=cache_max_size)
+        key = cache.get_mesh_key(tds, 'orth2d', dy_target=dy_target, x_scale_pos=x_scale_pos,
+                                 x_scale_vals=x_scale_vals)
+        arrays = mesh_cache.load(key)
+        if arrays is not None:
+            return FiniteElementOrth2DMesh(arrays['x_nodes'], arrays['y_nodes'], arrays['soil_grid'],
+                                           cache.get_system_soils(tds)[0],
+                                           inactive_value=float(arrays['inactive_value']))
     fc = FiniteElementOrth2DMeshConstructor(tds, dy_target, x_scale_pos=x_scale_pos, x_scale_vals=x_scale_vals)
     femesh = fc.femesh
     assert isinstance(femesh, FiniteElementOrth2DMesh)
+    if cache_dir is not None:
+        mesh_cache.save(key, x_nodes=np.asarray(femesh.x_nodes), y_nodes=np.asarray(femesh.y_nodes),
+                        soil_grid=np.asarray(femesh.soil_grid), inactive_value=femesh.inactive_value)
     return femesh
 
 
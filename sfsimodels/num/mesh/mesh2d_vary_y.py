@@ -1,7 +1,11 @@
+from collections import OrderedDict
+import copy
+import time
 import numpy as np
 from sfsimodels.models.abstract_models import PhysicalObject
 from sfsimodels.models.systems import TwoDSystem
-from sfsimodels.functions import interp_left, interp2d, interp3d
+from sfsimodels.functions import interp_left, interp2d, interp3d, get_stretched_coords, get_graded_positions
+from sfsimodels.num.mesh import partition, cache, ragged, active
 
 
 def remove_close_items(y, tol):
@@ -32,13 +36,27 @@ def adjust_slope_points_for_removals(sds, x, removed_y, retained_y):
                 sd[1][i] = retained_y
 
 
+def _get_size(value):
+    """Size of a stage output, shape for arrays, number of values for a dict of arrays, else the length"""
+    if value is None:
+        return None
+    if isinstance(value, np.ndarray):
+        return value.shape
+    if isinstance(value, dict):
+        return int(sum([np.size(value[key]) for key in value]))
+    if hasattr(value, '__len__'):
+        return len(value)
+    return None
+
+
 class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine2DMesh
     _soils = None
     x_index_to_sp_index = None
     _inactive_value = 1000000
 
     def __init__(self, tds, dy_target, x_scale_pos=None, x_scale_vals=None, dp: int = None, fd_eles=0, auto_run=True,
-                 use_3d_interp=False, smooth_surf=False, force_x2d=False):
+                 use_3d_interp=False, smooth_surf=False, force_x2d=False, freq_max=None, n_eles_per_wavelength=10,
+                 record_stats=False, memoize=False, fd_dh=None, fd_growth=1.2):
         """
         Builds a finite element mesh of a two-dimension system
 
@@ -58,13 +76,38 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
             if =0 then elements corresponding to the foundation are removed, else provide element id
         smooth_surf: bool
             if true then changes in angle of the slope must be less than 90 degrees, builds VaryXY mesh
+        freq_max: float
+            if not None then the target element height varies with the shear wave velocity so that
+            `n_eles_per_wavelength` elements fit in the wavelength at `freq_max`, bounded between
+            `min_scale * dy_target` and `max_scale * dy_target`
+        n_eles_per_wavelength: int
+            Number of elements per shear wavelength (only used if `freq_max` is not None)
+        record_stats: bool
+            if true then the wall time, iteration counts and output sizes of each stage are recorded,
+            see `get_stage_report`
+        memoize: bool
+            if true then the inputs and outputs of each stage are stored, so that `rebuild` only recomputes the
+            stages affected by a change to the system, and within those stages only the special vertical lines and
+            element columns whose inputs changed
+        fd_dh: float
+            if not None then the elements near the foundations are refined, element widths and heights are `fd_dh`
+            at the foundation and grow by a factor of `fd_growth` per element away from the foundation up to
+            `dy_target` (see `get_fd_dh`)
+        fd_growth: float
+            Ratio of the size of neighbouring elements in the refined zone (only used if `fd_dh` is not None)
         """
         self.min_scale = 0.5
         self.max_scale = 2.0
         self.allowable_slope = 0.25
         assert isinstance(tds, TwoDSystem)
-        self.tds = tds
         self.dy_target = dy_target
+        self.freq_max = freq_max
+        self.n_eles_per_wavelength = n_eles_per_wavelength
+        if fd_dh is not None and (fd_growth <= 1 or fd_dh <= 0):
+            raise ValueError(f'fd_dh must be positive and fd_growth greater than one, fd_dh={fd_dh}, '
+                             f'fd_growth={fd_growth}')
+        self.fd_dh = fd_dh
+        self.fd_growth = fd_growth
         if x_scale_pos is None:
             x_scale_pos = [0, tds.width]
         if x_scale_vals is None:
@@ -72,9 +115,29 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         self.x_scale_pos = np.array(x_scale_pos)
         self.x_scale_vals = np.array(x_scale_vals)
         self.dp = dp
-        self.xs = list(self.tds.x_sps)
+        self.fd_eles = fd_eles
+        self.use_3d_interp = use_3d_interp
         self.smooth_surf = smooth_surf
+        self.force_x2d = force_x2d
+        self.set_system(tds)
+        self.record_stats = record_stats
+        self.memoize = memoize
+        self._stage_memo = {}
+        self._part_memo = {}
+        self._prev_part_memo = {}
+        self.reused_stages = []
+        self.reused_parts = {}
+        self.stage_counts = {}
+        self.stage_report = []
 
+        if auto_run:
+            self.run()
+
+    def set_system(self, tds):
+        """Sets the two-dimensional system and clears the outputs of all stages"""
+        assert isinstance(tds, TwoDSystem)
+        self.tds = tds
+        self.xs = list(self.tds.x_sps)
         self.xs.append(tds.width)
         self.xs = np.array(self.xs)
         inds = np.where(np.array(tds.x_surf) <= tds.width)
@@ -91,43 +154,213 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
                 if sl.unique_hash not in self._soil_hashes:
                     self._soil_hashes.append(sl.unique_hash)
                     self._soils.append(sl)
+        self._system_dict = None
 
         self.y_surf_at_xcs = None
         self.yd = None
         self.xcs_sorted = None
         self.sds = None
         self.y_blocks = None
+        self.dh_targets = None
+        self.slope_constraints = None
+        self.dh_constraints = None
         self.y_coords_at_xcs = None
         self.x_nodes = None
         self.y_nodes = None
         self.x_nodes2d = None
         self._femesh = None
 
-        if auto_run:
-            self.get_special_coords_and_slopes()  # Step 1
-            self.set_init_y_blocks()
-            self.adjust_blocks_to_be_consistent_with_slopes()
-            self.trim_grid_to_target_dh()
-            self.build_req_y_node_positions()
-            self.set_x_nodes()
+    def run(self):
+        """Runs all stages of the mesh construction"""
+        self.reused_stages = []
+        self.reused_parts = {}
+        self._prev_part_memo = self._part_memo
+        self._part_memo = {}
+        self.stage_report = []
+        self.run_stage(self.get_special_coords_and_slopes)  # Step 1
+        self.run_stage(self.set_init_y_blocks)
+        self.run_stage(self.adjust_blocks_to_be_consistent_with_slopes)
+        self.run_stage(self.trim_grid_to_target_dh)
+        self.run_stage(self.build_req_y_node_positions)
+        self.run_stage(self.set_x_nodes)
+
+        if self.use_3d_interp:
+            self.run_stage(self.build_y_coords_grid_via_3d_interp)
+        else:
+            self.run_stage(self.build_y_coords_grid_via_propagation)
+        if self.dp is not None:
+            self.run_stage(self.set_to_decimal_places)
+        if self.smooth_surf:
+            self.run_stage(self.adjust_for_smooth_surface)
+            self.run_stage(self.set_soil_ids_to_vary_xy_grid)
+        elif self.force_x2d:
+            self.run_stage(self.set_x_nodes2d_from_x_nodes)
+            self.run_stage(self.set_soil_ids_to_vary_xy_grid)
+        else:
+            self.run_stage(self.set_soil_ids_to_vary_y_grid)
+        self.run_stage(self.create_mesh)
+        if not self.fd_eles:
+            self.run_stage(self.exclude_fd_eles)
 
-            if use_3d_interp:
-                self.build_y_coords_grid_via_3d_interp()
-            else:
-                self.build_y_coords_grid_via_propagation()
-            if self.dp is not None:
-                self.set_to_decimal_places()
-            if smooth_surf:
-                self.adjust_for_smooth_surface()
-                self.set_soil_ids_to_vary_xy_grid()
-            elif force_x2d:
-                self.x_nodes2d = self.x_nodes[:, np.newaxis] * np.ones_like(self.y_nodes)
-                self.set_soil_ids_to_vary_xy_grid()
+    def rebuild(self, tds=None):
+        """
+        Rebuilds the mesh after the system has been modified
+
+        If `memoize` is true, then stages whose inputs are unchanged since the last run are not recomputed,
+        the stored outputs are used instead (see `reused_stages`). Within the stages that are recomputed, the
+        block counts and y-coordinates of the special vertical lines and the soil ids of the element columns are
+        reused where the values they depend on are unchanged (see `reused_parts`). As the lines share the number
+        of elements and the y-coordinates are propagated from left to right, an edit can still change the lines
+        on either side of it, in which case they are recomputed.
+
+        Parameters
+        ----------
+        tds: TwoDSystem
+            if not None then replaces the current system
+        """
+        if tds is None:
+            tds = self.tds
+        self.set_system(tds)
+        self.run()
+        return self.femesh
+
+    # attributes that are set by each stage, used to report the size of the stage outputs and by `rebuild`
+    _stage_outputs = {
+        'get_special_coords_and_slopes': ['yd', 'xcs_sorted', 'sds', 'y_surf_at_xcs'],
+        'set_init_y_blocks': ['y_blocks', 'dh_targets'],
+        'adjust_blocks_to_be_consistent_with_slopes': ['y_blocks', 'slope_constraints'],
+        'trim_grid_to_target_dh': ['y_blocks', 'dh_constraints'],
+        'build_req_y_node_positions': ['req_y_nodes', 'req_y_coords_at_xcs'],
+        'set_x_nodes': ['x_nodes'],
+        'build_y_coords_grid_via_3d_interp': ['y_nodes'],
+        'build_y_coords_grid_via_propagation': ['y_coords_at_xcs', 'y_nodes'],
+        'set_to_decimal_places': ['x_nodes', 'y_nodes'],
+        'adjust_for_smooth_surface': ['x_nodes2d'],
+        'set_x_nodes2d_from_x_nodes': ['x_nodes2d'],
+        'set_soil_ids_to_vary_y_grid': ['soil_grid', 'y_centres', 'x_index_to_sp_index'],
+        'set_soil_ids_to_vary_xy_grid': ['soil_grid', 'y_centres', 'x_index_to_sp_index'],
+        'create_mesh': [],
+        'exclude_fd_eles': ['soil_grid', 'fd_ele_boxes'],
+    }
+
+    # inputs of each stage that can be reused by `rebuild`, 'geometry' and 'soil_props' refer to parts of the system,
+    # 'soil_props' is every input of the shear wave velocity (the soils and the water level of each profile)
+    _stage_inputs = {
+        'get_special_coords_and_slopes': ['geometry', 'x_surf', 'y_surf', 'dy_target', 'min_scale', 'fd_dh',
+                                          'fd_growth'],
+        'set_init_y_blocks': ['geometry', 'soil_props', 'yd', 'xcs_sorted', 'y_surf_at_sps', 'dy_target', 'freq_max',
+                              'n_eles_per_wavelength', 'min_scale', 'max_scale', 'fd_dh', 'fd_growth'],
+        'adjust_blocks_to_be_consistent_with_slopes': ['y_blocks', 'yd', 'sds', 'dy_target', 'min_scale',
+                                                       'max_scale', 'allowable_slope'],
+        'trim_grid_to_target_dh': ['y_blocks', 'yd', 'xcs_sorted', 'dh_targets', 'dy_target', 'freq_max',
+                                   'min_scale', 'max_scale', 'fd_dh'],
+        'build_req_y_node_positions': ['y_blocks', 'yd', 'xcs_sorted', 'sds', 'dy_target', 'min_scale', 'max_scale'],
+        'set_x_nodes': ['geometry', 'x_surf', 'y_surf', 'xcs_sorted', 'x_scale_pos', 'x_scale_vals', 'dy_target',
+                        'fd_dh', 'fd_growth'],
+        'build_y_coords_grid_via_3d_interp': ['x_nodes', 'xcs_sorted', 'req_y_nodes', 'req_y_coords_at_xcs'],
+        'build_y_coords_grid_via_propagation': ['x_nodes', 'xcs_sorted', 'req_y_nodes', 'req_y_coords_at_xcs',
+                                                'y_surf_at_xcs'],
+        'set_to_decimal_places': ['x_nodes', 'y_nodes', 'dp'],
+        'adjust_for_smooth_surface': ['geometry', 'x_nodes', 'y_nodes', 'x_surf', 'y_surf', 'xcs_sorted'],
+        'set_x_nodes2d_from_x_nodes': ['x_nodes', 'y_nodes'],
+        'set_soil_ids_to_vary_y_grid': ['geometry', 'x_nodes', 'y_nodes', 'y_surf_at_sps'],
+        'set_soil_ids_to_vary_xy_grid': ['geometry', 'x_nodes2d', 'y_nodes', 'x_surf', 'y_surf', 'y_surf_at_sps'],
+    }
+
+    def _get_stage_signature(self, name):
+        """Hash of the current values of the inputs of a stage"""
+        if self._system_dict is None:
+            self._system_dict = cache.get_system_dict(self.tds)
+        values = []
+        for item in self._stage_inputs[name]:
+            if item == 'geometry':
+                geometry = {key: self._system_dict[key] for key in self._system_dict if key not in ['soils', 'sps']}
+                geometry['sps'] = [{key: sp_dict[key] for key in sp_dict if key not in cache.SP_WATER_ATTRS}
+                                   for sp_dict in self._system_dict['sps']]
+                values.append(geometry)
+            elif item == 'soil_props':
+                water = [[sp_dict[key] for key in cache.SP_WATER_ATTRS] for sp_dict in self._system_dict['sps']]
+                values.append([self._system_dict['soils'], water])
             else:
-                self.set_soil_ids_to_vary_y_grid()
-            self.create_mesh()
-            if not fd_eles:
-                self.exclude_fd_eles()
+                values.append(getattr(self, item, None))
+        return cache.get_content_hash(values)
+
+    def run_stage(self, method):
+        """
+        Runs a stage of the mesh construction
+
+        Records the stage statistics if `record_stats` is true. If `memoize` is true and the inputs of the stage
+        are unchanged since the previous run, then the stored outputs are used instead of running the stage.
+        """
+        if not self.record_stats and not self.memoize:
+            return method()
+        name = method.__name__
+        self.stage_counts.pop(name, None)
+        start = time.perf_counter()
+        signature = None
+        reused = False
+        if self.memoize and name in self._stage_inputs:
+            signature = self._get_stage_signature(name)
+            memo = self._stage_memo.get(name)
+            if memo is not None and memo[0] == signature:
+                for attr in memo[1]:
+                    setattr(self, attr, copy.deepcopy(memo[1][attr]))
+                reused = True
+                self.reused_stages.append(name)
+        out = None
+        if not reused:
+            out = method()
+            if signature is not None:
+                outputs = {attr: copy.deepcopy(getattr(self, attr, None)) for attr in self._stage_outputs[name]}
+                self._stage_memo[name] = (signature, outputs)
+        if self.record_stats:
+            stats = OrderedDict()
+            stats['stage'] = name
+            stats['time'] = time.perf_counter() - start
+            stats['reused'] = reused
+            stats['counts'] = dict(self.stage_counts.get(name, {}))
+            stats['sizes'] = OrderedDict()
+            for attr in self._stage_outputs.get(name, []):
+                stats['sizes'][attr] = _get_size(getattr(self, attr, None))
+            self.stage_report.append(stats)
+        return out
+
+    def _get_memo_part(self, stage, key, func):
+        """
+        Result of `func` for a part of a stage (e.g. a special vertical line or a column of elements)
+
+        If `memoize` is true then the result is reused if the same stage and `key` (all values that the result
+        depends on) occurred in the previous or current run, the number of reused parts is stored in `reused_parts`.
+        """
+        if not self.memoize:
+            return func()
+        key = cache.get_content_hash([stage, key])
+        if key in self._part_memo:
+            result = self._part_memo[key]
+        elif key in self._prev_part_memo:
+            result = self._prev_part_memo[key]
+        else:
+            self._part_memo[key] = func()
+            return self._part_memo[key]
+        self._part_memo[key] = result
+        self.reused_parts[stage] = self.reused_parts.get(stage, 0) + 1
+        return result
+
+    def get_stage_report(self):
+        """
+        Statistics of each stage of the mesh construction (requires `record_stats=True`)
+
+        Returns
+        -------
+        list of OrderedDict
+            Each has the `stage` name, wall `time` [s], whether the stored outputs were `reused`,
+            iteration `counts` and `sizes` of the stage outputs
+        """
+        return self.stage_report
+
+    def set_x_nodes2d_from_x_nodes(self):
+        """Sets the 2D x-coordinates of the nodes without any adjustment"""
+        self.x_nodes2d = self.x_nodes[:, np.newaxis] * np.ones_like(self.y_nodes)
 
     def get_special_coords_and_slopes(self):
         """Find the coordinates, layer boundaries and surface slopes that should be maintained in the FE mesh"""
@@ -233,6 +466,18 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
             for pair in pairs:
                 adjust_slope_points_for_removals(sds, x, pair[0], pair[1])
 
+        # levels below the foundation edges with element heights that grow away from the foundation base
+        if self.fd_dh is not None:
+            for x_left, x_right, y_base, y_top in self._get_fd_rects():
+                for x in [x_left, x_right]:
+                    levels = list(yd[x])
+                    for y in y_base - self._get_fd_graded_distances()[1:]:
+                        dh = self.get_fd_dh(x, y)
+                        if y > -self.tds.height + dh * self.min_scale and \
+                                np.min(np.abs(np.array(levels) - y)) > dh * self.min_scale:
+                            levels.append(y)
+                    yd[x] = sorted(levels)
+
         self.y_surf_at_xcs = {}
         for x in yd:
             self.y_surf_at_xcs[x] = yd[x][-1]
@@ -245,13 +490,137 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         self.xcs_sorted = np.array(x_act)
         self.sds = sort_slopes(sds)
 
+    def _get_fd_rects(self):
+        """Left, right, base and top coordinates of each foundation"""
+        rects = []
+        for i, bd in enumerate(self.tds.bds):
+            fcx = self.tds.x_bds[i] + bd.x_fd
+            y_surf = np.interp(fcx, self.x_surf, self.y_surf)
+            rects.append([fcx - bd.fd.width / 2, fcx + bd.fd.width / 2, y_surf - bd.fd.depth, y_surf])
+        return rects
+
+    def _get_fd_graded_distances(self):
+        """Distances from the foundation to the boundaries of the refined elements (see `get_fd_dh`)"""
+        n = 0
+        if self.fd_dh < self.dy_target:
+            n = int(np.ceil(np.log(self.dy_target / self.fd_dh) / np.log(self.fd_growth)))
+        return np.concatenate([[0], np.cumsum(self.fd_dh * self.fd_growth ** np.arange(n))])
+
+    def get_fd_dh(self, x, y=None):
+        """
+        Target element size near the foundations
+
+        The size is `fd_dh` at the foundation and increases linearly with the distance from the foundation so
+        that neighbouring elements differ by a factor of `fd_growth`, up to `dy_target`. Equal to `dy_target`
+        if `fd_dh` is None.
+
+        Parameters
+        ----------
+        x: float or array_like
+            x-positions
+        y: float or array_like
+            if None then the horizontal distance to the nearest foundation edge is used (element widths),
+            else the distance to the sides and base of the nearest foundation (element heights)
+        """
+        x = np.asarray(x, dtype=float)
+        dh = np.full(np.broadcast(x, x if y is None else np.asarray(y)).shape, float(self.dy_target))
+        if self.fd_dh is None:
+            return dh
+        for x_left, x_right, y_base, y_top in self._get_fd_rects():
+            if y is None:
+                dist = np.minimum(np.abs(x - x_left), np.abs(x - x_right))
+            else:
+                dx = np.maximum(np.maximum(x_left - x, x - x_right), 0)
+                dist = np.hypot(dx, np.maximum(y_base - np.asarray(y, dtype=float), 0))
+            dh = np.minimum(dh, self.fd_dh + (self.fd_growth - 1) * dist)
+        return dh
+
+    @property
+    def vary_dh(self):
+        """True if the target element height varies (`freq_max` or `fd_dh` is set)"""
+        return self.freq_max is not None or self.fd_dh is not None
+
+    def get_dh_target_at_y(self, x, y):
+        """
+        Target element height at a position
+
+        Equal to `dy_target`, unless `freq_max` is set, then the height is set from the shear wave velocity
+        (from `SoilProfile.get_shear_vel_at_depth`) so that the wavelength at `freq_max` contains
+        `n_eles_per_wavelength` elements. Note that the slope of the soil layers is neglected.
+        If `fd_dh` is set, then the height is also limited by the graded size near the foundations (see `get_fd_dh`).
+        """
+        if self.fd_dh is not None:
+            return float(min(self._get_vs_dh_target_at_y(x, y), self.get_fd_dh(x, y)))
+        return self._get_vs_dh_target_at_y(x, y)
+
+    def _get_vs_dh_target_at_y(self, x, y):
+        if self.freq_max is None:
+            return self.dy_target
+        pid = int(interp_left(x, self.tds.x_sps))
+        sp = self.tds.sps[pid]
+        depth = max(self.y_surf_at_sps[pid] - y, 0.0)
+        if sp.height is not None:
+            depth = min(depth, sp.height)
+        vs = sp.get_shear_vel_at_depth(depth)
+        if vs is None or np.isnan(vs):
+            return self.dy_target
+        dh = vs / self.freq_max / self.n_eles_per_wavelength
+        return float(np.clip(dh, self.min_scale * self.dy_target, self.max_scale * self.dy_target))
+
+    def set_dh_targets(self):
+        """Sets the target element height for each zone between special y-coordinates along each vertical line"""
+        self.dh_targets = {}
+        for xc in self.xcs_sorted:
+            ys = self.yd[xc]
+            self.dh_targets[xc] = np.array([self.get_dh_target_at_y(xc, (ys[j] + ys[j + 1]) / 2)
+                                            for j in range(len(ys) - 1)])
+
+    def _get_scaled_dh(self, i, j, dh):
+        """Element height normalised by the zone target so that it can be compared against `dy_target`"""
+        if not self.vary_dh:
+            return dh
+        return dh * self.dy_target / self.dh_targets[self.xcs_sorted[i]][j]
+
+    def get_sizing_report(self):
+        """
+        Compares the number of elements in the mesh against an estimate for a mesh with uniform element heights of
+        `dy_target`, and if `fd_dh` is set, against a mesh with uniform element sizes of `fd_dh` ('fd_savings')
+
+        Returns
+        -------
+        OrderedDict
+        """
+        n_rows_uniform = 0
+        for xc in self.xcs_sorted:
+            n_blocks = np.clip(np.round(np.diff(self.yd[xc]) / self.dy_target), 1, None)
+            n_rows_uniform = max(n_rows_uniform, int(np.sum(n_blocks)))
+        n_cols = len(self.x_nodes) - 1
+        n_rows = len(self.y_nodes[0]) - 1
+        report = OrderedDict()
+        report['n_rows'] = n_rows
+        report['n_rows_uniform'] = n_rows_uniform
+        report['n_eles'] = n_cols * n_rows
+        report['n_eles_uniform'] = n_cols * n_rows_uniform
+        report['savings'] = 1 - n_rows / n_rows_uniform
+        if self.fd_dh is not None:  # compared to refining the whole mesh to the foundation element size
+            n_cols_fd = int(np.sum(np.clip(np.round(np.diff(self.xcs_sorted) / self.fd_dh), 1, None)))
+            n_rows_fd = 0
+            for xc in self.xcs_sorted:
+                n_blocks = np.clip(np.round(np.diff(self.yd[xc]) / self.fd_dh), 1, None)
+                n_rows_fd = max(n_rows_fd, int(np.sum(n_blocks)))
+            report['n_cols'] = n_cols
+            report['n_cols_uniform_fd'] = n_cols_fd
+            report['n_eles_uniform_fd'] = n_cols_fd * n_rows_fd
+            report['fd_savings'] = 1 - n_cols * n_rows / (n_cols_fd * n_rows_fd)
+        return report
+
     def set_init_y_blocks(self):
         """For each significant vertical line, assign initial number of elements between each special y-coordinate"""
         xcs = self.xcs_sorted
         y_steps = []
         y_blocks = {}
         # Step 1: Define an initial set of y_node coordinates at each x-special-position
-        h_target = self.dy_target
+        self.set_dh_targets()
         yd_init_inds = []
         for i in range(len(xcs)):
             xc0 = xcs[i]
@@ -261,6 +630,7 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
 
             for j in range(1, len(self.yd[xc0])):
                 h_diff = -(self.yd[xc0][j - 1] - self.yd[xc0][j])
+                h_target = self.dh_targets[xc0][j - 1]
                 n_blocks = int(np.round(h_diff / h_target))
                 if n_blocks == 0:
                     n_blocks = 1
@@ -276,6 +646,8 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
             if len(y_steps[i]) < n_max:
                 n_extra = n_max - n_blocks[i]  # number of blocks to add
                 h_diffs = np.diff(self.yd[xc0])  # thickness of each zone
+                if self.vary_dh:
+                    h_diffs = h_diffs / self.dh_targets[xc0]
                 for nn in range(n_extra):
                     dh_options = h_diffs / (np.array(y_blocks[xc0]) + 1)
                     # index of the zone with thickest average element, where new element will be added
@@ -283,252 +655,291 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
                     y_blocks[xc0][ind_max] += 1
         self.y_blocks = y_blocks
 
-    def adjust_blocks_to_be_consistent_with_slopes(self):
-        """Change the number of elements between special y-coords to try to maintain defined slopes"""
-        min_dh = self.min_scale * self.dy_target
-        max_dh = self.max_scale * self.dy_target
-        xcs = list(self.yd)
-        xcs.sort()
-        xcs = np.array(xcs)
-        yd_list = [self.yd[xc] for xc in xcs]
-        # yd_list = list(self.yd.values())
-
-        # Step 3: For each defined slope, check that the grid is consistent with the slope
-        #  - cycle through moving left to right and bot to top
-        #  - if not consistent then change thickness of elements in zones above and below on right side.
-        mdirs = [1, -1]  # TODO: alternative between forward and reverse add
-        dd = 0
-        mdir = mdirs[dd]
-        for pp in range(5):
-            sds = self.sds[::mdir]
-            for sd in sds:
-                csum_y_blocks = [np.cumsum(self.y_blocks[xcs]) for xcs in self.y_blocks]
-                if mdir == 1:
-                    x0 = sd[0][0]
-                    x1 = sd[0][1]
-                    y0 = sd[1][0]
-                    y1 = sd[1][1]
-                else:
-                    x0 = sd[0][1]
-                    x1 = sd[0][0]
-                    y0 = sd[1][1]
-                    y1 = sd[1][0]
-                ind_x0 = int(np.argmin(abs(xcs - x0)))
-                ind_x1 = int(np.argmin(abs(xcs - x1)))
-                ind_y0 = int(np.argmin(abs(np.array(yd_list[ind_x0]) - y0)))
-                ind_y1 = int(np.argmin(abs(np.array(yd_list[ind_x1]) - y1)))
-                x1_c = xcs[ind_x1]
-                y1_c = yd_list[ind_x1][ind_y1]
-                nb0 = csum_y_blocks[ind_x0][ind_y0 - 1]
-                nb1 = csum_y_blocks[ind_x1][ind_y1 - 1]
-                sgn = int(np.sign(y1 - y0))
-
-                dh_dzone = y1 - y0
-                slope = dh_dzone / (x1 - x0)
-                if abs(slope) < self.allowable_slope and nb0 == nb1:
+    def _get_zone_limits(self, xc):
+        """
+        Heights and limits on the number of elements of each zone between special y-coordinates along a vertical line
+
+        Returns
+        -------
+        h_zones: np.ndarray
+            Height of each zone
+        n_targets: np.ndarray
+            Number of elements that gives the target element height of each zone (not rounded)
+        n_lows: np.ndarray
+            Minimum number of elements so that the element height does not exceed `max_scale` times the zone target
+            (or `max_scale * dy_target`), zero for the zone above the surface
+        n_highs: np.ndarray
+            Maximum number of elements so that the element height is not less than `min_scale` times the zone target
+            (or `min_scale * dy_target`)
+        has_pad: bool
+            If true, then the last zone is between the surface and the highest surface of the system
+        """
+        targets = self.dh_targets[xc]
+        min_dh = self.min_scale * np.minimum(targets, self.dy_target)
+        max_dh = self.max_scale * np.minimum(targets, self.dy_target)
+        h_zones = np.diff(self.yd[xc])
+        n_targets = h_zones / targets
+        n_lows = np.maximum(np.ceil(h_zones / max_dh - 1e-9), 1).astype(int)
+        n_highs = np.maximum(np.floor(h_zones / min_dh + 1e-9), n_lows).astype(int)
+        has_pad = self.y_surf_at_xcs[xc] != self.yd[xc][-1]
+        if has_pad:
+            n_lows[-1] = 0
+            n_highs[-1] = int(np.floor(h_zones[-1] / min_dh[-1] + 1e-9))
+        return h_zones, n_targets, n_lows, n_highs, has_pad
+
+    def _solve_column_blocks(self, xc, n_max, level_targets=None):
+        """
+        Dynamic program over the zones of a special vertical line for the number of elements in each zone
+
+        The cost of each zone increases with the squared difference from its target number of elements and with
+        the number of elements outside of the element height limits (see `_get_zone_limits`). The zone above the
+        surface can have zero elements and only costs when its elements are too thin.
+
+        The zone costs and the slope penalties are convex in the number of elements, so the minimum cost for each
+        total is convex and the costs of adding a zone are found by merging the cost increments of the zone
+        with those of the zones below it (linear rather than quadratic in the total number of elements).
+
+        Parameters
+        ----------
+        xc: float
+            x-coordinate of the vertical line
+        n_max: int
+            Largest total number of elements that is considered
+        level_targets: dict
+            Node number targets at the zone boundaries, {boundary index: list of node numbers}, each missed node is
+            penalised by `_slope_penalty`
+
+        Returns
+        -------
+        costs: np.ndarray
+            Minimum cost for each total number of elements - size=(n_max + 1,)
+        levels: list of tuple
+            Lowest total, minimum cost for each total from the lowest total, lowest number of elements and cost of
+            each number of elements, of each zone and the zones below it (see `_get_column_blocks`)
+        """
+        def build():
+            h_zones, n_targets, n_lows, n_highs, has_pad = self._get_zone_limits(xc)
+            n_real = len(h_zones) - int(has_pad)
+            extra = max(n_max - int(np.sum(n_highs[:n_real])), 0)  # so that any total up to n_max can be reached
+            n_low = 0
+            costs = np.zeros(1)
+            levels = []
+            for k in range(len(h_zones)):
+                if k < n_real:
+                    nbs = np.arange(1, n_highs[k] + extra + 1)
+                    zone_costs = (nbs - n_targets[k]) ** 2 / max(n_targets[k], 1.)
+                else:  # above the surface
+                    nbs = np.arange(0, n_highs[k] + extra + 1)
+                    zone_costs = np.zeros(len(nbs))
+                zone_costs += self._dh_penalty * (np.maximum(n_lows[k] - nbs, 0) + np.maximum(nbs - n_highs[k], 0))
+                levels.append((n_low, costs, nbs[0], zone_costs))
+                if not len(costs):
                     continue
-                diff_nb = nb1 - nb0
-                y1_below = yd_list[ind_x1][ind_y1 - 1]
-                if y1_c == self.y_surf_at_xcs[x1_c]:  # surface
-                    y1_above = None
-                else:
-                    y1_above = yd_list[ind_x1][ind_y1 + 1]
+                incs = np.concatenate([np.diff(costs), np.diff(zone_costs)])
+                incs.sort(kind='mergesort')
+                costs = costs[0] + zone_costs[0] + np.concatenate([[0.], np.cumsum(incs)])
+                n_low += nbs[0]
+                costs = costs[:max(n_max + 1 - n_low, 0)]
+                if level_targets is not None:
+                    for target in level_targets.get(k + 1, []):
+                        costs = costs + self._slope_penalty * np.abs(n_low + np.arange(len(costs)) - target)
+            all_costs = np.full(n_max + 1, np.inf)
+            all_costs[n_low:n_low + len(costs)] = costs
+            return all_costs, levels
+        # all values that the solution depends on, so that unchanged lines are reused by `rebuild`
+        key = [self.yd[xc], self.dh_targets[xc], self.y_surf_at_xcs[xc], self.dy_target, self.min_scale,
+               self.max_scale, n_max, level_targets]
+        return self._get_memo_part('adjust_blocks_to_be_consistent_with_slopes', key, build)
+
+    @staticmethod
+    def _get_column_blocks(levels, n_total):
+        """
+        Number of elements in each zone of a solved vertical line (see `_solve_column_blocks`) for a total
 
-                while sgn != np.sign(diff_nb) and diff_nb != 0:
+        From the top zone down, the number of elements of each zone is the lowest that minimises its cost plus the
+        minimum cost of the zones below it.
+        """
+        blocks = []
+        nb = n_total
+        for n_low, costs, nb_low, zone_costs in levels[::-1]:
+            inds = nb - nb_low - n_low - np.arange(len(zone_costs))  # index of the total below the zone
+            valid = (inds >= 0) & (inds < len(costs))
+            if not np.any(valid):  # total cannot be reached
+                blocks.insert(0, int(nb_low))
+                nb -= nb_low
+                continue
+            cands = np.where(valid, costs[np.clip(inds, 0, max(len(costs) - 1, 0))] + zone_costs, np.inf)
+            cost = np.min(cands)
+            n_blocks = int(nb_low + np.flatnonzero(cands <= cost + 1.0e-9 * max(abs(cost), 1.))[0])
+            blocks.insert(0, n_blocks)
+            nb -= n_blocks
+        return blocks
+
+    # penalties per element of the block count objective, exceeding the element height limits costs more than
+    # missing a slope, which costs more than any change in the number of elements of a zone within the limits
+    _slope_penalty = 1.0e2
+    _dh_penalty = 1.0e4
+
+    def _solve_blocks_for_total(self, n_total, solutions, sd_inds):
+        """
+        Solves the number of elements of each special vertical line from left to right for a total number of elements
 
-                    nb_below = self.y_blocks[x1_c][ind_y1 - 1]
-                    if nb_below + np.sign(diff_nb) * -1 == 0:
-                        break
-                    new_dh_below = (y1_c - y1_below) / (nb_below + np.sign(diff_nb) * -1)
-                    if not (min_dh < new_dh_below < max_dh):
-                        break
+        Parameters
+        ----------
+        n_total: int
+            Total number of elements of each line
+        solutions: list
+            Costs and levels of each line without the slopes (see `_solve_column_blocks`)
+        sd_inds: list
+            Slope, line indexes, boundary indexes and target node number difference of each slope
+
+        Returns
+        -------
+        y_blocks: dict
+            Number of elements in each zone of each line
+        node_nums: list of np.ndarray
+            Node number at each zone boundary of each line
+        cost: float
+            Sum of the costs of all lines
+        """
+        xcs = self.xcs_sorted
+        y_blocks = {}
+        node_nums = []
+        cost = 0.0
+        for i, xc in enumerate(xcs):
+            level_targets = {}
+            for sd, ind_x0, ind_x1, ind_y0, ind_y1, diff_nb in sd_inds:
+                if ind_x1 == i:
+                    level_targets.setdefault(ind_y1, []).append(node_nums[ind_x0][ind_y0] + diff_nb)
+            costs, levels = solutions[i]
+            if len(level_targets):
+                costs, levels = self._solve_column_blocks(xc, n_total, level_targets)
+            cost += costs[n_total]
+            y_blocks[xc] = self._get_column_blocks(levels, n_total)
+            node_nums.append(np.concatenate([[0], np.cumsum(y_blocks[xc])]))
+        return y_blocks, node_nums, cost
 
-                    nb1 += np.sign(diff_nb) * -1
-                    if y1_c != self.y_surf_at_xcs[x1_c]:
-                        nb_above = self.y_blocks[x1_c][ind_y1]
-                        if nb_above + np.sign(diff_nb) * 1 == 0:
-                            break
-                        new_dh_above = (y1_above - y1_c) / (nb_above + np.sign(diff_nb) * 1)
-                        if not (min_dh < new_dh_above < max_dh):
-                            break
-                        self.y_blocks[x1_c][ind_y1] += np.sign(diff_nb) * 1
-                    self.y_blocks[x1_c][ind_y1 - 1] += np.sign(diff_nb) * -1
-                    diff_nb = nb1 - nb0
-                approx_grid_slope = (dh_dzone - diff_nb * self.dy_target) / (x1 - x0)
-                if sgn != np.sign(approx_grid_slope):
-                    pass  # this can be an issue if it cannot be adjusted
-                if sgn * approx_grid_slope > self.allowable_slope:
-                    nn = 0
-                    while sgn * approx_grid_slope > self.allowable_slope:
-                        nn += 1
-                        # if no issues then adjust blocks
-                        self.y_blocks[x1_c][ind_y1 - 1] += sgn * 1
-                        nb1 += sgn * 1
-                        diff_nb = nb1 - nb0
-                        if y1_c != self.y_surf_at_xcs[x1_c]:
-                            self.y_blocks[x1_c][ind_y1] += sgn * -1
-                        approx_grid_slope = (dh_dzone - diff_nb * self.dy_target) / (x1 - x0)
-                        if nn > 10:
-                            raise ValueError
-                diff_nb = nb1 - nb0
-                if diff_nb:  # if zero then slope matches the line
-                    # else check if an adjustment is possible
-                    nnn = abs(diff_nb)
-                    for nn in range(nnn):
-                        diff_nb = nb1 - nb0
-                        if diff_nb == 0:
-                            break
-                        nb_sgn = np.sign(diff_nb)
-                        approx_new_slope = (dh_dzone - (diff_nb - nb_sgn * (nn + 1)) * self.dy_target) / (x1 - x0)
-                        if sgn * approx_new_slope > self.allowable_slope:
-                            break
-                        nb_below = self.y_blocks[x1_c][ind_y1 - 1]
-                        new_nb_below = nb_below + nb_sgn * -1
-                        use_2_below = False
-                        if new_nb_below == 0:  # try bring from even lower layer
-                            nb_2_below = self.y_blocks[x1_c][ind_y1 - 2]
-                            new_nb_2_below = nb_2_below + nb_sgn * -1
-                            y1_2_below = yd_list[ind_x1][ind_y1 - 2]
-                            new_dh_2_below = (y1_below - y1_2_below) / new_nb_2_below
-                            if min_dh < new_dh_2_below < max_dh:
-                                use_2_below = True
-                            else:
-                                break
-                        else:
-                            new_dh_below = (y1_c - y1_below) / (nb_below + nb_sgn * -1)
-                            if not (min_dh < new_dh_below < max_dh):
-                                break
-                        if y1_above is not None:
-                            nb_above = self.y_blocks[x1_c][ind_y1]
-                            new_dh_above = (y1_above - y1_c) / (nb_above + nb_sgn * 1)
-                            if not (min_dh < new_dh_above < max_dh):
-                                break
-                        # if no issues then adjust blocks
-                        if use_2_below:
-                            self.y_blocks[x1_c][ind_y1 - 2] += nb_sgn * -1
-                        else:
-                            self.y_blocks[x1_c][ind_y1 - 1] += nb_sgn * -1
-                        nb1 += nb_sgn * -1
-                        if y1_above is not None:
-                            self.y_blocks[x1_c][ind_y1] += nb_sgn * 1
-
-        # Step 5: Set the total number of blocks to be equal to the minimum number of blocks used in the highest columns
-        h_max = max(self.y_surf)
-        n_blocks = np.array([sum(self.y_blocks[xc]) for xc in xcs])
-        inds = np.where(np.interp(xcs, self.x_surf, self.y_surf) == h_max)[0]
-        n_max = min(n_blocks[inds])  # minimum number of blocks at top
-        # create null nodes
-        for i in range(len(xcs)):
-            x0 = xcs[i]
-            if n_blocks[i] != n_max:
-                n_extra = n_max - n_blocks[i]
-                self.y_blocks[x0][-1] += n_extra
+    def adjust_blocks_to_be_consistent_with_slopes(self):
+        """
+        Solves the number of elements between special y-coords to try to maintain defined slopes
+
+        The total number of elements is the same for all special vertical lines. Each line is solved once from left
+        to right (see `_solve_column_blocks`), with the node number at the right end of each slope targeted to match
+        the left end plus the smallest step that keeps the grid within `allowable_slope` of the slope. The total
+        is first set to minimise the sum of the costs of all lines without the slopes, then each total up to the node
+        numbers targeted at the top of the lines is also solved, and the lowest cost solution is used.
+
+        Slopes that remain inconsistent with the grid are stored in `slope_constraints` along with the limit that
+        prevented the adjustment ('n_blocks' - a zone would have no elements, 'dh_limits' - element height outside
+        of min/max scale, or 'slopes' - conflicts with other slopes or the total number of elements).
+        """
+        xcs = self.xcs_sorted
+        yd_list = [self.yd[xc] for xc in xcs]
+        n_max = max([int(np.sum(self._get_zone_limits(xc)[3])) for xc in xcs])
+
+        # target node number differences between the ends of each slope
+        sd_inds = []
+        for sd in self.sds:
+            x0, x1, y0, y1 = sd[0][0], sd[0][1], sd[1][0], sd[1][1]
+            ind_x0 = int(np.argmin(abs(xcs - x0)))
+            ind_x1 = int(np.argmin(abs(xcs - x1)))
+            if ind_x0 >= ind_x1:
+                continue
+            ind_y0 = int(np.argmin(abs(np.array(yd_list[ind_x0]) - y0)))
+            ind_y1 = int(np.argmin(abs(np.array(yd_list[ind_x1]) - y1)))
+            dh_dzone = y1 - y0
+            n_steps = (abs(dh_dzone) - self.allowable_slope * (x1 - x0)) / self.dy_target
+            diff_nb = int(np.sign(dh_dzone)) * (int(np.floor(n_steps)) + 1 if n_steps >= 0 else 0)
+            sd_inds.append((sd, ind_x0, ind_x1, ind_y0, ind_y1, diff_nb))
+
+        # Step 4: total number of elements without the slopes
+        solutions = [self._solve_column_blocks(xc, n_max) for xc in xcs]
+        n_total = int(np.argmin(np.sum([costs for costs, levels in solutions], axis=0)))
+
+        # Step 5: solve each line with the slopes, also for the totals that are targeted at the top of the lines
+        y_blocks, node_nums, cost = self._solve_blocks_for_total(n_total, solutions, sd_inds)
+        n_low = n_total
+        n_high = n_total
+        for sd, ind_x0, ind_x1, ind_y0, ind_y1, diff_nb in sd_inds:
+            if ind_y1 == len(yd_list[ind_x1]) - 1:
+                n_low = min(n_low, node_nums[ind_x0][ind_y0] + diff_nb)
+                n_high = max(n_high, node_nums[ind_x0][ind_y0] + diff_nb)
+        n_totals = [n for n in range(max(n_low, 1), min(n_high, n_max) + 1) if n != n_total]
+        for n in n_totals:
+            solution = self._solve_blocks_for_total(n, solutions, sd_inds)
+            if solution[2] < cost:
+                n_total = n
+                y_blocks, node_nums, cost = solution
+        self.y_blocks = y_blocks
+
+        constraints = []
+        for sd, ind_x0, ind_x1, ind_y0, ind_y1, diff_nb in sd_inds:
+            nb0 = node_nums[ind_x0][ind_y0]
+            nb1 = node_nums[ind_x1][ind_y1]
+            if nb1 - nb0 == diff_nb:
+                continue
+            h_zones, n_targets, n_lows, n_highs, has_pad = self._get_zone_limits(xcs[ind_x1])
+            n_ones = np.ones(len(h_zones), dtype=int)
+            if has_pad:
+                n_ones[-1] = 0
+            target = nb0 + diff_nb
+            limit = 'slopes'
+            for lows, highs, name in [(n_ones, np.full(len(h_zones), n_total), 'n_blocks'),
+                                      (n_lows, n_highs, 'dh_limits')]:
+                low = max(np.sum(lows[:ind_y1]), n_total - np.sum(highs[ind_y1:]))
+                high = min(np.sum(highs[:ind_y1]), n_total - np.sum(lows[ind_y1:]))
+                if not low <= target <= high:
+                    limit = name
+                    break
+            constraints.append({'slope': sd, 'diff_nb': int(nb1 - nb0), 'diff_nb_target': diff_nb, 'limit': limit})
+        self.stage_counts['adjust_blocks_to_be_consistent_with_slopes'] = {
+            'lines': len(xcs), 'slopes': len(sd_inds), 'totals': len(n_totals) + 1, 'n_rows': n_total}
+        self.slope_constraints = constraints
 
     def trim_grid_to_target_dh(self):
-        """Check mesh for potential thin layers and try to remove rows of elements to get elements close to target dh"""
+        """
+        Check mesh for zones with elements that are far from the target dh
+
+        The element heights are part of the objective that sets the number of elements in
+        `adjust_blocks_to_be_consistent_with_slopes`, so the number of elements is not changed here. Zones with
+        a scaled element height outside of the optimal range are stored in `dh_constraints` along with the limit
+        that prevents the change ('n_blocks', 'max_dh', 'opt_high' - when removing an element, 'min_dh', 'opt_low' -
+        when adding an element, or 'coupled' - held by the slopes or the total number of elements).
+        """
         xcs = self.xcs_sorted
         opt_low = self.dy_target * (self.min_scale + 1) / 2
         opt_high = self.dy_target * (self.max_scale + 1) / 2
-        # try to trim mesh to be closer to target dh
-        opts_tried = []
-        for nn in range(10):
-            y_coords_at_xcs = [list(self.yd[xc]) for xc in xcs]
-            y_node_nums_at_xcs = [list(np.cumsum(self.y_blocks[xcs])) for xcs in self.y_blocks]
-            for i in range(len(y_node_nums_at_xcs)):
-                y_node_nums_at_xcs[i].insert(0, 0)
-                if y_node_nums_at_xcs[i][-2] == y_node_nums_at_xcs[i][-1]:
-                    y_coords_at_xcs[i] = y_coords_at_xcs[i][:-1]
-                    y_node_nums_at_xcs[i] = y_node_nums_at_xcs[i][:-1]
-            av_dhs = []
-            min_dhs = []
-            for i in range(len(y_node_nums_at_xcs)):
-                av_dhs.append([])
-                for j in range(len(y_node_nums_at_xcs[i]) - 1):
-                    if (i, j) in opts_tried:
-                        av_dhs[i].append(1000)
-                        continue
-                    nb = y_node_nums_at_xcs[i][j + 1] - y_node_nums_at_xcs[i][j]
-                    av_dhs[i].append((y_coords_at_xcs[i][j + 1] - y_coords_at_xcs[i][j]) / nb)
-
-                min_dhs.append(min(av_dhs[i]))
-            if min(min_dhs) < self.dy_target:  # favour slightly larger elements - could use opt_low
-                x_ind = min_dhs.index(min(min_dhs))
-                y_ind = av_dhs[x_ind].index(min_dhs[x_ind])
-                nb_lowest_p = y_node_nums_at_xcs[x_ind][y_ind]  # range where element could be removed
-                nb_highest_p = y_node_nums_at_xcs[x_ind][y_ind + 1]
-                hzone_p = y_coords_at_xcs[x_ind][y_ind + 1] - y_coords_at_xcs[x_ind][y_ind]
-
-                found_opt = 0
-                for opt in range(nb_lowest_p, nb_highest_p):
-                    max_new_dh = hzone_p / (nb_highest_p - nb_lowest_p - 1)
-
-                    for w in range(len(y_node_nums_at_xcs)):
-                        y_ind = interp_left(opt, y_node_nums_at_xcs[w])
-                        nb_low = y_node_nums_at_xcs[w][y_ind]
-                        nb_high = y_node_nums_at_xcs[w][y_ind + 1]
-                        hzone = y_coords_at_xcs[w][y_ind + 1] - y_coords_at_xcs[w][y_ind]
-                        new_dh = hzone / (nb_high - nb_low - 1)
-                        if max_new_dh < new_dh:
-                            max_new_dh = new_dh
-                    if max_new_dh < opt_high:
-                        for w in range(len(y_node_nums_at_xcs)):
-                            y_ind = interp_left(opt, y_node_nums_at_xcs[w])
-                            self.y_blocks[xcs[w]][y_ind] -= 1
-                        found_opt = 1
-                        break
-                if not found_opt:
-                    opts_tried.append((x_ind, y_ind))
-            else:
-                break
-        # reduce
-        opts_tried = []
-        for nn in range(10):
-            y_coords_at_xcs = [list(self.yd[xc]) for xc in xcs]
-            y_node_nums_at_xcs = [list(np.cumsum(self.y_blocks[xcs])) for xcs in self.y_blocks]
-            for i in range(len(y_node_nums_at_xcs)):
-                y_node_nums_at_xcs[i].insert(0, 0)
-                if y_node_nums_at_xcs[i][-2] == y_node_nums_at_xcs[i][-1]:
-                    y_coords_at_xcs[i] = y_coords_at_xcs[i][:-1]
-                    y_node_nums_at_xcs[i] = y_node_nums_at_xcs[i][:-1]
-            av_dhs = []
-            max_dhs = []
-            for i in range(len(y_node_nums_at_xcs)):
-                av_dhs.append([])
-                for j in range(len(y_node_nums_at_xcs[i]) - 1):
-                    if (i, j) in opts_tried:
-                        av_dhs[i].append(1000)
-                        continue
-                    nb = y_node_nums_at_xcs[i][j + 1] - y_node_nums_at_xcs[i][j]
-                    av_dhs[i].append((y_coords_at_xcs[i][j + 1] - y_coords_at_xcs[i][j]) / nb)
-
-                max_dhs.append(max(av_dhs[i]))
-            if max(max_dhs) > opt_high:
-                x_ind = max_dhs.index(max(max_dhs))
-                y_ind = av_dhs[x_ind].index(max_dhs[x_ind])
-                nb_lowest = y_node_nums_at_xcs[x_ind][y_ind]  # range where element could be add
-                nb_highest = y_node_nums_at_xcs[x_ind][y_ind + 1]
-                hzone_p = y_coords_at_xcs[x_ind][y_ind + 1] - y_coords_at_xcs[x_ind][y_ind]
-                found_opt = 0
-                for opt in range(nb_lowest, nb_highest):
-                    min_new_dh = hzone_p / (nb_highest - nb_lowest + 1)
-                    for w in range(len(y_node_nums_at_xcs)):
-                        y_ind = interp_left(nb_lowest, y_node_nums_at_xcs[w])
-                        nb_low = y_node_nums_at_xcs[w][y_ind]
-                        nb_high = y_node_nums_at_xcs[w][y_ind + 1]
-                        hzone = y_coords_at_xcs[w][y_ind + 1] - y_coords_at_xcs[w][y_ind]
-                        new_dh = hzone / (nb_high - nb_low + 1)
-                        if min_new_dh > new_dh:
-                            min_new_dh = new_dh
-                    if min_new_dh > opt_low:
-                        for w in range(len(y_node_nums_at_xcs)):
-                            y_ind = interp_left(nb_lowest, y_node_nums_at_xcs[w])
-                            self.y_blocks[xcs[w]][y_ind] += 1
-                        found_opt = 1
-                        break
-                if not found_opt:
-                    opts_tried.append((x_ind, y_ind))
-            else:
-                break
+        constraints = []
+        n_zones = 0
+        for i, xc in enumerate(xcs):
+            h_zones, n_targets, n_lows, n_highs, has_pad = self._get_zone_limits(xc)
+            for j in range(len(h_zones) - int(has_pad)):
+                n_zones += 1
+                nb = self.y_blocks[xc][j]
+                dh = self._get_scaled_dh(i, j, h_zones[j] / nb)
+                if dh > opt_high:
+                    change = 1
+                    if nb + 1 > n_highs[j]:
+                        limit = 'min_dh'
+                    elif self._get_scaled_dh(i, j, h_zones[j] / (nb + 1)) < opt_low:
+                        limit = 'opt_low'
+                    else:
+                        limit = 'coupled'
+                elif dh < opt_low:
+                    change = -1
+                    if nb == 1:
+                        limit = 'n_blocks'
+                    elif nb - 1 < n_lows[j]:
+                        limit = 'max_dh'
+                    elif self._get_scaled_dh(i, j, h_zones[j] / (nb - 1)) > opt_high:
+                        limit = 'opt_high'
+                    else:
+                        limit = 'coupled'
+                else:
+                    continue
+                constraints.append({'x': xc, 'zone': j, 'change': change, 'limit': limit})
+        self.stage_counts['trim_grid_to_target_dh'] = {'zones': n_zones, 'constraints': len(constraints)}
+        self.dh_constraints = constraints
 
     def build_req_y_node_positions(self):
         """
@@ -593,11 +1004,9 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         req_y_nodes = self.req_y_nodes
         y_coords_at_xcs = self.req_y_coords_at_xcs
         # Step 4: position additional nodes to be consistent with previous column - otherwise equally spaced
-        y_nodes = []
-        for i, xc0 in enumerate(xcs):
+        def build_line(i):
             if i == 0:  # first column just interpolate
-                y_nodes.append(np.interp(np.arange(req_y_nodes[i][-1] + 1), req_y_nodes[i], y_coords_at_xcs[i]))
-                continue
+                return np.interp(np.arange(req_y_nodes[i][-1] + 1), req_y_nodes[i], y_coords_at_xcs[i])
 
             new_y_vals = []
             for j in range(len(y_nodes[i - 1])):
@@ -620,7 +1029,19 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
                 else:
                     ind = np.where(req_y_nodes[i] == j)[0][0]
                     new_y_vals.append(y_coords_at_xcs[i][ind])
-            y_nodes.append(new_y_vals)
+            if np.any(np.diff(new_y_vals) <= 0):  # nodes crossed, so equally space between the required nodes
+                new_y_vals = np.interp(np.arange(req_y_nodes[i][-1] + 1), req_y_nodes[i], y_coords_at_xcs[i])
+            return np.array(new_y_vals)
+
+        y_nodes = []
+        for i, xc0 in enumerate(xcs):
+            # each line depends only on its required nodes and the line to its left, so lines are reused by `rebuild`
+            # wherever these are unchanged
+            key = [req_y_nodes[i], y_coords_at_xcs[i]]
+            if i > 0:
+                key += [y_nodes[i - 1], self.y_surf_at_xcs[xcs[i - 1]]]
+            y_nodes.append(self._get_memo_part('build_y_coords_grid_via_propagation', key,
+                                               lambda: build_line(i)))
         y_nodes = np.array(y_nodes)
         # For each surface slope adjust steps so that they are not pointed against slope
         for i, xc0 in enumerate(xcs):
@@ -638,8 +1059,10 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
             # assert diff_nb > 0  # currently only supports smoothing forward
             next_slope = surf_at_next_xc - surf_at_xc
             # trim either half the block or min_dh
-            if next_slope > 0 and diff_nb > 0:
-                next_ys = y_nodes[i+1][ind_yc+1: ind_nc + 1]
+            next_ys = y_nodes[i+1][ind_yc+1: ind_nc + 1]
+            # must not cross the surface or the nodes above
+            below_next = ind_nc == len(y_nodes[i]) - 1 or np.all(next_ys < y_nodes[i][ind_nc + 1])
+            if next_slope > 0 and diff_nb > 0 and np.all(next_ys > surf_at_xc) and below_next:
                 # y_nodes[i][ind_yc: ind_nc] = (next_ys - next_ys[0]) * 0.5 + next_ys[0]
                 y_nodes[i][ind_yc+1: ind_nc + 1] = next_ys
             # elif next_slope < 0 and diff_nb < 0:
@@ -662,44 +1085,41 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         if self.x_nodes is None:
             self.set_x_nodes()
         y_node_nums = np.arange(0, self.req_y_nodes[0][-1] + 1)
-        ys = []
-        for i in range(len(self.x_nodes)):
-            ys.append(interp3d(self.x_nodes[i], y_node_nums, self.xcs_sorted, self.req_y_nodes, self.req_y_coords_at_xcs))
-        self.y_nodes = np.array(ys)
+        self.y_nodes = interp3d(self.x_nodes, y_node_nums, self.xcs_sorted, self.req_y_nodes, self.req_y_coords_at_xcs)
+
+    def get_x_scales(self):
+        """
+        Positions and scale factors of the element widths
+
+        Equal to `x_scale_pos` and `x_scale_vals`, unless `fd_dh` is set, then the scales are reduced near the
+        foundations so that the element widths grade from `fd_dh` at the foundation edges (see `get_fd_dh`)
+
+        Returns
+        -------
+        x_scale_pos: np.ndarray
+        x_scale_vals: np.ndarray
+        """
+        if self.fd_dh is None:
+            return self.x_scale_pos, self.x_scale_vals
+        dists = self._get_fd_graded_distances()
+        pos = [self.x_scale_pos, [0, self.tds.width]]
+        for x_left, x_right, y_base, y_top in self._get_fd_rects():
+            pos += [x_left - dists, x_left + dists, x_right - dists, x_right + dists]
+        pos = np.concatenate(pos)
+        pos = np.unique(np.clip(pos, min(self.x_scale_pos[0], 0), None))
+        inds = np.clip(np.searchsorted(self.x_scale_pos, pos, side='right') - 1, 0, None)
+        # the distance to the nearest edge is smallest at one end of each interval
+        fd_dh = np.minimum(self.get_fd_dh(pos), self.get_fd_dh(np.append(pos[1:], pos[-1])))
+        vals = np.minimum(self.x_scale_vals[inds], fd_dh / self.dy_target)
+        return pos, vals
 
     def set_x_nodes(self):
         """Determine optimal position of node x-coordinates"""
-        dxs = [0]
-        x_start = 0
-        x_scale_curr = self.x_scale_vals[0]
-        for xx in range(1, len(self.xcs_sorted)):
-            x_shift = self.xcs_sorted[xx] - self.xcs_sorted[xx - 1]
-            extra_inds = np.where((self.xcs_sorted[xx] > self.x_scale_pos) & (self.x_scale_pos > self.xcs_sorted[xx - 1]))
-            x_cps = [self.xcs_sorted[xx - 1]]
-            x_scales = [x_scale_curr]
-            for i in extra_inds[0]:
-                x_cps.append(self.x_scale_pos[i])
-                x_scales.append(self.x_scale_vals[i])
-            x_scales = np.array(x_scales)
-            x_cps.append(self.xcs_sorted[xx])
-            zone_widths = np.diff(x_cps)
-            n_eles = np.sum(zone_widths / (x_scales * self.dy_target))
-            n_x_eles = int(n_eles + 0.5)
-            av_ele_width = x_shift / n_x_eles
-            x_incs = []
-            for n in range(n_x_eles):
-                x_ele = 0
-                for pp in range(10):
-                    x_ele += interp_left(x_ele + x_start, self.x_scale_pos, self.x_scale_vals) * self.dy_target / 10
-                x_incs.append(x_ele)
-                x_start += x_ele
-            x_incs = np.array(x_incs) * x_shift / sum(x_incs)
-            dxs += list(x_incs)
-            x_start = np.sum(dxs)
-            x_scale_curr = interp_left(x_start, self.x_scale_pos, self.x_scale_vals)
-            assert np.isclose(x_start, self.xcs_sorted[xx]), (x_start, self.xcs_sorted[xx])
-
-        self.x_nodes = np.cumsum(dxs)
+        x_scale_pos, x_scale_vals = self.get_x_scales()
+        # number of elements between special x-coordinates, from the integral of the target element widths
+        n_eles = np.diff(get_stretched_coords(self.xcs_sorted, x_scale_pos, x_scale_vals)) / self.dy_target
+        n_x_eles = np.clip((n_eles + 0.5).astype(int), 1, None)
+        self.x_nodes = get_graded_positions(self.xcs_sorted, n_x_eles, x_scale_pos, x_scale_vals)
 
     def adjust_for_smooth_surface(self):
         """Make the surface have less than 90 degree changes"""
@@ -809,30 +1229,29 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         self.soil_grid = np.zeros((len(y_centres), len(y_centres[0])), dtype=int)
         self.x_index_to_sp_index = interp_left(x_centres, self.tds.x_sps, np.arange(0, len(self.tds.x_sps)))
         self.x_index_to_sp_index = np.array(self.x_index_to_sp_index, dtype=int)
+        # depths, soil indexes and angles of the layers of each profile
+        sp_layers = []
+        for pid, sp in enumerate(self.tds.sps):
+            depths = np.array([sp.layer_depth(ll) for ll in range(1, sp.n_layers + 1)])
+            sl_inds = np.array([self._soil_hashes.index(sp.layer(ll).unique_hash) for ll in range(1, sp.n_layers + 1)])
+            sp_layers.append((depths, sl_inds, np.array(sp.x_angles, dtype=float)))
+
+        def build_column(xx, y_layers, sl_inds):
+            # the element is in the layer above the first layer top that it is not below
+            below = y_centres[xx][:, np.newaxis] < y_layers[np.newaxis, :]
+            n_above = np.where(below.all(axis=1), len(y_layers), np.argmin(below, axis=1))
+            soil_ids = sl_inds[np.maximum(n_above, 1) - 1]  # above the original soil profile due to ground slope
+            soil_ids[y_centres[xx] > surf_centres[xx]] = self._inactive_value
+            return soil_ids
+
         for xx in range(len(self.soil_grid)):
-            for yy in range(len(self.soil_grid[0])):
-                pid = self.x_index_to_sp_index[xx]
-                sp = self.tds.sps[pid]
-                if y_centres[xx][yy] > surf_centres[xx]:
-                    self.soil_grid[xx][yy] = self._inactive_value
-                    continue
-                x_angles = list(sp.x_angles)
-                sp_x = self.tds.x_sps[pid]
-                for ll in range(1, sp.n_layers + 1):
-                    yc = y_centres[xx][yy]
-                    if -yc > (sp.layer_depth(ll) - x_angles[ll - 1] * (x_centres[xx] - sp_x) - self.y_surf_at_sps[pid]):
-                        pass
-                    else:
-                        if ll == 1:  # above the original soil profile due to ground slope
-                            unique_hash = sp.layer(1).unique_hash
-                        else:
-                            unique_hash = sp.layer(ll - 1).unique_hash
-                        self.soil_grid[xx][yy] = self._soil_hashes.index(unique_hash)
-                        break
-                    if ll == sp.n_layers:
-                        unique_hash = sp.layer(ll).unique_hash
-                        self.soil_grid[xx][yy] = self._soil_hashes.index(unique_hash)
-                        break
+            pid = self.x_index_to_sp_index[xx]
+            depths, sl_inds, x_angles = sp_layers[pid]
+            y_layers = self.y_surf_at_sps[pid] - depths + x_angles * (x_centres[xx] - self.tds.x_sps[pid])
+            # columns with the same node heights, surface and layers are reused by `rebuild` and within a run
+            key = [y_centres[xx], surf_centres[xx], y_layers, sl_inds]
+            self.soil_grid[xx] = self._get_memo_part('set_soil_ids_to_vary_y_grid', key,
+                                                     lambda: build_column(xx, y_layers, sl_inds))
 
     def set_soil_ids_to_vary_xy_grid(self):
         # Assign soil to element grid
@@ -895,6 +1314,8 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
         return self._femesh
 
     def exclude_fd_eles(self):  # TODO: implement a near field option, where grid gets remeshed with angles to have more detail near footing
+        """Sets the elements of each foundation to inactive, the element ranges are stored in `fd_ele_boxes`"""
+        boxes = []
         for i, bd in enumerate(self.tds.bds):
             fd = bd.fd
             fcx = self.tds.x_bds[i] + bd.x_fd
@@ -908,16 +1329,547 @@ class FiniteElementVary2DMeshConstructor(object):  # maybe FiniteElementVertLine
             xei = self.femesh.get_nearest_node_index_at_x(x1)
             yei = self.femesh.get_nearest_node_index_at_depth(y_top, x0)
             ysi = self.femesh.get_nearest_node_index_at_depth(y_bot, x0)
-            # create foundation nodes a soil mesh nodes
-            # along the base
-            j = 0
-            for xx in range(int(xsi), int(xei)):
-                for yy in range(int(ysi), int(yei)):
-                    self.soil_grid[xx][yy] = self._inactive_value
-                    self.femesh.soil_grid[xx][yy] = self.femesh.inactive_value
+            xsi, xei, ysi, yei = int(xsi), int(xei), int(ysi), int(yei)
+            self.soil_grid[xsi:xei, ysi:yei] = self._inactive_value
+            self.femesh.soil_grid[xsi:xei, ysi:yei] = self.femesh.inactive_value
+            boxes.append([xsi, xei, ysi, yei])
+        self.fd_ele_boxes = np.array(boxes, dtype=int).reshape(-1, 4)
+        self.femesh.fd_ele_boxes = self.fd_ele_boxes
+        self.femesh.reset_cache()
+
+
+class FiniteElementVary2DMeshBase(PhysicalObject, active.ActiveMeshMixin):
+    """
+    Shared array operations for the vary-y and vary-xy meshes
+
+    Nodes are numbered in the natural order of the node grid (column-by-column from left to right and from top to
+    bottom within each column), skipping inactive nodes. Element numbering follows the same order over the element
+    grid, skipping inactive elements. All derived arrays are cached until the node coordinates or the soil grid
+    are reset.
+
+    Subclasses provide `get_x_nodes2d`, the x-position of all nodes - size=(nnx, nny).
+    """
+    _x_nodes = None
+    _y_nodes = None
+    _soil_grid = None
+    inactive_value = 1e6
+    fd_ele_boxes = np.zeros((0, 4), dtype=int)  # [x-start, x-end, y-start, y-end) element indexes of each foundation
+
+    def reset_cache(self):
+        """Clears all cached arrays, must be called if the node coordinates or soil_grid are modified in place"""
+        self._cache = {}
+
+    def _get_cached(self, name, func):
+        if not hasattr(self, '_cache'):
+            self._cache = {}
+        if name not in self._cache:
+            self._cache[name] = func()
+        return self._cache[name]
+
+    def get_active_ele_mask(self):
+        """Boolean grid that is True where an element is active - size=(nnx - 1, nny - 1)"""
+        return self._get_cached('active_ele_mask', lambda: np.asarray(self._soil_grid) != self.inactive_value)
+
+    def get_node_id_grid(self, node_order='natural'):
+        """
+        Grid of node ids (-1 if inactive) - size=(nnx, nny)
+
+        Parameters
+        ----------
+        node_order: str
+            if 'natural' then nodes are numbered column-by-column, if 'rcm' then nodes are renumbered using
+            reverse Cuthill-McKee to reduce the bandwidth
+        """
+        def build():
+            active = np.asarray(self.get_active_nodes(), dtype=bool)
+            ids = np.cumsum(active.ravel(), dtype=np.int32) - 1
+            return np.where(active.ravel(), ids, -1).astype(np.int32).reshape(active.shape)
+        nids = self._get_cached('node_id_grid', build)
+        if node_order == 'natural':
+            return nids
+
+        def build_renumbered():
+            inv_perm = self.get_node_renumbering(node_order)[1]
+            return np.where(nids >= 0, inv_perm[nids], -1).astype(np.int32)
+        return self._get_cached(f'node_id_grid_{node_order}', build_renumbered)
+
+    def get_ele_id_grid(self):
+        """Grid of element ids (-1 if inactive) - size=(nnx - 1, nny - 1)"""
+        def build():
+            active = self.get_active_ele_mask()
+            ids = np.cumsum(active.ravel(), dtype=np.int32) - 1
+            return np.where(active.ravel(), ids, -1).astype(np.int32).reshape(active.shape)
+        return self._get_cached('ele_id_grid', build)
+
+    @property
+    def n_nodes(self):
+        """Number of active nodes"""
+        return int(np.count_nonzero(self.get_node_id_grid() >= 0))
+
+    @property
+    def n_eles(self):
+        """Number of active elements"""
+        return int(np.count_nonzero(self.get_active_ele_mask()))
+
+    def get_node_coords(self, node_order='natural'):
+        """Coordinates of the active nodes - size=(n_nodes, 2)"""
+        def build():
+            active = self.get_node_id_grid() >= 0
+            coords = np.empty((int(np.count_nonzero(active)), 2), dtype=np.float64)
+            coords[:, 0] = self.get_x_nodes2d()[active]
+            coords[:, 1] = np.asarray(self._y_nodes)[active]
+            return coords
+        coords = self._get_cached('node_coords', build)
+        if node_order == 'natural':
+            return coords
+        return self._get_cached(f'node_coords_{node_order}',
+                                lambda: np.ascontiguousarray(coords[self.get_node_renumbering(node_order)[0]]))
+
+    def get_node_grid_indexes(self):
+        """The (x-index, y-index) of each active node in the node grid - size=(n_nodes, 2)"""
+        def build():
+            return np.ascontiguousarray(np.argwhere(self.get_node_id_grid() >= 0), dtype=np.int32)
+        return self._get_cached('node_grid_indexes', build)
+
+    def get_ele_grid_indexes(self):
+        """The (x-index, y-index) of each active element in the soil grid - size=(n_eles, 2)"""
+        def build():
+            return np.ascontiguousarray(np.argwhere(self.get_active_ele_mask()), dtype=np.int32)
+        return self._get_cached('ele_grid_indexes', build)
+
+    def get_connectivity(self, node_order='natural'):
+        """
+        Node ids of each active element - size=(n_eles, 4)
+
+        Nodes are ordered counter-clockwise starting from the bottom-left node.
+
+        Parameters
+        ----------
+        node_order: str
+            if 'natural' then nodes are numbered column-by-column, if 'rcm' then nodes are renumbered using
+            reverse Cuthill-McKee to reduce the bandwidth
+        """
+        if node_order != 'natural':
+            return self._get_cached(f'connectivity_{node_order}',
+                                    lambda: self.get_node_renumbering(node_order)[1][self.get_connectivity()])
+
+        def build():
+            nids = self.get_node_id_grid()
+            active = self.get_active_ele_mask()
+            conn = np.empty((int(np.count_nonzero(active)), 4), dtype=np.int32)
+            conn[:, 0] = nids[:-1, 1:][active]  # bottom-left
+            conn[:, 1] = nids[1:, 1:][active]  # bottom-right
+            conn[:, 2] = nids[1:, :-1][active]  # top-right
+            conn[:, 3] = nids[:-1, :-1][active]  # top-left
+            return conn
+        return self._get_cached('connectivity', build)
+
+    # (x, y) offsets in the refined grid of the nodes of a quadratic element from its top-left corner,
+    # corners counter-clockwise from the bottom-left, then the mid-side nodes of the bottom, right, top and left edges,
+    # then the centre node
+    _quad_node_offsets = [(0, 2), (2, 2), (2, 0), (0, 0), (1, 2), (2, 1), (1, 0), (0, 1), (1, 1)]
+
+    def _check_n_quad_nodes(self, n_nodes_per_ele):
+        if n_nodes_per_ele not in (8, 9):
+            raise ValueError(f'n_nodes_per_ele must be 8 or 9, n_nodes_per_ele={n_nodes_per_ele}')
+
+    def get_quadratic_node_id_grid(self, n_nodes_per_ele=9):
+        """
+        Grid of node ids of the quadratic elements (-1 if inactive) - size=(2 * nnx - 1, 2 * nny - 1)
+
+        The refined grid contains the corner nodes at even indexes, the mid-side nodes and the centre nodes.
+        Nodes are numbered in the same order as `get_node_id_grid`, so nodes on shared edges are only
+        numbered once.
+
+        Parameters
+        ----------
+        n_nodes_per_ele: int
+            8 (serendipity elements, without centre nodes) or 9 (Lagrange elements)
+        """
+        self._check_n_quad_nodes(n_nodes_per_ele)
+
+        def build():
+            active = self.get_active_ele_mask()
+            nex, ney = active.shape
+            mask = np.zeros((2 * nex + 1, 2 * ney + 1), dtype=bool)
+            for dx, dy in self._quad_node_offsets[:n_nodes_per_ele]:
+                mask[dx:dx + 2 * nex:2, dy:dy + 2 * ney:2] |= active
+            ids = np.cumsum(mask.ravel(), dtype=np.int32) - 1
+            return np.where(mask.ravel(), ids, -1).astype(np.int32).reshape(mask.shape)
+        return self._get_cached(f'quadratic_node_id_grid_{n_nodes_per_ele}', build)
+
+    def _get_quadratic_grid_coords(self):
+        """x and y coordinates of the refined grid, mid-side and centre nodes are the average of the corners"""
+        def build():
+            coords = []
+            for vals in [np.asarray(self.get_x_nodes2d(), dtype=float), np.asarray(self._y_nodes, dtype=float)]:
+                fine = np.empty((2 * vals.shape[0] - 1, 2 * vals.shape[1] - 1))
+                fine[::2, ::2] = vals
+                fine[1::2, ::2] = (vals[:-1] + vals[1:]) / 2
+                fine[::2, 1::2] = (vals[:, :-1] + vals[:, 1:]) / 2
+                fine[1::2, 1::2] = (vals[:-1, :-1] + vals[1:, :-1] + vals[:-1, 1:] + vals[1:, 1:]) / 4
+                coords.append(fine)
+            return coords
+        return self._get_cached('quadratic_grid_coords', build)
+
+    def get_quadratic_node_coords(self, n_nodes_per_ele=9):
+        """Coordinates of the active nodes of the quadratic elements - size=(n_quadratic_nodes, 2)"""
+        def build():
+            active = self.get_quadratic_node_id_grid(n_nodes_per_ele) >= 0
+            x_fine, y_fine = self._get_quadratic_grid_coords()
+            coords = np.empty((int(np.count_nonzero(active)), 2), dtype=np.float64)
+            coords[:, 0] = x_fine[active]
+            coords[:, 1] = y_fine[active]
+            return coords
+        self._check_n_quad_nodes(n_nodes_per_ele)
+        return self._get_cached(f'quadratic_node_coords_{n_nodes_per_ele}', build)
+
+    def get_quadratic_connectivity(self, n_nodes_per_ele=9):
+        """
+        Node ids (see `get_quadratic_node_id_grid`) of each active element - size=(n_eles, n_nodes_per_ele)
+
+        The corner nodes are ordered counter-clockwise starting from the bottom-left node (as in `get_connectivity`),
+        followed by the mid-side nodes of the bottom, right, top and left edges, then the centre node (9 nodes only).
+        """
+        def build():
+            nids = self.get_quadratic_node_id_grid(n_nodes_per_ele)
+            active = self.get_active_ele_mask()
+            nex, ney = active.shape
+            conn = np.empty((int(np.count_nonzero(active)), n_nodes_per_ele), dtype=np.int32)
+            for i, (dx, dy) in enumerate(self._quad_node_offsets[:n_nodes_per_ele]):
+                conn[:, i] = nids[dx:dx + 2 * nex:2, dy:dy + 2 * ney:2][active]
+            return conn
+        self._check_n_quad_nodes(n_nodes_per_ele)
+        return self._get_cached(f'quadratic_connectivity_{n_nodes_per_ele}', build)
+
+    def get_fd_ele_mask(self):
+        """Boolean grid that is True where an inactive element is inside a foundation - size=(nnx - 1, nny - 1)"""
+        def build():
+            active = self.get_active_ele_mask()
+            mask = np.zeros(active.shape, dtype=bool)
+            for xsi, xei, ysi, yei in self.fd_ele_boxes:
+                mask[xsi:xei, ysi:yei] = True
+            return mask & ~active
+        return self._get_cached('fd_ele_mask', build)
+
+    def get_boundary_sets(self, node_order='natural'):
+        """
+        Nodes and elements on the boundaries of the active elements
+
+        The faces of the active elements are classified by what is on the other side of the face:
+
+         - 'surface': inactive elements that are not in a foundation, or above the top of the mesh
+         - 'base', 'left', 'right': the bottom, left and right sides of the mesh
+         - 'foundation': inactive elements that are in a foundation (see `fd_ele_boxes`)
+         - 'interface_<i>_<j>': active elements of soil j, where the element is of soil i and i < j
+
+        Parameters
+        ----------
+        node_order: str
+            Node numbering (see `get_node_id_grid`)
+
+        Returns
+        -------
+        dict
+            Each value is a tuple of the sorted node ids and the sorted element ids on the boundary
+        """
+        def build():
+            active = self.get_active_ele_mask()
+            soil_grid = np.asarray(self._soil_grid)
+            # state of each element: 1 = air, 2 = foundation, 3 = active, padded with 0 (outside of the mesh)
+            state = np.zeros((active.shape[0] + 2, active.shape[1] + 2), dtype=np.int8)
+            state[1:-1, 1:-1] = np.where(active, 3, np.where(self.get_fd_ele_mask(), 2, 1))
+            nbrs = {
+                'top': state[1:-1, :-2],
+                'bottom': state[1:-1, 2:],
+                'left': state[:-2, 1:-1],
+                'right': state[2:, 1:-1],
+            }
+            # offsets of the two nodes of each face from the top-left node of the element
+            face_nodes = {'top': [(0, 0), (1, 0)], 'bottom': [(0, 1), (1, 1)], 'left': [(0, 0), (0, 1)],
+                          'right': [(1, 0), (1, 1)]}
+            face_masks = {
+                'surface': {'top': (nbrs['top'] <= 1), 'bottom': nbrs['bottom'] == 1, 'left': nbrs['left'] == 1,
+                            'right': nbrs['right'] == 1},
+                'base': {'bottom': nbrs['bottom'] == 0},
+                'left': {'left': nbrs['left'] == 0},
+                'right': {'right': nbrs['right'] == 0},
+                'foundation': {face: nbrs[face] == 2 for face in nbrs},
+            }
+            nids = self.get_node_id_grid(node_order)
+            eids = self.get_ele_id_grid()
+
+            def get_set(masks):
+                node_sets = []
+                ele_sets = []
+                for face in masks:
+                    xx, yy = np.nonzero(masks[face] & active)
+                    ele_sets.append(eids[xx, yy])
+                    for dx, dy in face_nodes[face]:
+                        node_sets.append(nids[xx + dx, yy + dy])
+                return np.unique(np.concatenate(node_sets)), np.unique(np.concatenate(ele_sets))
+
+            sets = {name: get_set(face_masks[name]) for name in face_masks}
+            # material interfaces, from the right and bottom faces of each element
+            pairs = []
+            for face, sg_nbr in [('right', soil_grid[1:]), ('bottom', soil_grid[:, 1:])]:
+                sg_ele = soil_grid[:-1] if face == 'right' else soil_grid[:, :-1]
+                act = active[:-1] & active[1:] if face == 'right' else active[:, :-1] & active[:, 1:]
+                xx, yy = np.nonzero(act & (sg_ele != sg_nbr))
+                if face == 'right':
+                    xx_nbr, yy_nbr = xx + 1, yy
+                else:
+                    xx_nbr, yy_nbr = xx, yy + 1
+                s0, s1 = soil_grid[xx, yy], soil_grid[xx_nbr, yy_nbr]
+                (dx0, dy0), (dx1, dy1) = face_nodes[face]
+                pairs.append(np.column_stack([np.minimum(s0, s1), np.maximum(s0, s1), eids[xx, yy],
+                                              eids[xx_nbr, yy_nbr], nids[xx + dx0, yy + dy0],
+                                              nids[xx + dx1, yy + dy1]]).astype(np.int64))
+            pairs = np.concatenate(pairs)
+            for s0, s1 in np.unique(pairs[:, :2], axis=0):
+                rows = pairs[(pairs[:, 0] == s0) & (pairs[:, 1] == s1)]
+                sets[f'interface_{s0}_{s1}'] = (np.unique(rows[:, 4:]), np.unique(rows[:, 2:4]))
+            return sets
+        return self._get_cached(f'boundary_sets_{node_order}', build)
+
+    def _get_ele_corner_coords(self):
+        """x and y coordinates of the corners of the active elements, counter-clockwise from the bottom-left"""
+        x = np.asarray(self.get_x_nodes2d(), dtype=float)
+        y = np.asarray(self._y_nodes, dtype=float)
+        active = self.get_active_ele_mask()
+        cxs = [x[:-1, 1:][active], x[1:, 1:][active], x[1:, :-1][active], x[:-1, :-1][active]]
+        cys = [y[:-1, 1:][active], y[1:, 1:][active], y[1:, :-1][active], y[:-1, :-1][active]]
+        return cxs, cys
+
+    def get_ele_areas(self):
+        """Area of each active element (shoelace formula) - size=(n_eles,)"""
+        def build():
+            cxs, cys = self._get_ele_corner_coords()
+            area = np.zeros(len(cxs[0]))
+            for i in range(4):
+                area += cxs[i] * cys[(i + 1) % 4] - cxs[(i + 1) % 4] * cys[i]
+            return area / 2
+        return self._get_cached('ele_areas', build)
+
+    def get_ele_centroids(self):
+        """Centroid of each active element - size=(n_eles, 2)"""
+        def build():
+            cxs, cys = self._get_ele_corner_coords()
+            centroids = np.zeros((len(cxs[0]), 2))
+            for i in range(4):
+                j = (i + 1) % 4
+                cross = cxs[i] * cys[j] - cxs[j] * cys[i]
+                centroids[:, 0] += (cxs[i] + cxs[j]) * cross
+                centroids[:, 1] += (cys[i] + cys[j]) * cross
+            with np.errstate(divide='ignore', invalid='ignore'):
+                centroids /= 6 * self.get_ele_areas()[:, np.newaxis]
+            return centroids
+        return self._get_cached('ele_centroids', build)
+
+    def get_ele_nodal_areas(self):
+        """
+        Area of each active element lumped to its nodes - size=(n_eles, 4), nodes ordered as in `get_connectivity`
 
+        The areas are the row sums of the consistent mass matrix of a bilinear element, `(A + T_i) / 6`, where `A`
+        is the element area and `T_i` is the area of the triangle formed by node `i` and its neighbours, so
+        distorted elements are lumped exactly (a quarter of the area for parallelograms).
+        """
+        def build():
+            cxs, cys = self._get_ele_corner_coords()
+            areas = self.get_ele_areas()
+            nodal = np.empty((len(areas), 4))
+            for i in range(4):
+                p, n = (i - 1) % 4, (i + 1) % 4
+                tri = ((cxs[n] - cxs[i]) * (cys[p] - cys[i]) - (cys[n] - cys[i]) * (cxs[p] - cxs[i])) / 2
+                nodal[:, i] = (areas + tri) / 6
+            return nodal
+        return self._get_cached('ele_nodal_areas', build)
+
+    def get_nodal_masses(self, ele_densities=None, prop='unit_dry_mass', thickness=1.0, node_order='natural'):
+        """
+        Lumped mass of each active node - size=(n_nodes,)
+
+        Parameters
+        ----------
+        ele_densities: array_like
+            Mass density of each active element - size=(n_eles,), if None then the soil property `prop` is used
+            and the result is cached
+        prop: str
+            Name of the soil mass density property (e.g. 'unit_dry_mass' or 'unit_sat_mass')
+        thickness: float
+            Out-of-plane thickness of the elements
+        node_order: str
+            Node numbering (see `get_node_id_grid`)
+        """
+        def build():
+            if ele_densities is None:
+                densities = self.get_ele_property_fields([prop])[prop][self.get_active_ele_mask()]
+                if np.any(np.isnan(densities)):
+                    raise ValueError(f'{prop} must be set for all soils to compute the nodal masses')
+            else:
+                densities = np.asarray(ele_densities, dtype=float)
+                if densities.shape != (self.n_eles,):
+                    raise ValueError(f'ele_densities must have size=({self.n_eles},), shape={densities.shape}')
+            weights = self.get_ele_nodal_areas() * (densities * thickness)[:, np.newaxis]
+            return np.bincount(self.get_connectivity(node_order).ravel(), weights=weights.ravel(),
+                               minlength=self.n_nodes)
+        if ele_densities is not None:
+            return build()
+        return self._get_cached(f'nodal_masses_{prop}_{thickness}_{node_order}', build)
+
+    def get_partitions(self, n_parts):
+        """
+        Splits the active elements into balanced subdomains using recursive coordinate bisection
+
+        Returns
+        -------
+        list of sfsimodels.num.mesh.partition.MeshPartition
+        """
+        return partition.partition_mesh(self, n_parts)
+
+    def get_ragged_mesh(self):
+        """
+        Active-only representation of the mesh, with the active nodes and elements of each column stored in
+        compressed sparse column form
+
+        Returns
+        -------
+        sfsimodels.num.mesh.ragged.RaggedVary2DMesh
+        """
+        return ragged.RaggedVary2DMesh.from_femesh(self)
+
+    def get_ele_soil_ids(self):
+        """Index of the soil (in `soils`) of each active element - size=(n_eles,)"""
+        def build():
+            return np.ascontiguousarray(np.asarray(self._soil_grid)[self.get_active_ele_mask()], dtype=np.int32)
+        return self._get_cached('ele_soil_ids', build)
+
+    def _get_ele_soil_index_grid(self):
+        """Soil index of each element, inactive elements are set to len(soils) - size=(nnx - 1, nny - 1)"""
+        def build():
+            return np.where(self.get_active_ele_mask(), np.asarray(self._soil_grid), len(self.soils)).astype(int)
+        return self._get_cached('ele_soil_index_grid', build)
+
+    def _get_soil_ele_index(self):
+        """
+        Inverted index from soil index to flat element indexes (in `soil_grid.ravel()`)
+
+        Returns
+        -------
+        order: np.ndarray
+            Flat indexes of the active elements sorted by soil index then flat index
+        splits: np.ndarray
+            Elements of soil `i` are `order[splits[i]:splits[i + 1]]` - size=(len(soils) + 1,)
+        """
+        def build():
+            soil_inds = self._get_ele_soil_index_grid().ravel()
+            order = np.argsort(soil_inds, kind='stable')
+            splits = np.searchsorted(soil_inds[order], np.arange(len(self.soils) + 1))
+            return order, splits
+        return self._get_cached('soil_ele_index', build)
+
+    def get_ele_flat_indexes_by_soil(self, soil_inds):
+        """
+        Flat indexes (in `soil_grid.ravel()`) of the elements of one or more soils
+
+        Parameters
+        ----------
+        soil_inds: int or array_like
+            Index (or indexes) of the soils in `soils`
+
+        Returns
+        -------
+        np.ndarray
+            Sorted by the order of `soil_inds` then by flat index
+        """
+        order, splits = self._get_soil_ele_index()
+        soil_inds = np.atleast_1d(np.asarray(soil_inds, dtype=int))
+        if not len(soil_inds):
+            return np.zeros(0, dtype=order.dtype)
+        return np.concatenate([order[splits[i]:splits[i + 1]] for i in soil_inds])
+
+    def get_ele_flat_indexes_by_type(self, stype):
+        """Flat indexes (in `soil_grid.ravel()`) of the elements with soils of type `stype`"""
+        return self.get_ele_flat_indexes_by_soil([i for i, sl in enumerate(self.soils) if sl.type == stype])
+
+    def get_ele_flat_indexes_by_hash(self, unique_hash):
+        """Flat indexes (in `soil_grid.ravel()`) of the elements of the soil with the `unique_hash`"""
+        return self.get_ele_flat_indexes_by_soil([i for i, sl in enumerate(self.soils) if sl.unique_hash == unique_hash])
+
+    def get_ele_index_by_type(self, stype):
+        """Grid indexes of the elements with soils of type `stype` (as returned by `np.unravel_index`)"""
+        return np.unravel_index(self.get_ele_flat_indexes_by_type(stype), np.shape(self.soil_grid))
 
-class FiniteElementVaryY2DMesh(PhysicalObject):
+    def _to_ele_grid(self, values):
+        """Scatters values of the active elements to the element grid, nan where inactive"""
+        active = self.get_active_ele_mask()
+        grid = np.full(active.shape, np.nan)
+        grid[active] = values
+        return grid
+
+    def get_ele_property_fields(self, props, v_eff_stress=None, saturated=False):
+        """
+        Soil properties of all elements - each size=(nnx - 1, nny - 1), nan where inactive
+
+        Properties are found in the same way as `SoilProfile.gen_split`, using the `get_<prop>_at_v_eff_stress`
+        method of the soil if it exists (stress dependent soils), else the `get_<prop>` method, else the attribute.
+
+        Parameters
+        ----------
+        props: list of str
+            Names of the properties (e.g. 'unit_dry_mass', 'g_mod', 'bulk_mod', 'shear_vel', 'permeability')
+        v_eff_stress: array_like
+            Vertical effective stress at the element centres - size=(nnx - 1, nny - 1), required if a stress
+            dependent property is requested
+        saturated: bool or array_like
+            if true then saturated properties are used (e.g. for 'shear_vel' and 'unit_mass'), can be an
+            array - size=(nnx - 1, nny - 1)
+
+        Returns
+        -------
+        dict
+        """
+        active = self.get_active_ele_mask()
+        saturated = np.broadcast_to(np.asarray(saturated, dtype=bool), active.shape)[active]
+        if v_eff_stress is not None:
+            v_eff_stress = np.broadcast_to(np.asarray(v_eff_stress, dtype=float), active.shape)[active]
+        fields = self._get_active_ele_property_fields(props, v_eff_stress=v_eff_stress, saturated=saturated)
+        return {item: self._to_ele_grid(fields[item]) for item in fields}
+
+    def get_ele_stress_fields(self, gwl=1e6, unit_water_weight=9800., x_surf=None, y_surf=None):
+        """
+        Initial vertical stresses and hydrostatic pore pressure at the element centres - each
+        size=(nnx - 1, nny - 1), nan where inactive
+
+        The overburden is integrated down each column of elements, using the dry unit weight
+        (`Soil.get_unit_weight_or('dry')`) above the ground water level and the saturated unit weight below.
+        Water above the ground surface adds to the total stress. Inactive elements (e.g. foundations) carry no weight.
+
+        Parameters
+        ----------
+        gwl: float or array_like
+            if a float then the depth of the ground water level below the ground surface (same as
+            `SoilProfile.gwl`), else the coordinates of the ground water level [[x0, y0], [x1, y1], ...]
+            (e.g. `TwoDSystem.gwl`) interpolated along the x-axis
+        unit_water_weight: float
+            Unit weight of water
+        x_surf: array_like
+            x-coordinates of the ground surface (e.g. `TwoDSystem.x_surf`), if None then the ground surface is the
+            top of the active elements, interpolated across the columns of the foundations (see `fd_ele_boxes`)
+        y_surf: array_like
+            y-coordinates of the ground surface
+
+        Returns
+        -------
+        dict
+            'v_total_stress', 'pore_pressure' and 'v_eff_stress'
+        """
+        fields = self._get_active_ele_stress_fields(gwl=gwl, unit_water_weight=unit_water_weight, x_surf=x_surf,
+                                                    y_surf=y_surf)
+        return {item: self._to_ele_grid(fields[item]) for item in fields}
+
+
+class FiniteElementVaryY2DMesh(FiniteElementVary2DMeshBase):
     base_type = 'femesh'
     type = 'vary_y2d'
 
@@ -928,6 +1880,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
         self._soils = soils
         self.inactive_value = inactive_value
         self.inputs = ['x_nodes', 'y_nodes', 'soil_grid', 'soils']
+        self._cache = {}
 
     def get_active_nodes(self):
         active_nodes = np.ones((len(self._x_nodes), len(self._y_nodes[0])), dtype=int)  # Start with all active
@@ -959,6 +1912,10 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
     def get_nearest_node_index_at_x(self, x):
         return np.argmin(abs(self.x_nodes - x))
 
+    def get_x_nodes2d(self):
+        """x-position of all nodes - size=(nnx, nny)"""
+        return self._get_cached('x_nodes2d', lambda: np.asarray(self._x_nodes)[:, np.newaxis] * np.ones_like(self._y_nodes))
+
     @property
     def nny(self):
         return len(self._y_nodes[0])
@@ -971,6 +1928,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
         """Adjusts the node coordinates to a certain number of decimal places"""
         self._y_nodes = np.round(self._y_nodes, dp)
         self._x_nodes = np.round(self._x_nodes, dp)
+        self.reset_cache()
 
     @property
     def x_nodes(self):
@@ -982,6 +1940,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
             self._x_nodes = np.loadtxt(x_nodes)
         else:
             self._x_nodes = x_nodes
+        self.reset_cache()
 
     @property
     def y_nodes(self):
@@ -994,6 +1953,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
             self._y_nodes = np.loadtxt(y_nodes)
         else:
             self._y_nodes = y_nodes
+        self.reset_cache()
 
     @property
     def soil_grid(self):
@@ -1005,6 +1965,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
             self._soil_grid = np.loadtxt(soil_grid)
         else:
             self._soil_grid = soil_grid
+        self.reset_cache()
 
     def add_to_dict(self, models_dict, **kwargs):
         if self.base_type not in models_dict:
@@ -1013,7 +1974,7 @@ class FiniteElementVaryY2DMesh(PhysicalObject):
             models_dict["soil"] = {}
 
 
-class FiniteElementVaryXY2DMesh(PhysicalObject):
+class FiniteElementVaryXY2DMesh(FiniteElementVary2DMeshBase):
     base_type = 'femesh'
     type = 'vary_xy2d'
 
@@ -1026,6 +1987,7 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
         self._soils = soils
         self.inactive_value = inactive_value
         self.inputs = ['x_nodes', 'y_nodes', 'soil_grid', 'soils']
+        self._cache = {}
 
     def get_active_nodes(self):
         active_nodes = np.ones((len(self._x_nodes), len(self._y_nodes[0])), dtype=int)  # Start with all active
@@ -1057,6 +2019,10 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
     # def get_nearest_node_index_at_x(self, x, y):
     #     return np.argmin(abs(self.x_nodes - x))
 
+    def get_x_nodes2d(self):
+        """x-position of all nodes - size=(nnx, nny)"""
+        return self._x_nodes
+
     def build_node_coords_mesh(self):
         self.node_coords_mesh = np.array([self.x_nodes, self.y_nodes]).transpose(1, 2, 0)
 
@@ -1083,17 +2049,6 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
         arr_s = np.shape(self.ele_coords_mesh)[:-1]
         return np.dstack(np.unravel_index(np.argsort(norms.ravel())[:n], arr_s))[0]
 
-    def get_ele_index_by_type(self, stype):
-        s_inds = []
-        for i, sl in enumerate(self.soils):
-            if sl.type == stype:
-                s_inds.append(i)
-        s_inds = np.array(s_inds)
-        arr_s = np.shape(self.soil_grid)
-        pmesh_inds = np.where(self.soil_grid.flatten() == s_inds[:, None])
-        pmesh_inds = np.unravel_index(pmesh_inds[1], arr_s)
-        return pmesh_inds
-
     @property
     def nny(self):
         return len(self._y_nodes[0])
@@ -1106,6 +2061,7 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
         """Adjusts the node coordinates to a certain number of decimal places"""
         self._y_nodes = np.round(self._y_nodes, dp)
         self._x_nodes = np.round(self._x_nodes, dp)
+        self.reset_cache()
 
     @property
     def x_nodes(self):
@@ -1117,6 +2073,7 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
             self._x_nodes = np.loadtxt(x_nodes)
         else:
             self._x_nodes = x_nodes
+        self.reset_cache()
         self.coords_mesh = None
 
     @property
@@ -1129,6 +2086,7 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
             self._y_nodes = np.loadtxt(y_nodes)
         else:
             self._y_nodes = y_nodes
+        self.reset_cache()
         self.coords_mesh = None
 
     @property
@@ -1141,6 +2099,7 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
             self._soil_grid = np.loadtxt(soil_grid)
         else:
             self._soil_grid = soil_grid
+        self.reset_cache()
 
     def add_to_dict(self, models_dict, **kwargs):
         if self.base_type not in models_dict:
@@ -1149,40 +2108,126 @@ class FiniteElementVaryXY2DMesh(PhysicalObject):
             models_dict["soil"] = {}
 
     def get_change_coords_at_depth_offset(self, x_coords, y_coords, offset, tol=0):
-        prev_ind = np.where(self.soil_grid[0] != self.inactive_value)[0][0]
-        coords = [[self.x_nodes[0][prev_ind + 1]],
-                  [self.y_nodes[0][prev_ind + 1]]]
-        for i in range(self.nnx - 1):
-            active_ind = np.where(self.soil_grid[i] != self.inactive_value)[0][0]
-            if active_ind != prev_ind:
-                coords[0].append(self.x_nodes[i + 1][prev_ind + 1])
-                coords[1].append(self.y_nodes[i + 1][prev_ind + 1])
-            coords[0].append(self.x_nodes[i + 1][active_ind + 1])
-            coords[1].append(self.y_nodes[i + 1][active_ind + 1])
-            prev_ind = active_ind
-        coords = np.array(coords)
-        slopes = np.diff(coords[1]) / np.diff(coords[0])
-        diff_slopes = np.diff(slopes)
-        inds = np.where(abs(diff_slopes) > tol)[0] + 1
-        inds = np.array([0] + list(inds) + [len(coords[0]) -1], dtype=int)
+        """
+        Coordinates where the slope changes along the line of nodes `offset` elements below the top element
+
+        Parameters
+        ----------
+        x_coords: array_like
+            Not used
+        y_coords: array_like
+            Not used
+        offset: int
+            Number of elements below the bottom of the top active element of each column (0 is the bottom of the
+            top element), limited to the base of the mesh
+        tol: float
+            Minimum change in slope to be returned
+
+        Returns
+        -------
+        array_like (2, n)
+            x- and y-coordinates of the first and last nodes and of the nodes where the slope changes
+        """
+        active = self.get_active_ele_mask()
+        top_inds = np.argmax(active, axis=1)  # top active element of each column
+        prev_inds = np.concatenate([top_inds[:1], top_inds[:-1]])
+        cols = np.arange(1, self.nnx)
+        # at each column the previous offset node if the surface steps, then the offset node below the top element
+        y_offs = np.minimum(top_inds + 1 + int(offset), self.nny - 1)
+        prev_offs = np.minimum(prev_inds + 1 + int(offset), self.nny - 1)
+        y_inds = np.column_stack([prev_offs, y_offs]).ravel()
+        x_inds = np.repeat(cols, 2)
+        keep = np.column_stack([top_inds != prev_inds, np.ones(len(cols), dtype=bool)]).ravel()
+        x_inds = np.concatenate([[0], x_inds[keep]])
+        y_inds = np.concatenate([[y_offs[0]], y_inds[keep]])
+        coords = np.array([self.x_nodes[x_inds, y_inds], self.y_nodes[x_inds, y_inds]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.diff(coords[1]) / np.diff(coords[0])
+            diff_slopes = np.diff(slopes)
+        inds = np.concatenate([[0], np.where(abs(diff_slopes) > tol)[0] + 1, [len(coords[0]) - 1]])
         ccoords = coords.T[inds].T
         return ccoords
 
 
-def construct_femesh_vary_xy(tds, dy_target, x_scale_pos=None, x_scale_vals=None):
+def _construct_femesh_vary(tds, dy_target, x_scale_pos, x_scale_vals, smooth_surf, mesh_class, cache_dir,
+                           cache_max_size):
+    if cache_dir is not None:
+        mesh_cache = cache.MeshCache(cache_dir, max_size=cache_max_size)
+        key = cache.get_mesh_key(tds, mesh_class.type, dy_target=dy_target, x_scale_pos=x_scale_pos,
+                                 x_scale_vals=x_scale_vals)
+        arrays = mesh_cache.load(key)
+        if arrays is not None:
+            soils = cache.get_system_soils(tds)[0]
+            femesh = mesh_class(arrays['x_nodes'], arrays['y_nodes'], arrays['soil_grid'], soils,
+                                inactive_value=float(arrays['inactive_value']))
+            femesh.fd_ele_boxes = arrays['fd_ele_boxes']
+            return femesh
     fc = FiniteElementVary2DMeshConstructor(tds, dy_target, x_scale_pos=x_scale_pos, x_scale_vals=x_scale_vals,
-                                            smooth_surf=True)
+                                            smooth_surf=smooth_surf)
     femesh = fc.femesh
-    assert isinstance(femesh, FiniteElementVaryXY2DMesh)
+    assert isinstance(femesh, mesh_class)
+    if cache_dir is not None:
+        mesh_cache.save(key, x_nodes=np.asarray(femesh.x_nodes), y_nodes=np.asarray(femesh.y_nodes),
+                        soil_grid=np.asarray(femesh.soil_grid), inactive_value=femesh.inactive_value,
+                        fd_ele_boxes=np.asarray(femesh.fd_ele_boxes))
     return femesh
 
 
-def construct_femesh_vary_y(tds, dy_target, x_scale_pos=None, x_scale_vals=None):
-    fc = FiniteElementVary2DMeshConstructor(tds, dy_target, x_scale_pos=x_scale_pos, x_scale_vals=x_scale_vals,
-                                            smooth_surf=False)
-    femesh = fc.femesh
-    assert isinstance(femesh, FiniteElementVaryY2DMesh)
-    return femesh
+def construct_femesh_vary_xy(tds, dy_target, x_scale_pos=None, x_scale_vals=None, cache_dir=None,
+                             cache_max_size=None):
+    """
+    Builds a mesh with node x-positions that vary with depth so that the surface is smooth
+
+    Parameters
+    ----------
+    tds: TwoDSystem
+        A two dimensional system of models
+    dy_target: float
+        Target height of elements
+    x_scale_pos: array_like
+        x-positions used to provide scale factors for element widths
+    x_scale_vals: array_like
+        scale factors for element widths
+    cache_dir: str
+        if not None then meshes are stored in (and loaded from) this directory, keyed by a hash of the system
+        and the inputs, see `sfsimodels.num.mesh.cache.MeshCache`
+    cache_max_size: int
+        Maximum size of the cache directory in bytes, the least recently used meshes are removed first
+
+    Returns
+    -------
+    FiniteElementVaryXY2DMesh
+    """
+    return _construct_femesh_vary(tds, dy_target, x_scale_pos, x_scale_vals, True, FiniteElementVaryXY2DMesh,
+                                  cache_dir, cache_max_size)
+
+
+def construct_femesh_vary_y(tds, dy_target, x_scale_pos=None, x_scale_vals=None, cache_dir=None, cache_max_size=None):
+    """
+    Builds a mesh with vertical columns of nodes
+
+    Parameters
+    ----------
+    tds: TwoDSystem
+        A two dimensional system of models
+    dy_target: float
+        Target height of elements
+    x_scale_pos: array_like
+        x-positions used to provide scale factors for element widths
+    x_scale_vals: array_like
+        scale factors for element widths
+    cache_dir: str
+        if not None then meshes are stored in (and loaded from) this directory, keyed by a hash of the system
+        and the inputs, see `sfsimodels.num.mesh.cache.MeshCache`
+    cache_max_size: int
+        Maximum size of the cache directory in bytes, the least recently used meshes are removed first
+
+    Returns
+    -------
+    FiniteElementVaryY2DMesh
+    """
+    return _construct_femesh_vary(tds, dy_target, x_scale_pos, x_scale_vals, False, FiniteElementVaryY2DMesh,
+                                  cache_dir, cache_max_size)
 
 
 def _example_run():
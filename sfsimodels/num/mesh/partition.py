@@ -0,0 +1,162 @@
+import numpy as np
+
+
+class MeshPartition(object):
+    """
+    A subdomain of a finite element mesh
+
+    Parameters
+    ----------
+    index: int
+        Partition number
+    ele_ids: np.ndarray
+        Global ids of the elements in the partition
+    node_ids: np.ndarray
+        Global ids of all the nodes used by the elements of the partition
+    interface_node_ids: np.ndarray
+        Global ids of the nodes that are shared with other partitions
+    neighbours: dict
+        Keys are the indexes of the neighbouring partitions, values are the global ids of the shared nodes
+    """
+    def __init__(self, index, ele_ids, node_ids, interface_node_ids, neighbours):
+        self.index = index
+        self.ele_ids = ele_ids
+        self.node_ids = node_ids
+        self.interface_node_ids = interface_node_ids
+        self.neighbours = neighbours
+
+    def __repr__(self):
+        return f'MeshPartition({self.index}, n_eles={len(self.ele_ids)}, n_nodes={len(self.node_ids)})'
+
+    @property
+    def n_eles(self):
+        return len(self.ele_ids)
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    def get_local_connectivity(self, connectivity):
+        """Connectivity of the partition elements using local node numbers (positions in `node_ids`)"""
+        return np.searchsorted(self.node_ids, np.asarray(connectivity)[self.ele_ids]).astype(np.int32)
+
+
+def get_rcb_ele_partition(ele_coords, n_parts):
+    """
+    Splits elements into balanced partitions using recursive coordinate bisection
+
+    Each set of elements is cut perpendicular to its longest dimension, so that the cut (and therefore the number
+    of interface nodes) is as short as possible.
+
+    Parameters
+    ----------
+    ele_coords: array_like
+        Coordinates of the element centres - size=(n_eles, 2)
+    n_parts: int
+        Number of partitions
+
+    Returns
+    -------
+    np.ndarray
+        Partition index of each element
+    """
+    ele_coords = np.asarray(ele_coords, dtype=float)
+    n_parts = int(n_parts)
+    if n_parts < 1:
+        raise ValueError(f'n_parts must be greater than zero, n_parts={n_parts}')
+    if n_parts > len(ele_coords):
+        raise ValueError(f'n_parts ({n_parts}) cannot exceed the number of elements ({len(ele_coords)})')
+    parts = np.zeros(len(ele_coords), dtype=np.int32)
+    stack = [(np.arange(len(ele_coords)), n_parts, 0)]
+    while stack:
+        inds, n, offset = stack.pop()
+        if n == 1:
+            parts[inds] = offset
+            continue
+        coords = ele_coords[inds]
+        extents = np.ptp(coords, axis=0)
+        axis = int(np.argmax(extents))
+        order = np.lexsort((coords[:, 1 - axis], coords[:, axis]))
+        n_left = n // 2
+        n_split = int(np.round(len(inds) * n_left / n))
+        stack.append((inds[order[:n_split]], n_left, offset))
+        stack.append((inds[order[n_split:]], n - n_left, offset + n_left))
+    return parts
+
+
+def build_partitions(connectivity, ele_parts, n_parts=None):
+    """
+    Builds the element, node and interface lists of each partition
+
+    Parameters
+    ----------
+    connectivity: array_like
+        Node ids of each element - size=(n_eles, n_nodes_per_ele)
+    ele_parts: array_like
+        Partition index of each element
+    n_parts: int
+        Number of partitions, if None then taken as the maximum partition index plus one
+
+    Returns
+    -------
+    list of MeshPartition
+    """
+    conn = np.asarray(connectivity, dtype=np.int64)
+    ele_parts = np.asarray(ele_parts, dtype=np.int64)
+    if n_parts is None:
+        n_parts = int(ele_parts.max()) + 1
+    # unique (node, partition) pairs sorted by node then partition
+    keys = np.unique(conn.ravel() * n_parts + np.repeat(ele_parts, conn.shape[1]))
+    nodes = keys // n_parts
+    node_parts = keys % n_parts
+    n_parts_at_node = np.bincount(nodes)
+    shared = n_parts_at_node[nodes] > 1
+
+    # pairs of partitions that share a node (a node can be shared by at most n_nodes_per_ele partitions)
+    pairs = []
+    for d in range(1, conn.shape[1]):
+        same = np.where(nodes[d:] == nodes[:-d])[0]
+        pairs.append(np.array([node_parts[same], node_parts[same + d], nodes[same]]))
+    pairs = np.concatenate(pairs, axis=1)
+    pairs = np.concatenate([pairs, pairs[[1, 0, 2]]], axis=1)  # symmetric
+    pairs = pairs[:, np.lexsort((pairs[2], pairs[1], pairs[0]))]
+
+    ele_order = np.argsort(ele_parts, kind='stable')
+    ele_splits = np.searchsorted(ele_parts[ele_order], np.arange(n_parts + 1))
+    node_order = np.argsort(node_parts, kind='stable')
+    node_splits = np.searchsorted(node_parts[node_order], np.arange(n_parts + 1))
+    pair_splits = np.searchsorted(pairs[0], np.arange(n_parts + 1))
+    partitions = []
+    for pp in range(n_parts):
+        p_nodes = nodes[node_order[node_splits[pp]:node_splits[pp + 1]]]
+        p_shared = shared[node_order[node_splits[pp]:node_splits[pp + 1]]]
+        p_pairs = pairs[:, pair_splits[pp]:pair_splits[pp + 1]]
+        nbr_splits = np.where(np.diff(p_pairs[1]))[0] + 1
+        neighbours = {}
+        for group in np.split(p_pairs, nbr_splits, axis=1):
+            if group.shape[1]:
+                neighbours[int(group[1][0])] = group[2].astype(np.int32)
+        partitions.append(MeshPartition(pp, ele_order[ele_splits[pp]:ele_splits[pp + 1]].astype(np.int32),
+                                        p_nodes.astype(np.int32), p_nodes[p_shared].astype(np.int32), neighbours))
+    return partitions
+
+
+def partition_mesh(femesh, n_parts):
+    """
+    Splits the active elements of a mesh into balanced, contiguous partitions for parallel solvers
+
+    Parameters
+    ----------
+    femesh: FiniteElementVaryY2DMesh or FiniteElementVaryXY2DMesh
+        The mesh
+    n_parts: int
+        Number of partitions
+
+    Returns
+    -------
+    list of MeshPartition
+    """
+    conn = femesh.get_connectivity()
+    ele_coords = femesh.get_node_coords()[conn].mean(axis=1)
+    ele_parts = get_rcb_ele_partition(ele_coords, n_parts)
+    return build_partitions(conn, ele_parts, n_parts)
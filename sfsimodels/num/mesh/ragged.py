@@ -0,0 +1,338 @@
+import numpy as np
+
+from sfsimodels.num.mesh import active
+
+
+def get_column_runs(mask):
+    """
+    Column, first row and number of rows of each run of contiguous True entries in the columns of a grid
+
+    Parameters
+    ----------
+    mask: array_like
+        Boolean grid - size=(n_cols, n_rows)
+
+    Returns
+    -------
+    cols: np.ndarray
+        Column index of each run, runs are ordered by column then by first row - size=(n_runs,)
+    starts: np.ndarray
+        Row index of the first entry of each run - size=(n_runs,)
+    counts: np.ndarray
+        Number of entries in each run - size=(n_runs,)
+    """
+    mask = np.asarray(mask, dtype=bool)
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    cols, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    return cols.astype(np.int32), starts.astype(np.int32), (ends - starts).astype(np.int32)
+
+
+class RaggedVary2DMesh(active.ActiveMeshMixin):
+    """
+    Active-only representation of a vary mesh, stored as runs of contiguous active nodes and elements in each
+    column (a column has more than one run if it passes through a buried foundation)
+
+    Nodes and elements are numbered in the same (natural) order as the dense mesh, so ids, connectivity and
+    exported files are the same as those of the dense mesh, but memory scales with the number of active entries.
+    All queries are computed from the run storage and the active entries (see `ActiveMeshMixin`), element fields
+    are returned for the active elements - size=(n_eles,). FLAC grids are not supported as the coordinates of the
+    inactive grid points are not stored.
+
+    Parameters
+    ----------
+    mesh_type: str
+        Type of the dense mesh ('vary_y2d' or 'vary_xy2d')
+    nnx: int
+        Number of node columns of the grid
+    nny: int
+        Number of node rows of the grid
+    node_runs: tuple of array_like
+        Column, first row and number of rows of each run of active nodes (see `get_column_runs`)
+    node_x: array_like
+        x-coordinate of each column - size=(nnx,) (vary_y2d) or of each active node - size=(n_nodes,) (vary_xy2d)
+    node_y: array_like
+        y-coordinate of each active node - size=(n_nodes,)
+    ele_runs: tuple of array_like
+        Column, first row and number of rows of each run of active elements (see `get_column_runs`)
+    ele_soil_ids: array_like
+        Index of the soil (in `soils`) of each active element - size=(n_eles,)
+    soils: list
+        Soil objects
+    fd_ele_boxes: array_like
+        [x-start, x-end, y-start, y-end) element indexes of each foundation
+    """
+    def __init__(self, mesh_type, nnx, nny, node_runs, node_x, node_y, ele_runs, ele_soil_ids, soils,
+                 fd_ele_boxes=None):
+        self.type = mesh_type
+        self.nnx = int(nnx)
+        self.nny = int(nny)
+        self.node_run_cols, self.node_run_starts, self.node_run_counts = [np.asarray(arr, dtype=np.int32)
+                                                                         for arr in node_runs]
+        self.node_x = np.asarray(node_x, dtype=np.float64)
+        self.node_y = np.asarray(node_y, dtype=np.float64)
+        self.ele_run_cols, self.ele_run_starts, self.ele_run_counts = [np.asarray(arr, dtype=np.int32)
+                                                                      for arr in ele_runs]
+        self.ele_soil_ids = np.asarray(ele_soil_ids, dtype=np.int32)
+        self.soils = soils
+        if fd_ele_boxes is None:
+            fd_ele_boxes = np.zeros((0, 4), dtype=int)
+        self.fd_ele_boxes = np.asarray(fd_ele_boxes, dtype=int).reshape(-1, 4)
+        self.node_run_ptr = np.concatenate([[0], np.cumsum(self.node_run_counts, dtype=np.int64)])
+        self.ele_run_ptr = np.concatenate([[0], np.cumsum(self.ele_run_counts, dtype=np.int64)])
+        self._cache = {}
+
+    def __repr__(self):
+        return f'RaggedVary2DMesh({self.type}, n_nodes={self.n_nodes}, n_eles={self.n_eles})'
+
+    @classmethod
+    def from_femesh(cls, femesh):
+        """Builds the active-only representation of a `FiniteElementVaryY2DMesh` or `FiniteElementVaryXY2DMesh`"""
+        node_runs = get_column_runs(femesh.get_node_id_grid() >= 0)
+        ele_runs = get_column_runs(femesh.get_active_ele_mask())
+        coords = femesh.get_node_coords()
+        if femesh.type == 'vary_y2d':
+            node_x = np.asarray(femesh.x_nodes, dtype=np.float64)
+        else:
+            node_x = coords[:, 0]
+        return cls(femesh.type, femesh.nnx, femesh.nny, node_runs, node_x, coords[:, 1], ele_runs,
+                   femesh.get_ele_soil_ids(), femesh.soils, femesh.fd_ele_boxes)
+
+    def to_femesh(self):
+        """
+        Dense mesh with the same active nodes and elements
+
+        Coordinates of the inactive nodes are not stored, so they are set to nan.
+        """
+        from sfsimodels.num.mesh.mesh2d_vary_y import FiniteElementVaryY2DMesh, FiniteElementVaryXY2DMesh
+        inds = self.get_node_grid_indexes()
+        y_nodes = np.full((self.nnx, self.nny), np.nan)
+        y_nodes[inds[:, 0], inds[:, 1]] = self.node_y
+        if self.type == 'vary_y2d':
+            x_nodes = self.node_x.copy()
+            mesh_class = FiniteElementVaryY2DMesh
+        else:
+            x_nodes = np.full((self.nnx, self.nny), np.nan)
+            x_nodes[inds[:, 0], inds[:, 1]] = self.node_x
+            mesh_class = FiniteElementVaryXY2DMesh
+        soil_grid = np.full((self.nnx - 1, self.nny - 1), mesh_class.inactive_value)
+        e_inds = self.get_ele_grid_indexes()
+        soil_grid[e_inds[:, 0], e_inds[:, 1]] = self.ele_soil_ids
+        femesh = mesh_class(x_nodes, y_nodes, soil_grid, self.soils)
+        femesh.fd_ele_boxes = self.fd_ele_boxes.copy()
+        return femesh
+
+    @property
+    def nbytes(self):
+        """Memory used by the stored arrays in bytes"""
+        return sum([arr.nbytes for arr in [self.node_run_cols, self.node_run_starts, self.node_run_counts,
+                                           self.node_x, self.node_y, self.ele_run_cols, self.ele_run_starts,
+                                           self.ele_run_counts, self.ele_soil_ids]])
+
+    @property
+    def n_nodes(self):
+        """Number of active nodes"""
+        return int(self.node_run_ptr[-1])
+
+    @property
+    def n_eles(self):
+        """Number of active elements"""
+        return int(self.ele_run_ptr[-1])
+
+    def _get_cached(self, name, func):
+        if name not in self._cache:
+            self._cache[name] = func()
+        return self._cache[name]
+
+    def get_node_coords(self, node_order='natural'):
+        """Coordinates of the active nodes - size=(n_nodes, 2)"""
+        if node_order != 'natural':
+            return self._get_cached(f'node_coords_{node_order}', lambda: np.ascontiguousarray(
+                self.get_node_coords()[self.get_node_renumbering(node_order)[0]]))
+
+        def build():
+            coords = np.empty((self.n_nodes, 2), dtype=np.float64)
+            if self.type == 'vary_y2d':
+                coords[:, 0] = np.repeat(self.node_x[self.node_run_cols], self.node_run_counts)
+            else:
+                coords[:, 0] = self.node_x
+            coords[:, 1] = self.node_y
+            return coords
+        return self._get_cached('node_coords', build)
+
+    def get_ele_soil_ids(self):
+        """Index of the soil (in `soils`) of each active element - size=(n_eles,)"""
+        return self.ele_soil_ids
+
+    @staticmethod
+    def _get_grid_indexes(cols, starts, counts, ptr):
+        xx = np.repeat(cols, counts)
+        yy = np.arange(ptr[-1], dtype=np.int64) - np.repeat(ptr[:-1] - starts, counts)
+        return np.ascontiguousarray(np.column_stack([xx, yy]), dtype=np.int32)
+
+    def get_node_grid_indexes(self):
+        """The (x-index, y-index) of each active node in the node grid - size=(n_nodes, 2)"""
+        return self._get_cached('node_grid_indexes', lambda: self._get_grid_indexes(
+            self.node_run_cols, self.node_run_starts, self.node_run_counts, self.node_run_ptr))
+
+    def get_ele_grid_indexes(self):
+        """The (x-index, y-index) of each active element in the soil grid - size=(n_eles, 2)"""
+        return self._get_cached('ele_grid_indexes', lambda: self._get_grid_indexes(
+            self.ele_run_cols, self.ele_run_starts, self.ele_run_counts, self.ele_run_ptr))
+
+    @staticmethod
+    def _lookup(cols, starts, counts, ptr, n_cols, n_rows, xx, yy):
+        """Position of entries (xx, yy) in the run storage, -1 if not stored"""
+        xx = np.asarray(xx, dtype=np.int64)
+        yy = np.asarray(yy, dtype=np.int64)
+        inside = (xx >= 0) & (xx < n_cols) & (yy >= 0) & (yy < n_rows)
+        if not len(cols):
+            return np.full(np.shape(inside), -1, dtype=np.int64)
+        # runs are sorted by column then by first row, so the run that may contain an entry is the last run
+        # that starts at or before it
+        keys = cols.astype(np.int64) * n_rows + starts
+        runs = np.maximum(np.searchsorted(keys, xx * n_rows + yy, side='right') - 1, 0)
+        offset = yy - starts[runs]
+        found = inside & (cols[runs] == xx) & (offset >= 0) & (offset < counts[runs])
+        return np.where(found, ptr[runs] + offset, -1)
+
+    def get_node_ids_at(self, xx, yy):
+        """Node ids at grid indexes (xx, yy), -1 if inactive or outside the grid"""
+        return self._lookup(self.node_run_cols, self.node_run_starts, self.node_run_counts, self.node_run_ptr,
+                            self.nnx, self.nny, xx, yy)
+
+    def get_ele_ids_at(self, xx, yy):
+        """Element ids at grid indexes (xx, yy), -1 if inactive or outside the grid"""
+        return self._lookup(self.ele_run_cols, self.ele_run_starts, self.ele_run_counts, self.ele_run_ptr,
+                            self.nnx - 1, self.nny - 1, xx, yy)
+
+    def get_connectivity(self, node_order='natural'):
+        """
+        Node ids of each active element - size=(n_eles, 4)
+
+        Nodes are ordered counter-clockwise starting from the bottom-left node (same as the dense mesh).
+        """
+        if node_order != 'natural':
+            return self._get_cached(f'connectivity_{node_order}',
+                                    lambda: self.get_node_renumbering(node_order)[1][self.get_connectivity()])
+
+        def build():
+            inds = self.get_ele_grid_indexes()
+            xx, yy = inds[:, 0], inds[:, 1]
+            conn = np.empty((self.n_eles, 4), dtype=np.int32)
+            for i, (dx, dy) in enumerate([(0, 1), (1, 1), (1, 0), (0, 0)]):
+                conn[:, i] = self.get_node_ids_at(xx + dx, yy + dy)
+            return conn
+        return self._get_cached('connectivity', build)
+
+    def get_boundary_sets(self, node_order='natural'):
+        """
+        Nodes and elements on the boundaries of the active elements (see `FiniteElementVaryY2DMesh.get_boundary_sets`)
+
+        Returns
+        -------
+        dict
+            Each value is a tuple of the sorted node ids and the sorted element ids on the boundary
+        """
+        if node_order != 'natural':
+            def renumber_sets():
+                inv_perm = self.get_node_renumbering(node_order)[1]
+                return {name: (np.sort(inv_perm[nids]).astype(np.int32), eids)
+                        for name, (nids, eids) in self.get_boundary_sets().items()}
+            return self._get_cached(f'boundary_sets_{node_order}', renumber_sets)
+
+        def build():
+            inds = self.get_ele_grid_indexes()
+            xx, yy = inds[:, 0].astype(np.int64), inds[:, 1].astype(np.int64)
+            eids = np.arange(self.n_eles)
+            # offsets of the neighbouring element and of the two nodes of each face from the element
+            faces = {'top': ((0, -1), [(0, 0), (1, 0)]), 'bottom': ((0, 1), [(0, 1), (1, 1)]),
+                     'left': ((-1, 0), [(0, 0), (0, 1)]), 'right': ((1, 0), [(1, 0), (1, 1)])}
+            nbr_states = {}
+            nbr_ids = {}
+            for face, ((dx, dy), _) in faces.items():
+                nx, ny = xx + dx, yy + dy
+                ids = self.get_ele_ids_at(nx, ny)
+                inside = (nx >= 0) & (nx < self.nnx - 1) & (ny >= 0) & (ny < self.nny - 1)
+                in_fd = np.zeros(len(nx), dtype=bool)
+                for xsi, xei, ysi, yei in self.fd_ele_boxes:
+                    in_fd |= (nx >= xsi) & (nx < xei) & (ny >= ysi) & (ny < yei)
+                # 1 = air, 2 = foundation, 3 = active, 0 = outside of the mesh
+                nbr_states[face] = np.where(ids >= 0, 3, np.where(inside, np.where(in_fd, 2, 1), 0))
+                nbr_ids[face] = ids
+            face_masks = {
+                'surface': {'top': nbr_states['top'] <= 1, 'bottom': nbr_states['bottom'] == 1,
+                            'left': nbr_states['left'] == 1, 'right': nbr_states['right'] == 1},
+                'base': {'bottom': nbr_states['bottom'] == 0},
+                'left': {'left': nbr_states['left'] == 0},
+                'right': {'right': nbr_states['right'] == 0},
+                'foundation': {face: nbr_states[face] == 2 for face in faces},
+            }
+
+            def get_face_nodes(face, sel):
+                return [self.get_node_ids_at(xx[sel] + dx, yy[sel] + dy) for dx, dy in faces[face][1]]
+
+            sets = {}
+            for name, masks in face_masks.items():
+                node_sets = []
+                ele_sets = []
+                for face, mask in masks.items():
+                    ele_sets.append(eids[mask])
+                    node_sets += get_face_nodes(face, mask)
+                sets[name] = (np.unique(np.concatenate(node_sets)).astype(np.int32),
+                              np.unique(np.concatenate(ele_sets)).astype(np.int32))
+            # material interfaces, from the right and bottom faces of each element
+            pairs = []
+            for face in ['right', 'bottom']:
+                ids = nbr_ids[face]
+                sel = ids >= 0
+                sel[sel] = self.ele_soil_ids[sel] != self.ele_soil_ids[ids[sel]]
+                s0, s1 = self.ele_soil_ids[sel], self.ele_soil_ids[ids[sel]]
+                n0, n1 = get_face_nodes(face, sel)
+                pairs.append(np.column_stack([np.minimum(s0, s1), np.maximum(s0, s1), eids[sel], ids[sel], n0, n1]))
+            pairs = np.concatenate(pairs).astype(np.int64)
+            for s0, s1 in np.unique(pairs[:, :2], axis=0):
+                rows = pairs[(pairs[:, 0] == s0) & (pairs[:, 1] == s1)]
+                sets[f'interface_{s0}_{s1}'] = (np.unique(rows[:, 4:]).astype(np.int32),
+                                                np.unique(rows[:, 2:4]).astype(np.int32))
+            return sets
+        return self._get_cached('boundary_sets', build)
+
+    def _get_ele_corner_coords(self):
+        """x and y coordinates of the corners of each active element, ordered as in `get_connectivity`"""
+        def build():
+            coords = self.get_node_coords()
+            conn = self.get_connectivity()
+            return [coords[conn[:, i], 0] for i in range(4)], [coords[conn[:, i], 1] for i in range(4)]
+        return self._get_cached('ele_corner_coords', build)
+
+    def get_ele_property_fields(self, props, v_eff_stress=None, saturated=False):
+        """
+        Soil properties of the active elements - each size=(n_eles,), see
+        `FiniteElementVaryY2DMesh.get_ele_property_fields`
+
+        Parameters
+        ----------
+        props: list of str
+            Names of the properties (e.g. 'unit_dry_mass', 'g_mod', 'bulk_mod', 'shear_vel', 'permeability')
+        v_eff_stress: array_like
+            Vertical effective stress at the element centres - size=(n_eles,), required if a stress dependent
+            property is requested
+        saturated: bool or array_like
+            if true then saturated properties are used, can be an array - size=(n_eles,)
+
+        Returns
+        -------
+        dict
+        """
+        return self._get_active_ele_property_fields(props, v_eff_stress=v_eff_stress, saturated=saturated)
+
+    def get_ele_stress_fields(self, gwl=1e6, unit_water_weight=9800., x_surf=None, y_surf=None):
+        """
+        Initial vertical stresses and hydrostatic pore pressure at the centres of the active elements -
+        each size=(n_eles,), see `FiniteElementVaryY2DMesh.get_ele_stress_fields`
+        """
+        return self._get_active_ele_stress_fields(gwl=gwl, unit_water_weight=unit_water_weight, x_surf=x_surf,
+                                                  y_surf=y_surf)
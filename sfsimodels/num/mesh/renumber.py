@@ -0,0 +1,150 @@
+import numpy as np
+
+
+def get_node_adjacency(connectivity, n_nodes=None):
+    """
+    Builds the node adjacency graph of a mesh in compressed sparse row format
+
+    Two nodes are adjacent if they belong to the same element.
+
+    Parameters
+    ----------
+    connectivity: array_like
+        Node ids of each element - size=(n_eles, n_nodes_per_ele)
+    n_nodes: int
+        Total number of nodes, if None then taken as the maximum node id plus one
+
+    Returns
+    -------
+    indptr: np.ndarray
+        Start position of the neighbours of each node in `indices` - size=(n_nodes + 1,)
+    indices: np.ndarray
+        Neighbouring node ids
+    """
+    conn = np.asarray(connectivity, dtype=np.int64)
+    if n_nodes is None:
+        n_nodes = int(conn.max()) + 1
+    npe = conn.shape[1]
+    ii, jj = np.where(~np.eye(npe, dtype=bool))
+    rows = conn[:, ii].ravel()
+    cols = conn[:, jj].ravel()
+    keys = np.unique(rows * n_nodes + cols)
+    rows = keys // n_nodes
+    indices = (keys % n_nodes).astype(np.int32)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    return indptr, indices
+
+
+def _gather_neighbours(indptr, indices, nodes):
+    """Neighbours of a set of nodes, also returns the position in `nodes` of the parent of each neighbour"""
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(np.sum(counts))
+    if total == 0:
+        return np.zeros(0, dtype=indices.dtype), np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    parents = np.repeat(np.arange(len(nodes)), counts)
+    return indices[offsets + np.arange(total)], parents
+
+
+def _get_bfs_levels(indptr, indices, start, visited):
+    """Level structure from a start node, `visited` is not modified"""
+    visited = visited.copy()
+    visited[start] = True
+    levels = [np.array([start])]
+    while True:
+        nbrs, _ = _gather_neighbours(indptr, indices, levels[-1])
+        nbrs = np.unique(nbrs[~visited[nbrs]])
+        if not len(nbrs):
+            return levels
+        visited[nbrs] = True
+        levels.append(nbrs)
+
+
+def _get_pseudo_peripheral_node(indptr, indices, start, visited, degrees):
+    """Finds a node near the periphery of the graph component (George and Liu, 1979)"""
+    levels = _get_bfs_levels(indptr, indices, start, visited)
+    for i in range(len(degrees)):
+        last = levels[-1]
+        cand = last[np.argmin(degrees[last])]
+        cand_levels = _get_bfs_levels(indptr, indices, cand, visited)
+        if len(cand_levels) <= len(levels):
+            return start
+        start = cand
+        levels = cand_levels
+    return start
+
+
+def get_rcm_permutation(connectivity, n_nodes=None, start_nodes=None):
+    """
+    Computes the reverse Cuthill-McKee node ordering that reduces the bandwidth of the system matrix
+
+    Parameters
+    ----------
+    connectivity: array_like
+        Node ids of each element - size=(n_eles, n_nodes_per_ele)
+    n_nodes: int
+        Total number of nodes, if None then taken as the maximum node id plus one
+    start_nodes: array_like
+        Ordered node ids that form the first level of the ordering (e.g. a boundary of the mesh),
+        if None then the ordering starts from a pseudo-peripheral node
+
+    Returns
+    -------
+    perm: np.ndarray
+        Old node id at each new position, i.e. new_coords = coords[perm]
+    inv_perm: np.ndarray
+        New node id of each old node, i.e. new_connectivity = inv_perm[connectivity]
+    """
+    indptr, indices = get_node_adjacency(connectivity, n_nodes=n_nodes)
+    n_nodes = len(indptr) - 1
+    degrees = np.diff(indptr)
+    visited = np.zeros(n_nodes, dtype=bool)
+    order = []
+    n_ordered = 0
+    while n_ordered < n_nodes:  # each pass orders one connected component
+        if start_nodes is not None and not n_ordered:
+            frontier = np.unique(np.asarray(start_nodes), return_index=True)[1]
+            frontier = np.asarray(start_nodes)[np.sort(frontier)]
+        else:
+            unvisited = np.where(~visited)[0]
+            start = unvisited[np.argmin(degrees[unvisited])]
+            frontier = np.array([_get_pseudo_peripheral_node(indptr, indices, start, visited, degrees)])
+        visited[frontier] = True
+        while len(frontier):
+            order.append(frontier)
+            n_ordered += len(frontier)
+            nbrs, parents = _gather_neighbours(indptr, indices, frontier)
+            keep = ~visited[nbrs]
+            nbrs = nbrs[keep]
+            parents = parents[keep]
+            # children are numbered in order of their parent, then by increasing degree
+            inds = np.lexsort((degrees[nbrs], parents))
+            nbrs = nbrs[inds]
+            uniq, first = np.unique(nbrs, return_index=True)
+            frontier = nbrs[np.sort(first)]
+            visited[frontier] = True
+    perm = np.concatenate(order)[::-1].astype(np.int32)
+    inv_perm = np.empty(n_nodes, dtype=np.int32)
+    inv_perm[perm] = np.arange(n_nodes, dtype=np.int32)
+    return perm, inv_perm
+
+
+def calc_bandwidth(connectivity, inv_perm=None):
+    """
+    Computes the half-bandwidth of the system matrix (maximum difference in node id within an element)
+
+    Parameters
+    ----------
+    connectivity: array_like
+        Node ids of each element - size=(n_eles, n_nodes_per_ele)
+    inv_perm: array_like
+        New node id of each old node, if not None then the bandwidth is computed for the renumbered nodes
+    """
+    conn = np.asarray(connectivity)
+    if inv_perm is not None:
+        conn = np.asarray(inv_perm)[conn]
+    if not len(conn):
+        return 0
+    return int(np.max(conn.max(axis=1) - conn.min(axis=1)))
@@ -16,13 +16,13 @@ def read_json_sensor_file(ffp):
     return si
 
 
-def get_all_sensor_codes(si, wild_sensor_code):
+def get_all_sensor_numbers(si, wild_sensor_code):
     """
-    Get all sensor sensor_codes that match a wild sensor code
+    Get the motion type and number of all sensors that match a wild sensor code
 
     :param si: dict, sensor index json dictionary
     :param wild_sensor_code: str, a sensor code with "*" for wildcards (e.g. ACCX-*-L2C-*)
-    :return:
+    :return: list of tuples, (motion type, sensor number)
     """
     mtype_and_ory, x, y, z = wild_sensor_code.split("-")
     if mtype_and_ory == "*":
@@ -32,16 +32,27 @@ def get_all_sensor_codes(si, wild_sensor_code):
     else:
         mtypes = [mtype_and_ory]
 
-    all_sensor_codes = []
+    all_sensor_numbers = []
     for mtype in mtypes:
         for m_number in si[mtype]:
             if x in ["*", si[mtype][m_number]['X-CODE']] and \
                     y in ["*", si[mtype][m_number]['Y-CODE']] and \
                     z in ["*", si[mtype][m_number]['Z-CODE']]:
-                cc = get_sensor_code_by_number(si, mtype, m_number)
-                all_sensor_codes.append(cc)
+                all_sensor_numbers.append((mtype, m_number))
 
-    return all_sensor_codes
+    return all_sensor_numbers
+
+
+def get_all_sensor_codes(si, wild_sensor_code):
+    """
+    Get all sensor sensor_codes that match a wild sensor code
+
+    :param si: dict, sensor index json dictionary
+    :param wild_sensor_code: str, a sensor code with "*" for wildcards (e.g. ACCX-*-L2C-*)
+    :return:
+    """
+    return [get_sensor_code_by_number(si, mtype, m_number)
+            for mtype, m_number in get_all_sensor_numbers(si, wild_sensor_code)]
 
 
 def create_motion_name(test_name, sensor_code, code_suffix=""):
@@ -126,20 +137,34 @@ def get_depth_by_code(si, sensor_code, coords='auto', surface=None):
     mtype, sensor_number = get_mtype_and_number_from_code(si, sensor_code)
     if sensor_number is None:
         raise KeyError("Depth not found for sensor_code: %s" % sensor_code)
+    return convert_y_to_depth(si, si[mtype][sensor_number]['y'], coords=coords, surface=surface)
+
+
+def convert_y_to_depth(si, y, coords='auto', surface=None):
+    """
+    Convert sensor y-coordinates to depth from surface as a positive value for downwards
+
+    :param si: dict, sensor index json dictionary
+    :param y: float or array_like, y-coordinates of sensors
+    :param coords: str
+        options: 'auto', '+ve' or '-ve' or 'rev+ve'
+    :param surface:
+    :return:
+    """
     if coords == 'auto':
         surface = get_surface_height(si)
         if surface is None:
             raise ValueError('Cannot detect surface height, define coord system and include surface height as an input')
-        return surface - si[mtype][sensor_number]['y']
+        return surface - y
     elif coords == '+ve':
-        return si[mtype][sensor_number]['y']
+        return y
     elif coords == '-ve':  # FLAC
-        return -si[mtype][sensor_number]['y']
+        return -y
     elif coords == 'rev+ve':  # reverse positive (surface is a positive number, numbers decrease with depth)
         if surface is None:
             surface = get_surface_height(si)
         if surface is None:
             raise ValueError('Cannot detect surface height, include surface height as an input')
-        return -si[mtype][sensor_number]['y']
+        return -y
     else:
         raise ValueError(f"coords={coords}, does not match: ['auto', '+ve', '-ve', 'rev+ve']")
@@ -63,3 +63,64 @@ def test_interp2d_at_edge():
     print(f_interp)
     assert f_interp[0][0] == 0
     assert f_interp[1][0] == 10.
+
+
+def test_interp2d_out_and_chunks():
+    f = np.array([[0, 0, 0],
+                  [0, 1, 4],
+                  [2, 6, 2],
+                  [10, 10, 10]
+                  ])
+    xf = np.array([0, 1, 2, 3])
+    x = np.array([-1, 0, 0.5, 1, 2.2, 2.5, 3, 4.])
+    expected = fns.interp2d(x, xf, f)
+    assert np.isclose(expected[:, 1], [0, 0, 0.5, 1, 6.8, 8, 10, 10]).all(), expected[:, 1]
+    out = np.zeros((len(x), 3))
+    f_interp = fns.interp2d(x, xf, f, out=out, chunk_size=3)
+    assert f_interp is out
+    assert np.array_equal(out, expected)
+    with pytest.raises(ValueError):
+        fns.interp2d(x, xf, f, out=np.zeros((len(x), 2)))
+
+
+def test_interp3d_array_x():
+    xs = np.array([0.0, 4.0, 10.0])
+    ys_at_xs = [np.array([0, 2, 4]), np.array([0, 1, 3, 4]), np.array([0, 4])]
+    f = [np.array([0., -1, -2]), np.array([-1., -2, -3, -4]), np.array([-2., -5])]
+    y = np.array([0, 1, 2.5, 4])
+    x = np.array([0.0, 1.5, 4.0, 7.0, 10.0])
+    vals = fns.interp3d(x, y, xs, ys_at_xs, f)
+    assert vals.shape == (len(x), len(y))
+    for i in range(len(x)):
+        val = fns.interp3d(x[i], y, xs, ys_at_xs, f)
+        assert val.shape == (len(y),)
+        assert np.array_equal(vals[i], val)
+    assert np.isclose(vals[0], [0, -0.5, -1.25, -2]).all(), vals[0]
+    assert np.isclose(vals[-1], [-2, -2.75, -3.875, -5]).all(), vals[-1]
+
+
+def test_interp3d_w_short_tables():
+    xs = np.array([0.0, 4.0, 10.0])
+    ys_at_xs = [np.array([0, 2, 4]), np.array([0, 1, 3]), np.array([1, 4])]
+    f = [np.array([0., -1, -2]), np.array([-1., -2, -3]), np.array([-2., -5])]
+    y = np.array([0, 1, 2.5, 3])
+    # the table at x=10 does not reach y=0, but is not needed for x < 4
+    vals = fns.interp3d(np.array([0.0, 2.0]), y, xs, ys_at_xs, f)
+    assert np.isclose(vals[0], [0, -0.5, -1.25, -1.5]).all(), vals[0]
+    assert np.isclose(vals[1], [-0.5, -1.25, -2, -2.25]).all(), vals[1]
+    assert np.isclose(fns.interp3d(2.0, y, xs, ys_at_xs, f), vals[1]).all()
+    with pytest.raises(AssertionError):
+        fns.interp3d(7.0, y, xs, ys_at_xs, f)
+
+
+def test_get_graded_positions():
+    x_scale_pos = [0, 4, 10]
+    x_scale_vals = [1., 2., 0.5]
+    u = fns.get_stretched_coords([0, 2, 6, 12], x_scale_pos, x_scale_vals)
+    assert np.isclose(u, [0, 2, 5, 11]).all(), u
+
+    xs = fns.get_graded_positions([0, 6, 12], [5, 5], x_scale_pos, x_scale_vals)
+    # equal steps in the stretched coordinate, 1.0 in the first zone and 1.2 in the second
+    expected = [0, 1, 2, 3, 4, 6, 8.4, 10.2, 10.8, 11.4, 12]
+    assert np.isclose(xs, expected).all(), xs
+    assert xs[5] == 6 and xs[10] == 12
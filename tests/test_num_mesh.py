@@ -1,6 +1,11 @@
+import copy
+import io
+import time
+
 import sfsimodels as sm
 from sfsimodels.num.mesh import mesh2d_vary_y
 import numpy as np
+import pytest
 
 
 def test_two_d_mesh():
@@ -225,5 +230,1908 @@ def test_mesh_vary_y():
             assert y0_ind == y1_ind, (sd, y0_ind, y1_ind)
 
 
+def test_mesh_connectivity():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        active_nodes = femesh.get_active_nodes()
+        active_eles = femesh.soil_grid != femesh.inactive_value
+        conn = femesh.get_connectivity()
+        coords = femesh.get_node_coords()
+        assert conn.dtype == np.int32
+        assert conn.shape == (np.sum(active_eles), 4)
+        assert conn.flags['C_CONTIGUOUS']
+        assert coords.shape == (np.sum(active_nodes), 2)
+        assert femesh.get_ele_soil_ids().shape == (len(conn),)
+        assert conn.min() == 0 and conn.max() == len(coords) - 1
+        # every node is used by at least one element
+        assert len(np.unique(conn)) == len(coords)
+        # check against loop
+        nids = femesh.get_node_id_grid()
+        x_nodes2d = femesh.get_x_nodes2d()
+        ee = 0
+        for xx in range(len(femesh.soil_grid)):
+            for yy in range(len(femesh.soil_grid[0])):
+                if femesh.soil_grid[xx][yy] == femesh.inactive_value:
+                    continue
+                assert conn[ee][0] == nids[xx][yy + 1]
+                assert conn[ee][2] == nids[xx + 1][yy]
+                assert femesh.get_ele_soil_ids()[ee] == femesh.soil_grid[xx][yy]
+                ee += 1
+                assert np.isclose(coords[nids[xx][yy]][0], x_nodes2d[xx][yy])
+                assert np.isclose(coords[nids[xx][yy]][1], femesh.y_nodes[xx][yy])
+        # counter-clockwise ordering gives positive signed area
+        xs = coords[conn][:, :, 0]
+        ys = coords[conn][:, :, 1]
+        areas = 0.5 * np.sum(xs * np.roll(ys, -1, axis=1) - np.roll(xs, -1, axis=1) * ys, axis=1)
+        assert np.min(areas) > 0
+        # cache is reset when grid is changed
+        sg = femesh.soil_grid.copy()
+        sg[0][-1] = femesh.inactive_value
+        femesh.soil_grid = sg
+        assert len(femesh.get_connectivity()) == len(conn) - 1
+
+
+def test_rcm_renumbering():
+    from sfsimodels.num.mesh import renumber
+    # tall narrow grid where natural column-by-column numbering has a large bandwidth
+    nnx, nny = 4, 30
+    nids = np.arange(nnx * nny).reshape((nnx, nny))
+    conn = np.array([nids[:-1, 1:].ravel(), nids[1:, 1:].ravel(), nids[1:, :-1].ravel(), nids[:-1, :-1].ravel()]).T
+    assert renumber.calc_bandwidth(conn) == nny + 1
+    perm, inv_perm = renumber.get_rcm_permutation(conn)
+    assert np.array_equal(np.sort(perm), np.arange(nnx * nny))
+    assert np.array_equal(inv_perm[perm], np.arange(nnx * nny))
+    assert renumber.calc_bandwidth(conn, inv_perm) <= 2 * nnx
+    perm, inv_perm = renumber.get_rcm_permutation(conn, start_nodes=nids[:, -1])
+    assert renumber.calc_bandwidth(conn, inv_perm) <= nnx + 1
+
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        bw_natural = femesh.get_bandwidth()
+        bw_rcm = femesh.get_bandwidth(node_order='rcm')
+        assert bw_rcm <= bw_natural
+        conn = femesh.get_connectivity()
+        conn_rcm = femesh.get_connectivity(node_order='rcm')
+        coords = femesh.get_node_coords()
+        coords_rcm = femesh.get_node_coords(node_order='rcm')
+        assert np.array_equal(coords[conn], coords_rcm[conn_rcm])
+        nids = femesh.get_node_id_grid(node_order='rcm')
+        ind = np.argwhere(nids >= 0)[5]
+        assert np.isclose(coords_rcm[nids[ind[0], ind[1]]][1], femesh.y_nodes[ind[0]][ind[1]])
+
+    # deep and narrow mesh
+    tds.width = 3
+    tds.x_surf = np.array([0, 3])
+    tds.y_surf = np.array([0, 0])
+    tds.bds.clear()
+    tds.x_bds.clear()
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    assert femesh.get_bandwidth(node_order='rcm') <= femesh.nnx + 1 < femesh.get_bandwidth()
+
+
+def test_partition_mesh():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        conn = femesh.get_connectivity()
+        for n_parts in [1, 3, 4]:
+            parts = femesh.get_partitions(n_parts)
+            assert len(parts) == n_parts
+            n_eles = [len(part.ele_ids) for part in parts]
+            assert sum(n_eles) == femesh.n_eles
+            assert max(n_eles) - min(n_eles) <= 1
+            all_eles = np.concatenate([part.ele_ids for part in parts])
+            assert np.array_equal(np.sort(all_eles), np.arange(femesh.n_eles))
+            for part in parts:
+                assert np.array_equal(part.node_ids, np.unique(conn[part.ele_ids]))
+                local_conn = part.get_local_connectivity(conn)
+                assert np.array_equal(part.node_ids[local_conn], conn[part.ele_ids])
+                for nbr in part.neighbours:
+                    shared = np.intersect1d(part.node_ids, parts[nbr].node_ids)
+                    assert np.array_equal(part.neighbours[nbr], shared)
+                    assert np.array_equal(parts[nbr].neighbours[part.index], shared)
+                    assert np.all(np.isin(shared, part.interface_node_ids))
+            if n_parts == 1:
+                assert len(parts[0].interface_node_ids) == 0
+            else:
+                # cuts are short compared to the number of nodes
+                assert len(np.unique(np.concatenate([p.interface_node_ids for p in parts]))) < 0.2 * femesh.n_nodes
+
+
+def test_mesh_vary_y_w_wavelength_sizing():
+    sp = sm.SoilProfile()
+    for depth, vs in [(0, 100.), (4, 180.), (10, 260.), (18, 350.)]:
+        sp.add_layer(depth, sm.Soil(g_mod=vs ** 2 * 1.8e3, unit_dry_weight=1.8e3 * 9.8, poissons_ratio=0.3))
+    sp.height = 30
+    sp.x_angles = [0.0, 0.0, 0.0, 0.0]
+    tds = sm.TwoDSystem(width=20, height=30)
+    tds.add_sp(sp, x=0)
+    dy_target = 1.0
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, dy_target, freq_max=10., n_eles_per_wavelength=10)
+    assert np.isclose(fc.get_dh_target_at_y(5, -1.), 1.0)  # vs=100 / 10Hz / 10
+    assert np.isclose(fc.get_dh_target_at_y(5, -25.), 2.0)  # limited by max_scale
+    dhs = -np.diff(fc.femesh.y_nodes, axis=1)
+    assert np.min(dhs) > fc.min_scale * dy_target
+    assert np.max(dhs) <= fc.max_scale * dy_target + 1e-8
+    assert np.mean(dhs[:, :3]) < np.mean(dhs[:, -3:])
+    report = fc.get_sizing_report()
+    assert report['n_eles'] == fc.femesh.soil_grid.size
+    assert report['savings'] > 0.3, report
+
+
+def test_mesh_vary_y_w_fd_refinement():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, fd_dh=0.1, fd_growth=1.2)
+    assert np.isclose(fc.get_fd_dh(4.), 0.1)
+    assert np.isclose(fc.get_fd_dh(3.), 0.1 + 0.2 * 1)
+    assert np.isclose(fc.get_fd_dh(20.), 0.5)
+    assert np.isclose(fc.get_fd_dh(5., -0.6 - 1.), 0.3)  # below the base
+    femesh = fc.femesh
+    dxs = np.diff(femesh.x_nodes)
+    x_centres = (femesh.x_nodes[1:] + femesh.x_nodes[:-1]) / 2
+    assert np.max(dxs[abs(x_centres - 4) < 0.1]) < 0.1 * 1.05
+    assert np.max(dxs[abs(x_centres - 6) < 0.1]) < 0.1 * 1.05
+    assert np.allclose(dxs[x_centres > 10], 0.5)
+    assert np.max(dxs[1:] / dxs[:-1]) < 1.2 * 1.05  # graded
+    # heights below the foundation grow with depth
+    col = np.argmin(abs(femesh.x_nodes - 4))
+    y_col = femesh.y_nodes[col]
+    dhs = -np.diff(y_col)
+    below = (y_col[1:] < -0.6) & (y_col[1:] > -2.)
+    assert np.max(dhs[below][:3]) < 0.15
+    assert np.all(np.diff(dhs[below]) > -1e-6)
+    assert femesh.get_quality_report()['n_inverted'] == 0
+    report = fc.get_sizing_report()
+    assert report['n_cols_uniform_fd'] == 300  # 30m / 0.1m
+    assert report['fd_savings'] > 0.9, report
+    fc_uniform = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+    assert femesh.nnx > fc_uniform.femesh.nnx
+
+    with pytest.raises(ValueError):
+        mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, fd_dh=0.1, fd_growth=1.)
+
+
+def test_mesh_constructor_stage_report():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, record_stats=True)
+    report = fc.get_stage_report()
+    stages = [stats['stage'] for stats in report]
+    assert stages == ['get_special_coords_and_slopes', 'set_init_y_blocks', 'adjust_blocks_to_be_consistent_with_slopes',
+                      'trim_grid_to_target_dh', 'build_req_y_node_positions', 'set_x_nodes',
+                      'build_y_coords_grid_via_propagation', 'set_soil_ids_to_vary_y_grid', 'create_mesh',
+                      'exclude_fd_eles']
+    for stats in report:
+        assert stats['time'] >= 0
+    assert report[2]['counts']['lines'] == len(fc.xcs_sorted)
+    assert report[2]['counts']['totals'] >= 1
+    assert report[3]['counts']['constraints'] == len(fc.dh_constraints)
+    assert report[5]['sizes']['x_nodes'] == (fc.femesh.nnx,)
+    assert report[7]['sizes']['soil_grid'] == fc.soil_grid.shape
+
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+    assert fc.get_stage_report() == []
+
+
+def test_construct_femesh_w_cache(tmp_path):
+    from sfsimodels.num.mesh import cache, mesh2d_orth
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    cache_dir = str(tmp_path)
+    for construct, tds_a in [(mesh2d_vary_y.construct_femesh_vary_y, tds),
+                             (mesh2d_vary_y.construct_femesh_vary_xy, tds_xy),
+                             (mesh2d_orth.construct_femesh_orth, tds)]:
+        femesh = construct(tds_a, 0.5, cache_dir=cache_dir)
+        tds_b = copy.deepcopy(tds_a)  # separately built but identical system
+        femesh_c = construct(tds_b, 0.5, cache_dir=cache_dir)
+        assert type(femesh_c) == type(femesh)
+        assert np.array_equal(femesh_c.x_nodes, femesh.x_nodes)
+        assert np.array_equal(femesh_c.y_nodes, femesh.y_nodes)
+        assert np.array_equal(femesh_c.soil_grid, femesh.soil_grid)
+        assert femesh_c.soils[0] is tds_b.sps[0].layer(1)
+    assert len(cache.MeshCache(cache_dir).get_entries()) == 3
+
+    key = cache.get_mesh_key(tds, 'vary_y2d', dy_target=0.5, x_scale_pos=None, x_scale_vals=None)
+    assert key == cache.get_mesh_key(copy.deepcopy(tds), 'vary_y2d', dy_target=0.5, x_scale_pos=None,
+                                     x_scale_vals=None)
+    assert key != cache.get_mesh_key(tds, 'vary_y2d', dy_target=0.6, x_scale_pos=None, x_scale_vals=None)
+    tds.bds[0].fd.depth = 0.8
+    assert key != cache.get_mesh_key(tds, 'vary_y2d', dy_target=0.5, x_scale_pos=None, x_scale_vals=None)
+    tds.bds[0].fd.depth = 0.6
+    assert key == cache.get_mesh_key(tds, 'vary_y2d', dy_target=0.5, x_scale_pos=None, x_scale_vals=None)
+    tds.sps[0].layer(2).phi = 32.0
+    assert key != cache.get_mesh_key(tds, 'vary_y2d', dy_target=0.5, x_scale_pos=None, x_scale_vals=None)
+
+
+def test_mesh_cache_eviction(tmp_path):
+    from sfsimodels.num.mesh import cache
+    mc = cache.MeshCache(str(tmp_path), max_entries=2)
+    mc.save('a', x=np.arange(10))
+    mc.save('b', x=np.arange(20))
+    assert mc.load('a') is not None  # 'a' is now more recently used than 'b'
+    mc.save('c', x=np.arange(30))
+    assert mc.load('b') is None
+    assert np.array_equal(mc.load('a')['x'], np.arange(10))
+    assert np.array_equal(mc.load('c')['x'], np.arange(30))
+    mc.max_size = mc.size - 1
+    mc.evict()
+    assert len(mc.get_entries()) == 1
+    assert mc.load('c') is not None
+    mc.clear()
+    assert mc.size == 0
+
+
+def test_mesh_batch():
+    from sfsimodels.num.mesh import batch
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    systems = [copy.deepcopy(tds) for i in range(3)]
+    systems[1].bds[0].fd.width = 200  # foundation wider than domain
+    systems[2] = (systems[2], {'dy_target': 1.0, 'x_scale_vals': [1.5, 1.5]})
+    results = batch.build_mesh_batch(systems, 0.5, max_workers=2)
+    assert [res.index for res in results] == [0, 1, 2]
+    assert results[0].ok
+    assert not results[1].ok
+    assert 'Error' in results[1].error
+    assert results[2].ok
+    femesh = results[0].get_femesh(systems[0])
+    expected = mesh2d_vary_y.construct_femesh_vary_y(tds, 0.5)
+    assert np.array_equal(femesh.x_nodes, expected.x_nodes)
+    assert np.array_equal(femesh.y_nodes, expected.y_nodes)
+    assert np.array_equal(femesh.soil_grid, expected.soil_grid)
+    assert femesh.soils[0] is systems[0].sps[0].layer(1)
+    assert results[0].arrays['soil_grid'].dtype == np.int32
+    assert results[2].arrays['x_nodes'][1] > expected.x_nodes[1]
+
+    unordered = list(batch.iter_mesh_batch(systems, 0.5, ordered=False, max_workers=0))
+    assert sorted([res.index for res in unordered]) == [0, 1, 2]
+    assert np.array_equal(unordered[2].arrays['y_nodes'], results[2].arrays['y_nodes'])
+    with pytest.raises(ValueError, match='Mesh of system 1 was not built'):
+        results[1].get_femesh(systems[1])
+
+
+def test_mesh_constructor_rebuild_w_memoize():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, memoize=True)
+    assert fc.reused_stages == []
+
+    # replace the soil of the bottom layer, the soil properties could change the element heights,
+    # but the outputs are unchanged so later stages are reused
+    sl = sm.Soil(g_mod=5.0e4, unit_dry_weight=18.0e3, poissons_ratio=0.3)
+    tds.sps[0].replace_layer(3, sl)
+    fc.rebuild()
+    assert 'set_init_y_blocks' not in fc.reused_stages
+    assert 'trim_grid_to_target_dh' in fc.reused_stages
+    assert 'build_y_coords_grid_via_propagation' in fc.reused_stages
+    assert 'set_soil_ids_to_vary_y_grid' in fc.reused_stages
+    expected = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+    assert np.array_equal(fc.femesh.y_nodes, expected.femesh.y_nodes)
+    assert np.array_equal(fc.femesh.soil_grid, expected.femesh.soil_grid)
+    assert fc.femesh.soils[2] is sl
+
+    # change the x-scale, the vertical node distribution is reused
+    fc.x_scale_vals = np.array([1.5, 1.5])
+    fc.rebuild()
+    assert 'build_req_y_node_positions' in fc.reused_stages
+    assert 'set_x_nodes' not in fc.reused_stages
+    expected = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, x_scale_vals=[1.5, 1.5])
+    assert np.array_equal(fc.femesh.x_nodes, expected.femesh.x_nodes)
+    assert np.array_equal(fc.femesh.y_nodes, expected.femesh.y_nodes)
+
+    # move the building, all stages are recomputed, but the lines and columns away from the building are reused
+    tds2 = copy.deepcopy(tds)
+    tds2.x_bds[0] = 20
+    fc.rebuild(tds2)
+    assert fc.reused_stages == []
+    assert fc.reused_parts['adjust_blocks_to_be_consistent_with_slopes'] > 0
+    assert fc.reused_parts['build_y_coords_grid_via_propagation'] > 0
+    expected = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds2, 0.5, x_scale_vals=[1.5, 1.5])
+    assert np.array_equal(fc.femesh.x_nodes, expected.femesh.x_nodes)
+    assert np.array_equal(fc.femesh.y_nodes, expected.femesh.y_nodes)
+    assert np.array_equal(fc.femesh.soil_grid, expected.femesh.soil_grid)
+
+    # deepen the foundation, the element columns away from the foundation are reused
+    tds2.bds[0].fd.depth = 0.9
+    fc.rebuild(tds2)
+    assert 0 < fc.reused_parts['set_soil_ids_to_vary_y_grid'] < fc.femesh.nnx - 1
+    expected = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds2, 0.5, x_scale_vals=[1.5, 1.5])
+    assert np.array_equal(fc.femesh.y_nodes, expected.femesh.y_nodes)
+    assert np.array_equal(fc.femesh.soil_grid, expected.femesh.soil_grid)
+
+
+
+def test_mesh_constructor_rebuild_w_gwl_change():
+    sl1 = sm.Soil(g_mod=30.0e6, unit_dry_weight=16.0e3, unit_sat_weight=20.0e3, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=80.0e6, unit_dry_weight=17.0e3, unit_sat_weight=21.0e3, poissons_ratio=0.3)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(6, sl2)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0]
+    sp.gwl = 100.
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, freq_max=25, memoize=True)
+
+    # raising the water level lowers the shear wave velocity, so the element heights are recomputed
+    sp.gwl = 1.0
+    fc.rebuild()
+    assert 'set_init_y_blocks' not in fc.reused_stages
+    assert 'set_x_nodes' in fc.reused_stages
+    expected = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, freq_max=25)
+    assert fc.femesh.nny == expected.femesh.nny
+    assert np.array_equal(fc.femesh.y_nodes, expected.femesh.y_nodes)
+    assert np.array_equal(fc.femesh.soil_grid, expected.femesh.soil_grid)
+
+def test_mesh_constructor_block_constraints():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, record_stats=True)
+    counts = fc.get_stage_report()[2]['counts']
+    assert isinstance(fc.slope_constraints, list)
+    for constraint in fc.slope_constraints:
+        assert constraint['limit'] in ['n_blocks', 'dh_limits', 'slopes']
+        assert constraint['diff_nb'] != constraint['diff_nb_target']
+    for constraint in fc.dh_constraints:
+        assert constraint['limit'] in ['n_blocks', 'max_dh', 'opt_high', 'min_dh', 'opt_low', 'coupled']
+    # all lines have the same number of elements and the element heights are within the limits
+    for xc in fc.xcs_sorted:
+        assert sum(fc.y_blocks[xc]) == counts['n_rows']
+        assert min(fc.y_blocks[xc]) >= 0
+        dhs = np.diff(fc.yd[xc]) / np.array(fc.y_blocks[xc])
+        dhs = dhs[np.array(fc.y_blocks[xc]) > 0]
+        assert np.all(dhs[:-1] >= 0.5 * fc.min_scale)
+        assert np.all(dhs <= 0.5 * fc.max_scale)
+
+    # the solve time grows about linearly with the number of rows (it was cubic), 4x the rows is timed
+    times = []
+    n_rows = []
+    for dy_target in [0.1, 0.025]:
+        fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, dy_target, auto_run=False)
+        fc.get_special_coords_and_slopes()
+        fc.set_init_y_blocks()
+        init_blocks = copy.deepcopy(fc.y_blocks)
+        run_times = []
+        for i in range(3):
+            fc.y_blocks = copy.deepcopy(init_blocks)
+            t0 = time.perf_counter()
+            fc.adjust_blocks_to_be_consistent_with_slopes()
+            run_times.append(time.perf_counter() - t0)
+        times.append(min(run_times))
+        n_rows.append(sum(fc.y_blocks[fc.xcs_sorted[0]]))
+    assert 3.5 < n_rows[1] / n_rows[0] < 4.5
+    assert times[1] < 16 * times[0], times
+
+
+def test_mesh_x_nodes_follow_scale():
+    from sfsimodels.num.mesh import mesh2d_orth
+    x_scale_pos = [0, 15]
+    x_scale_vals = [1., 2.]
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, x_scale_pos=x_scale_pos, x_scale_vals=x_scale_vals)
+    ofc = mesh2d_orth.FiniteElementOrth2DMeshConstructor(tds, 0.5, x_scale_pos=x_scale_pos, x_scale_vals=x_scale_vals)
+    for x_nodes, x_req in [(fc.x_nodes, fc.xcs_sorted), (ofc.x_nodes, ofc.x_act)]:
+        assert np.all(np.isin(x_req, x_nodes))
+        dxs = np.diff(x_nodes)
+        x_centres = (x_nodes[1:] + x_nodes[:-1]) / 2
+        assert np.allclose(dxs[x_centres > 15] / (0.5 * 2), 1, atol=0.1)
+        assert np.allclose(dxs[x_centres < 4] / 0.5, 1, atol=0.1)
+
+
+def test_mesh_ele_property_fields():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        fields = femesh.get_ele_property_fields(['g_mod', 'unit_dry_mass', 'shear_vel', 'poissons_ratio'])
+        active = femesh.soil_grid != femesh.inactive_value
+        for item in fields:
+            assert fields[item].shape == femesh.soil_grid.shape
+            assert np.isnan(fields[item][~active]).all()
+        for xx, yy in np.argwhere(active)[::7]:
+            sl = femesh.soils[femesh.soil_grid[xx][yy]]
+            assert fields['g_mod'][xx, yy] == sl.g_mod
+            assert fields['unit_dry_mass'][xx, yy] == sl.unit_dry_mass
+            assert fields['shear_vel'][xx, yy] == sl.get_shear_vel(saturated=False)
+            assert fields['poissons_ratio'][xx, yy] == sl.poissons_ratio
+
+    # stress dependent soil
+    sl = sm.StressDependentSoil(g0_mod=500., unit_dry_weight=17.0e3, unit_sat_weight=19.0e3, poissons_ratio=0.3,
+                                phi=30.0)
+    tds.sps[0].replace_layer(3, sl)
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    v_eff = np.linspace(1.0e3, 2.0e5, femesh.soil_grid.size).reshape(femesh.soil_grid.shape)
+    saturated = np.zeros(femesh.soil_grid.shape, dtype=bool)
+    saturated[:, 10:] = True
+    with pytest.raises(ValueError):
+        femesh.get_ele_property_fields(['g_mod'])
+    fields = femesh.get_ele_property_fields(['g_mod', 'shear_vel'], v_eff_stress=v_eff, saturated=saturated)
+    in_sl = femesh.soil_grid == 2
+    assert in_sl.any()
+    assert np.allclose(fields['g_mod'][in_sl], sl.get_g_mod_at_v_eff_stress(v_eff[in_sl]))
+    xx, yy = np.argwhere(in_sl & saturated)[0]
+    assert np.isclose(fields['shear_vel'][xx, yy], sl.get_shear_vel_at_v_eff_stress(v_eff[xx, yy], True))
+    xx, yy = np.argwhere(~in_sl & saturated & (femesh.soil_grid != femesh.inactive_value))[0]
+    assert femesh.soils[femesh.soil_grid[xx, yy]].get_shear_vel(True) is None  # saturated weight not set
+    assert np.isnan(fields['shear_vel'][xx, yy])
+
+
+def test_mesh_ele_stress_fields():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    sp = tds.sps[0]
+    for i in range(1, sp.n_layers + 1):
+        sp.layer(i).unit_sat_weight = 20.0e3 - 100 * i
+    sp.gwl = 2.3
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    fields = femesh.get_ele_stress_fields(gwl=sp.gwl)
+    active = femesh.soil_grid != femesh.inactive_value
+    for item in fields:
+        assert fields[item].shape == femesh.soil_grid.shape
+        assert np.isnan(fields[item][~active]).all()
+        assert not np.isnan(fields[item][active]).any()
+    y_nodes = femesh.y_nodes
+    y_centres = (y_nodes[:-1, :-1] + y_nodes[1:, :-1] + y_nodes[:-1, 1:] + y_nodes[1:, 1:]) / 4
+    for xx in [0, 3]:  # flat surface at y=0, away from the foundation
+        for yy in np.where(active[xx])[0]:
+            depth = -y_centres[xx, yy]
+            assert np.isclose(fields['v_eff_stress'][xx, yy], sp.get_v_eff_stress_at_depth(depth))
+            assert np.isclose(fields['pore_pressure'][xx, yy], sp.get_hydrostatic_pressure_at_depth(depth))
+
+    # ground water level as coordinates, same level in the flat part, then ponded over the raised surface
+    gwl = np.array([[0, -2.3], [10, -2.3], [12, 1.5], [30, 1.5]])
+    fields_c = femesh.get_ele_stress_fields(gwl=gwl)
+    assert np.allclose(fields_c['v_eff_stress'][:4], fields['v_eff_stress'][:4], equal_nan=True)
+    xx = len(femesh.x_nodes) - 2
+    yy = np.argmax(active[xx])
+    depth = 1.0 - y_centres[xx, yy]
+    assert np.isclose(fields_c['pore_pressure'][xx, yy], (1.5 - y_centres[xx, yy]) * 9800.)
+    assert np.isclose(fields_c['v_total_stress'][xx, yy], 0.5 * 9800. + depth * sp.layer(1).unit_sat_weight)
+
+
+def test_mesh_ele_stress_fields_under_fd():
+    # the ground water level is measured from the ground surface, not the base of the foundation
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    sp = tds.sps[0]
+    for i in range(1, sp.n_layers + 1):
+        sp.layer(i).unit_sat_weight = 20.0e3 - 100 * i
+    sp.gwl = 0.3
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    xsi, xei, ysi, yei = femesh.fd_ele_boxes[0]
+    xx = (xsi + xei) // 2  # under the foundation at x=5
+    y_nodes = femesh.y_nodes
+    y_centres = (y_nodes[:-1, :-1] + y_nodes[1:, :-1] + y_nodes[:-1, 1:] + y_nodes[1:, 1:]) / 4
+    active = femesh.soil_grid != femesh.inactive_value
+    yys = np.where(active[xx])[0]
+    assert np.isclose(y_nodes[xx, yys[0]], -0.6)
+    uw_dry = sp.layer(1).unit_dry_weight
+    uw_sat = sp.layer(1).unit_sat_weight
+    for fields in [femesh.get_ele_stress_fields(gwl=sp.gwl),
+                   femesh.get_ele_stress_fields(gwl=sp.gwl, x_surf=tds.x_surf, y_surf=tds.y_surf)]:
+        for yy in yys:
+            depth = -y_centres[xx, yy]
+            assert np.isclose(fields['pore_pressure'][xx, yy], sp.get_hydrostatic_pressure_at_depth(depth))
+            # the soil replaced by the foundation carries no weight
+            v_total = sp.get_v_total_stress_at_depth(depth) - 0.3 * uw_dry - 0.3 * uw_sat
+            assert np.isclose(fields['v_total_stress'][xx, yy], v_total)
+
+
+def test_mesh_export(tmp_path):
+    from sfsimodels.num.mesh import export
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        coords = femesh.get_node_coords()
+        conn = femesh.get_connectivity()
+        fix_ids, fixities = export.get_node_fixities(femesh)
+        nids = femesh.get_node_id_grid()
+        assert np.isin(nids[0][nids[0] >= 0], fix_ids).all() and np.isin(nids[-1][nids[-1] >= 0], fix_ids).all()
+        assert np.sum(fixities[:, 1]) == femesh.nnx  # one base node per column
+
+        ffp = str(tmp_path / 'model.tcl')
+        export.write_opensees_tcl(femesh, ffp, chunk_size=100)
+        lines = open(ffp).read().splitlines()
+        nodes = np.array([line.split()[1:] for line in lines if line.startswith('node')], dtype=float)
+        eles = np.array([line.split()[2:7] for line in lines if line.startswith('element')], dtype=int)
+        assert np.array_equal(nodes[:, 0], np.arange(1, len(coords) + 1))
+        assert np.allclose(nodes[:, 1:], coords)
+        assert np.array_equal(eles[:, 1:] - 1, conn)
+        assert len([line for line in lines if line.startswith('nDMaterial')]) == len(femesh.soils)
+        assert len([line for line in lines if line.startswith('fix')]) == len(fix_ids)
+
+        buf = io.StringIO()
+        export.write_opensees_py(femesh, buf)
+        assert buf.getvalue().count('ops.element(') == len(conn)
+
+        buf = io.StringIO()
+        export.write_vtk(femesh, buf, chunk_size=333)
+        lines = buf.getvalue().splitlines()
+        i = lines.index(f'CELLS {len(conn)} {5 * len(conn)}')
+        assert np.array_equal(np.array([line.split() for line in lines[i + 1:i + 1 + len(conn)]], dtype=int)[:, 1:],
+                              conn)
+        assert len(lines) == 13 + 3 * len(conn) + 2 * len(coords)
+
+        buf = io.StringIO()
+        export.write_flac_grid(femesh, buf, chunk_size=50)
+        txt = buf.getvalue()
+        assert txt.startswith(f'grid {femesh.nnx - 1},{femesh.nny - 1}')
+        assert txt.count('ini x=') == femesh.nnx * femesh.nny
+        assert txt.count("group 'soil_") - 2 * len(femesh.soils) == len(conn)
+        assert txt.count('model null') == femesh.soil_grid.size - len(conn)
+
+
+
+def test_mesh_export_int_rows():
+    import time
+    from sfsimodels.num.mesh import export
+    ids = np.arange(1, 200001)
+    rows = np.column_stack([ids, ids, ids + 1, ids + 702, ids + 701, ids % 3 + 1])
+    fmt = 'element quad %d %d %d %d %d 1 PlaneStrain %d'
+    parts = export._get_int_fmt_parts(fmt)
+    assert export._get_int_fmt_parts('node %d %.10g') is None
+    for vals in [rows, np.array([[0, -1, 10, -123456789012, 7, 99]])]:
+        assert export._format_int_rows(parts, vals) == ((fmt + '\n') * len(vals)) % tuple(vals.ravel().tolist())
+    # rows with many different numbers of digits are left to `%` formatting
+    assert export._format_int_rows(parts, np.random.default_rng(0).integers(-10 ** 6, 10 ** 6, (1000, 6))) is None
+
+    # throughput of the integer rows against `%` formatting
+    t_fast = []
+    t_pct = []
+    for i in range(3):
+        t0 = time.perf_counter()
+        export._format_int_rows(parts, rows)
+        t_fast.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        ((fmt + '\n') * len(rows)) % tuple(rows.ravel().tolist())
+        t_pct.append(time.perf_counter() - t0)
+    assert min(t_fast) < min(t_pct)
+
+def test_mesh_boundary_sets(tmp_path):
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    femesh, femesh_xy = fc.femesh, fc_xy.femesh
+    assert len(femesh.fd_ele_boxes) == 1
+    bs = femesh.get_boundary_sets()
+    assert bs is femesh.get_boundary_sets()  # cached
+    nids = femesh.get_node_id_grid()
+    eids = femesh.get_ele_id_grid()
+    assert np.array_equal(bs['base'][0], np.sort(nids[:, -1]))
+    assert np.array_equal(bs['left'][0], np.sort(nids[0][nids[0] >= 0]))
+    assert np.array_equal(bs['right'][1], np.sort(eids[-1][eids[-1] >= 0]))
+    # the top node of each column is on the surface, except within the foundation
+    xsi, xei, ysi, yei = femesh.fd_ele_boxes[0]
+    top_nids = nids[np.arange(femesh.nnx), np.argmax(nids >= 0, axis=1)]
+    in_fd = (np.arange(femesh.nnx) > xsi) & (np.arange(femesh.nnx) < xei)
+    assert np.isin(top_nids[~in_fd], bs['surface'][0]).all()
+    assert not np.isin(top_nids[in_fd], bs['surface'][0]).any()
+    # foundation contact nodes are around the excluded elements
+    fd_nodes = np.unique(nids[xsi:xei + 1, ysi:yei + 1])
+    assert np.isin(bs['foundation'][0], fd_nodes).all()
+    assert np.isin(nids[xsi:xei + 1, yei], bs['foundation'][0]).all()  # below the foundation
+    # soil layer interfaces
+    coords = femesh.get_node_coords()
+    assert np.allclose(coords[bs['interface_0_1'][0], 1], -5)
+    assert np.allclose(coords[bs['interface_1_2'][0], 1], -12)
+    for name in ['interface_0_1', 'interface_1_2']:
+        assert len(np.unique(femesh.get_ele_soil_ids()[bs[name][1]])) == 2
+
+    # foundation elements are kept by the disk cache
+    cache_dir = str(tmp_path)
+    mesh2d_vary_y.construct_femesh_vary_y(tds, 0.5, cache_dir=cache_dir)
+    cached = mesh2d_vary_y.construct_femesh_vary_y(tds, 0.5, cache_dir=cache_dir)
+    assert np.array_equal(cached.fd_ele_boxes, femesh.fd_ele_boxes)
+    assert np.array_equal(cached.get_boundary_sets()['foundation'][0], bs['foundation'][0])
+
+    # surface polyline simplification
+    ccoords = femesh_xy.get_change_coords_at_depth_offset(None, None, 0, tol=0.01)
+    assert ccoords[0][0] == 0 and np.isclose(ccoords[0][-1], femesh_xy.x_nodes[-1][0])
+    assert np.all(np.diff(ccoords[0]) >= 0)
+    deep = femesh_xy.get_change_coords_at_depth_offset(None, None, 3, tol=0.01)
+    assert np.isclose(deep[0][0], 0) and np.isclose(deep[0][-1], femesh_xy.x_nodes[-1][0])
+    assert deep[1][0] < ccoords[1][0] and deep[1][-1] < ccoords[1][-1]
+    base = femesh_xy.get_change_coords_at_depth_offset(None, None, femesh_xy.nny, tol=0.01)
+    assert np.allclose(base[1], femesh_xy.y_nodes[0][-1])
+
+
+def test_mesh_quality_report():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    femesh, femesh_xy = fc.femesh, fc_xy.femesh
+    quality = femesh.get_ele_quality()
+    assert quality is femesh.get_ele_quality()  # cached
+    # rectangles where the x-coordinates and the element tops and bottoms are straight
+    rect = quality['skew'] < 1e-12
+    assert np.allclose(quality['min_angle'][rect], 90)
+    assert np.allclose(quality['scaled_jacobian'][rect], 1)
+    conn = femesh.get_connectivity()
+    coords = femesh.get_node_coords()
+    ele = np.argmax(quality['aspect_ratio'])
+    lens = np.linalg.norm(coords[np.roll(conn[ele], -1)] - coords[conn[ele]], axis=1)
+    assert np.isclose(quality['aspect_ratio'][ele], lens.max() / lens.min())
+
+    report = femesh_xy.get_quality_report(n_bins=5, n_worst=3)
+    assert report['n_eles'] == femesh_xy.n_eles
+    assert report['n_inverted'] == 0
+    q_xy = femesh_xy.get_ele_quality()
+    for item in ['skew', 'aspect_ratio', 'min_angle', 'max_angle', 'scaled_jacobian']:
+        assert report[item]['hist'][0].sum() == femesh_xy.n_eles
+        assert len(report[item]['worst']) == 3
+    assert q_xy['min_angle'][report['min_angle']['worst'][0]] == report['min_angle']['min']
+    assert q_xy['skew'][report['skew']['worst'][0]] == report['skew']['max']
+    assert report['min_angle']['min'] < 90
+
+    # an inverted element is detected
+    y_nodes = np.array(femesh.y_nodes, dtype=float)
+    y_nodes[5, 3] = y_nodes[5, 5]
+    femesh.y_nodes = y_nodes
+    assert femesh.get_quality_report()['n_inverted'] > 0
+
+
+def test_mesh_soil_ele_index():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    soil_grid = np.array(femesh.soil_grid)
+    flat = soil_grid.ravel()
+    for i, sl in enumerate(femesh.soils):
+        assert np.array_equal(femesh.get_ele_flat_indexes_by_soil(i), np.where(flat == i)[0])
+        assert np.array_equal(femesh.get_ele_flat_indexes_by_hash(sl.unique_hash), np.where(flat == i)[0])
+    inds = femesh.get_ele_flat_indexes_by_soil([2, 0])
+    assert np.array_equal(inds, np.concatenate([np.where(flat == 2)[0], np.where(flat == 0)[0]]))
+    xinds, yinds = femesh.get_ele_index_by_type('soil')
+    assert len(xinds) == femesh.n_eles
+    assert np.array_equal(xinds * soil_grid.shape[1] + yinds, femesh.get_ele_flat_indexes_by_soil([0, 1, 2]))
+    assert len(femesh.get_ele_index_by_type('pm4sand')[0]) == 0
+    # updated when the soil grid changes
+    assert soil_grid[0, 2] == 0
+    soil_grid[0, 2] = 2
+    femesh.soil_grid = soil_grid
+    assert 2 in femesh.get_ele_flat_indexes_by_soil(2)
+    assert 2 not in femesh.get_ele_flat_indexes_by_soil(0)
+
+
+def test_mesh_quadratic_eles():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        coords = femesh.get_node_coords()
+        conn = femesh.get_connectivity()
+        for n in [8, 9]:
+            q_coords = femesh.get_quadratic_node_coords(n)
+            q_conn = femesh.get_quadratic_connectivity(n)
+            assert q_conn.shape == (femesh.n_eles, n)
+            assert np.array_equal(np.unique(q_conn), np.arange(len(q_coords)))  # all nodes used, numbered once
+            assert np.allclose(q_coords[q_conn[:, :4]], coords[conn])  # same corners
+            for i in range(4):  # mid-side nodes
+                assert np.allclose(q_coords[q_conn[:, 4 + i]], (coords[conn[:, i]] + coords[conn[:, (i + 1) % 4]]) / 2)
+            n_edges = len(np.unique(np.sort(conn[:, [[0, 1], [1, 2], [2, 3], [3, 0]]], axis=2).reshape(-1, 2), axis=0))
+            assert len(q_coords) == femesh.n_nodes + n_edges + (n - 8) * femesh.n_eles
+        assert np.allclose(q_coords[q_conn[:, 8]], coords[conn].mean(axis=1))
+    with pytest.raises(ValueError):
+        femesh.get_quadratic_connectivity(6)
+
+
+def test_mesh_ele_areas_and_nodal_masses():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        coords = femesh.get_node_coords()
+        conn = femesh.get_connectivity()
+        pts = coords[conn]  # size=(n_eles, 4, 2)
+        # integrate the bilinear shape functions with 2x2 Gauss points
+        xis = np.array([-1, 1, 1, -1])
+        etas = np.array([-1, -1, 1, 1])
+        nodal = np.zeros((len(conn), 4))
+        for xi in [-1 / np.sqrt(3), 1 / np.sqrt(3)]:
+            for eta in [-1 / np.sqrt(3), 1 / np.sqrt(3)]:
+                dn_dxi = xis * (1 + etas * eta) / 4
+                dn_deta = etas * (1 + xis * xi) / 4
+                jac = np.array([[pts[:, :, 0] @ dn_dxi, pts[:, :, 1] @ dn_dxi],
+                                [pts[:, :, 0] @ dn_deta, pts[:, :, 1] @ dn_deta]])
+                det = jac[0, 0] * jac[1, 1] - jac[0, 1] * jac[1, 0]
+                nodal += (1 + xis * xi) * (1 + etas * eta) / 4 * det[:, np.newaxis]
+        assert np.allclose(femesh.get_ele_nodal_areas(), nodal)
+        areas = femesh.get_ele_areas()
+        assert np.allclose(areas, nodal.sum(axis=1))
+        assert femesh.get_ele_areas() is areas  # cached
+        centroids = femesh.get_ele_centroids()
+        assert np.allclose(centroids, pts.mean(axis=1), atol=0.01)
+
+        masses = femesh.get_nodal_masses(thickness=2.)
+        assert masses.shape == (femesh.n_nodes,)
+        assert np.isclose(masses.sum(), np.sum(areas * 1.8 * 2.))
+        densities = np.arange(femesh.n_eles, dtype=float)
+        expected = np.zeros(femesh.n_nodes)
+        np.add.at(expected, conn, nodal * densities[:, np.newaxis])
+        assert np.allclose(femesh.get_nodal_masses(densities), expected)
+        perm = femesh.get_node_renumbering('rcm')[0]
+        assert np.allclose(femesh.get_nodal_masses(node_order='rcm'), femesh.get_nodal_masses()[perm])
+    with pytest.raises(ValueError):
+        femesh.get_nodal_masses(densities[:-1])
+
+
+def test_mesh_ragged():
+    from sfsimodels.num.mesh import export, ragged, locate
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        rmesh = femesh.get_ragged_mesh()
+        assert rmesh.n_nodes == femesh.n_nodes and rmesh.n_eles == femesh.n_eles
+        assert np.array_equal(rmesh.get_node_coords(), femesh.get_node_coords())
+        assert np.array_equal(rmesh.get_connectivity(), femesh.get_connectivity())
+        assert np.array_equal(rmesh.get_ele_grid_indexes(), femesh.get_ele_grid_indexes())
+        assert np.array_equal(rmesh.get_node_grid_indexes(), femesh.get_node_grid_indexes())
+        assert rmesh.get_ele_ids_at(-1, 0) == -1
+        assert rmesh.get_node_ids_at(femesh.nnx - 1, femesh.nny - 1) == femesh.get_node_id_grid()[-1, -1]
+        bsets = femesh.get_boundary_sets()
+        r_bsets = rmesh.get_boundary_sets()
+        assert sorted(bsets) == sorted(r_bsets)
+        for name in bsets:
+            assert np.array_equal(bsets[name][0], r_bsets[name][0])
+            assert np.array_equal(bsets[name][1], r_bsets[name][1])
+        ffp = io.StringIO()
+        export.write_vtk(femesh, ffp)
+        r_ffp = io.StringIO()
+        export.write_vtk(rmesh, r_ffp)
+        assert ffp.getvalue() == r_ffp.getvalue()
+        dense_nbytes = sum([np.asarray(arr).nbytes for arr in [femesh.x_nodes, femesh.y_nodes, femesh.soil_grid]])
+        assert rmesh.nbytes < dense_nbytes
+
+        dense = rmesh.to_femesh()
+        assert isinstance(dense, type(femesh))
+        assert np.array_equal(dense.get_node_coords(), femesh.get_node_coords())
+        assert np.array_equal(dense.get_connectivity(), femesh.get_connectivity())
+        assert np.array_equal(dense.get_ele_soil_ids(), femesh.get_ele_soil_ids())
+        assert np.array_equal(dense.fd_ele_boxes, femesh.fd_ele_boxes)
+
+        # queries computed from the run storage match those of the original mesh
+        assert np.array_equal(rmesh.get_connectivity('rcm'), femesh.get_connectivity('rcm'))
+        assert np.array_equal(rmesh.get_node_coords('rcm'), femesh.get_node_coords('rcm'))
+        assert rmesh.get_bandwidth('rcm') == femesh.get_bandwidth('rcm')
+        assert np.array_equal(rmesh.get_boundary_sets('rcm')['base'][0], femesh.get_boundary_sets('rcm')['base'][0])
+        assert np.allclose(rmesh.get_ele_quality()['skew'], femesh.get_ele_quality()['skew'])
+        assert rmesh.get_quality_report()['n_inverted'] == femesh.get_quality_report()['n_inverted']
+        e_inds = femesh.get_ele_grid_indexes()
+        props = ['g_mod', 'unit_dry_mass', 'poissons_ratio']
+        fields = femesh.get_ele_property_fields(props)
+        r_fields = rmesh.get_ele_property_fields(props)
+        for item in props:
+            assert np.array_equal(r_fields[item], fields[item][e_inds[:, 0], e_inds[:, 1]])
+        fields = femesh.get_ele_stress_fields(gwl=1e6)
+        r_fields = rmesh.get_ele_stress_fields(gwl=1e6)
+        assert np.allclose(r_fields['v_total_stress'], fields['v_total_stress'][e_inds[:, 0], e_inds[:, 1]])
+        centroids = femesh.get_ele_centroids()
+        assert np.array_equal(rmesh.locate_points(centroids)[0], np.arange(femesh.n_eles))
+        loads = np.array([[1.0, -2.0, 0.0]])
+        assert np.allclose(rmesh.get_nodal_loads(loads, centroids[:1]), femesh.get_nodal_loads(loads, centroids[:1]))
+        xs = np.linspace(0, 30, 13)
+        assert np.array_equal(locate.get_surface_y(rmesh, xs), locate.get_surface_y(femesh, xs))
+        with pytest.raises(ValueError):
+            export.write_flac_grid(rmesh, io.StringIO())
+    cols, starts, counts = ragged.get_column_runs([[True, False, True], [False, False, False], [False, True, True]])
+    assert np.array_equal(cols, [0, 0, 2]) and np.array_equal(starts, [0, 2, 1]) and np.array_equal(counts, [1, 1, 2])
+
+
+def test_mesh_ragged_buried_foundation():
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl1.unit_sat_weight = rho * 10.
+    sl2.unit_sat_weight = rho * 10.
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 1.5  # top of the foundation is below the ground surface
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 30])
+    tds.y_surf = np.array([0, 0])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=10)
+    femesh = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5).femesh
+    xsi, xei, ysi, yei = femesh.fd_ele_boxes[0]
+    assert ysi > 0 and femesh.get_active_ele_mask()[xsi:xei, :ysi].all()
+
+    rmesh = femesh.get_ragged_mesh()
+    assert len(rmesh.ele_run_cols) == femesh.nnx - 1 + (xei - xsi)
+    assert np.array_equal(rmesh.get_node_coords(), femesh.get_node_coords())
+    assert np.array_equal(rmesh.get_connectivity(), femesh.get_connectivity())
+    assert np.array_equal(rmesh.get_node_grid_indexes(), femesh.get_node_grid_indexes())
+    assert np.array_equal(rmesh.get_ele_ids_at(xsi, ysi), -1)
+    assert rmesh.get_ele_ids_at(xsi, yei) == femesh.get_ele_id_grid()[xsi, yei]
+    bsets = femesh.get_boundary_sets()
+    r_bsets = rmesh.get_boundary_sets()
+    assert sorted(bsets) == sorted(r_bsets)
+    for name in bsets:
+        assert np.array_equal(bsets[name][0], r_bsets[name][0])
+        assert np.array_equal(bsets[name][1], r_bsets[name][1])
+    assert np.array_equal(rmesh.get_connectivity('rcm'), femesh.get_connectivity('rcm'))
+    e_inds = femesh.get_ele_grid_indexes()
+    fields = femesh.get_ele_stress_fields(gwl=2.0)
+    r_fields = rmesh.get_ele_stress_fields(gwl=2.0)
+    for item in fields:
+        assert np.allclose(r_fields[item], fields[item][e_inds[:, 0], e_inds[:, 1]])
+    # the soil above the foundation loads the soil below it
+    below = rmesh.get_ele_ids_at(xsi, yei)
+    assert r_fields['v_total_stress'][below] > r_fields['v_total_stress'][rmesh.get_ele_ids_at(xsi, ysi - 1)]
+
+
+def test_mesh_nodal_loads():
+    from sfsimodels.num.mesh import locate
+    rng = np.random.default_rng(1)
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        nc = femesh.get_node_coords()
+        conn = femesh.get_connectivity()
+        ele_ids, xi, eta = femesh.locate_points(nc[conn].mean(axis=1))
+        assert np.array_equal(ele_ids, np.arange(femesh.n_eles))
+        assert np.allclose(xi, 0) and np.allclose(eta, 0)
+        ele_ids, xi, eta = femesh.locate_points(nc)
+        assert np.all(ele_ids >= 0)
+        assert femesh.locate_points([[1., 100.]])[0][0] == -1
+
+        # random points inside random elements
+        n_loads = 1000
+        eles = rng.integers(0, femesh.n_eles, n_loads)
+        w = rng.random((n_loads, 4))
+        w /= w.sum(axis=1)[:, np.newaxis]
+        coords = np.einsum('ni,nij->nj', w, nc[conn[eles]])
+        ele_ids, xi, eta = femesh.locate_points(coords)
+        n = locate.get_quad_shape_functions(xi, eta)[0]
+        assert np.allclose(np.einsum('ni,nij->nj', n, nc[conn[ele_ids]]), coords)
+
+        loads = rng.normal(size=(n_loads, 3))
+        nodal = femesh.get_nodal_loads(loads, coords=coords)
+        assert nodal.shape == (femesh.n_nodes, 2)
+        assert np.allclose(nodal.sum(axis=0), loads[:, :2].sum(axis=0))
+        moment = np.sum(nc[:, 0] * nodal[:, 1] - nc[:, 1] * nodal[:, 0])
+        expected = np.sum(coords[:, 0] * loads[:, 1] - coords[:, 1] * loads[:, 0] + loads[:, 2])
+        assert np.isclose(moment, expected)
+
+        # load at a node goes only to that node
+        ld = sm.LoadAtCoords(x=nc[5, 0], y=nc[5, 1], p_x=2., p_y=-10.)
+        nodal = femesh.get_nodal_loads([ld])
+        assert np.allclose(nodal[5], [2., -10.])
+        assert np.isclose(np.abs(nodal).sum(), 12.)
+        with pytest.raises(ValueError):
+            femesh.get_nodal_loads([[0., 1.]], coords=[[1., 100.]])
+
+
+def test_mesh_sensor_locations():
+    from sfsimodels.num.mesh import locate
+    si = {'ACC': {}, 'DISP': {}}
+    rng = np.random.default_rng(2)
+    for i in range(1, 41):
+        si['ACC'][i] = {'x': rng.uniform(0.5, 29.5), 'y': 30 - rng.uniform(0.1, 7.), 'X-CODE': f'P{i}',
+                        'Y-CODE': 'L1', 'Z-CODE': 'M', 'Orientation': 'X'}
+    si['ACC'][41] = {'x': 20., 'y': 30., 'X-CODE': 'P41', 'Y-CODE': 'S', 'Z-CODE': 'M', 'Orientation': 'X'}
+    si['DISP'][1] = {'x': 5., 'y': 31., 'X-CODE': 'FD', 'Y-CODE': 'S', 'Z-CODE': 'M', 'Orientation': 'Y'}
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5)
+
+    sl4 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.35)
+    sl5 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.36)
+    h_face = 1.8
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.4, sl2)
+    sp.add_layer(5.7, sl3)
+    sp2 = sm.SoilProfile()
+    sp2.add_layer(0, sl4)
+    sp2.add_layer(3.9, sl2)
+    sp2.add_layer(6.5, sl5)
+    sp2.height = 20
+    sp.x_angles = [None, 0.07, 0.0]
+    sp2.x_angles = [None, 0.00, 0.0]
+    tds_xy = sm.TwoDSystem(width=45, height=7.5)
+    tds_xy.add_sp(sp, x=0)
+    tds_xy.add_sp(sp2, x=17)
+    tds_xy.x_surf = np.array([0, 12, 13, 20, 25, tds_xy.width])
+    tds_xy.y_surf = np.array([0, 0, h_face, h_face - 0.6, h_face - 0.3, h_face + 0.])
+    x_scale_pos = np.array([0, 5, 10, 16, 19, 25, 29])
+    x_scale_vals = np.array([2., 1.2, 1.0, 1.2, 0.7, 1.2, 2])
+    fc_xy = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds_xy, 0.5, x_scale_pos=x_scale_pos,
+                                                             x_scale_vals=x_scale_vals, smooth_surf=True)
+    for femesh in [fc.femesh, fc_xy.femesh]:
+        locs = femesh.get_sensor_locations(si)
+        assert len(locs['sensor_codes']) == 42
+        assert locs['sensor_codes'][0] == 'ACCX-P1-L1-M'
+        depths = [sm.sensors.get_depth_by_code(si, code) for code in locs['sensor_codes']]
+        surf_y = locate.get_surface_y(femesh, locs['coords'][:, 0])
+        assert np.allclose(surf_y - locs['coords'][:, 1], depths)
+        inside = locs['ele_ids'] >= 0
+        assert np.sum(~inside) == 1  # above the surface
+        nc = femesh.get_node_coords()
+        w = locs['weights'][inside]
+        assert np.allclose(w.sum(axis=1), 1)
+        assert np.allclose(np.einsum('ni,nij->nj', w, nc[locs['ele_node_ids'][inside]]), locs['coords'][inside])
+        dists = np.linalg.norm(locs['coords'][~inside, np.newaxis] - nc[np.newaxis], axis=2)
+        assert locs['node_ids'][~inside][0] == np.argmin(dists)
+
+        locs = femesh.get_sensor_locations(si, 'ACCX-*-L1-*', coords='+ve')
+        assert len(locs['sensor_codes']) == 40
+        assert np.allclose(locate.get_surface_y(femesh, locs['coords'][:, 0]) - locs['coords'][:, 1],
+                           [si['ACC'][i]['y'] for i in range(1, 41)])
+        assert not np.any(locs['ele_ids'] >= 0)  # y is taken as a depth, so all are below the mesh
+
+
+def test_orth_mesh_y_levels():
+    from sfsimodels.num.mesh import mesh2d_orth
+    vs = 150.0
+    rho = 1.8
+    g_mod = vs ** 2 * rho
+    sl1 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.32)
+    sl2 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.33)
+    sl3 = sm.Soil(g_mod=g_mod, unit_dry_weight=rho * 9.8, poissons_ratio=0.34)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.add_layer(12, sl3)
+    sp.height = 18
+    sp.x_angles = [0.0, 0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2
+    fd.depth = 0.6
+    fd.ip_axis = 'width'
+    fd.height = 1
+    fd.length = 100
+    tds = sm.TwoDSystem(width=30, height=15)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 10, 12, 30])
+    tds.y_surf = np.array([0, 0, 1, 1])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=5)
+    tds.y_surf = np.array([0, 0, 0.5, 0.5])
+    ofc = mesh2d_orth.FiniteElementOrth2DMeshConstructor(tds, 1.5)
+    # the highest level includes the top of the surface, nodes must not extend below the base
+    assert ofc.y_nodes[0] == 0.5
+    assert np.all(np.diff(ofc.y_nodes) < 0)
+    assert ofc.y_nodes[-1] > -tds.height - 1.5
+    assert len(ofc.y_nodes) < 20
+    # foundation bases and layer boundaries are kept as levels
+    ofc = mesh2d_orth.FiniteElementOrth2DMeshConstructor(tds, 0.25)
+    assert np.isclose(ofc.y_nodes, -0.6).any()  # foundation base
+    assert np.isclose(ofc.y_nodes, -5).any()  # second layer
+    assert np.isclose(ofc.y_nodes, -12).any()
+    assert ofc.soil_grid[-1, 0] == 0 and ofc.soil_grid[0, -1] == 2
+
+
+def test_orth_mesh_w_duplicate_x():
+    # the right edge of the foundation is at a surface coordinate
+    from sfsimodels.num.mesh import mesh2d_orth
+    sl1 = sm.Soil(g_mod=1e5, unit_dry_weight=17., poissons_ratio=0.3)
+    sl2 = sm.Soil(g_mod=2e5, unit_dry_weight=18., poissons_ratio=0.31)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(5, sl2)
+    sp.height = 20
+    sp.x_angles = [0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 2.
+    fd.depth = 0.6
+    fd.height = 1.
+    fd.length = 100
+    fd.ip_axis = 'width'
+    tds = sm.TwoDSystem(width=20, height=12)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 3., 8., 20])
+    tds.y_surf = np.array([0, 0, 1., 1.])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=2.)
+    femesh = mesh2d_orth.construct_femesh_orth(tds, 0.5)
+    assert np.all(np.diff(femesh.x_nodes) > 0)
+    assert np.isclose(femesh.x_nodes, 3.).sum() == 1
+    assert femesh.x_nodes[-1] == 20
+
+
+def test_mesh_vary_y_nodes_do_not_cross_at_slope():
+    # the nodes of the vertical line at the toe of the slope used to cross, which inverted an element
+    sl1 = sm.Soil(g_mod=1e5, unit_dry_weight=17., poissons_ratio=0.3)
+    sl2 = sm.Soil(g_mod=2e5, unit_dry_weight=18., poissons_ratio=0.31)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(4.45, sl2)
+    sp.height = 30
+    sp.x_angles = [0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 1.55
+    fd.depth = 1.32
+    fd.height = 1.
+    fd.length = 100
+    fd.ip_axis = 'width'
+    tds = sm.TwoDSystem(width=33.64, height=14.59)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 5.24, 6.24, 27.01, 33.64])
+    tds.y_surf = np.array([0, 0, 1.23, 2.86, 1.21])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=4.1)
+    femesh = mesh2d_vary_y.construct_femesh_vary_y(tds, 0.5)
+    assert np.all(np.diff(femesh.y_nodes, axis=1) < 0)
+    assert femesh.get_quality_report()['n_inverted'] == 0
+
+
+def test_trim_grid_to_target_dh_w_empty_zone():
+    # the zone between the surface at the top of the slope and the highest surface ends up with no elements
+    sl1 = sm.Soil(g_mod=1e5, unit_dry_weight=17., poissons_ratio=0.3)
+    sl2 = sm.Soil(g_mod=2e5, unit_dry_weight=18., poissons_ratio=0.31)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(9.29, sl2)
+    sp.height = 30
+    sp.x_angles = [0.0, 0.0]
+    fd = sm.RaftFoundation()
+    fd.width = 3.38
+    fd.depth = 0.92
+    fd.height = 1.
+    fd.length = 100
+    fd.ip_axis = 'width'
+    tds = sm.TwoDSystem(width=43.96, height=12.83)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.array([0, 11.8, 14.44, 37.83, 43.96])
+    tds.y_surf = np.array([0, 0, 1.78, 0.95, 2.25])
+    bd = sm.NullBuilding()
+    bd.set_foundation(fd, x=0.0)
+    tds.add_bd(bd, x=8.83)
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, auto_run=False)
+    fc.get_special_coords_and_slopes()
+    fc.set_init_y_blocks()
+    fc.adjust_blocks_to_be_consistent_with_slopes()
+    assert min(fc.y_blocks[xc][-1] for xc in fc.xcs_sorted) >= 0
+    fc.trim_grid_to_target_dh()
+    femesh = mesh2d_vary_y.construct_femesh_vary_y(tds, 0.5)
+    assert femesh.get_quality_report()['n_inverted'] == 0
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, use_3d_interp=True)
+    assert fc.femesh.soil_grid.shape == (fc.femesh.nnx - 1, fc.femesh.nny - 1)
+
+
+def test_mesh_vary_y_w_rolling_surface():
+    sl1 = sm.Soil(g_mod=1e5, unit_dry_weight=17., poissons_ratio=0.3)
+    sl2 = sm.Soil(g_mod=2e5, unit_dry_weight=18., poissons_ratio=0.3)
+    sl3 = sm.Soil(g_mod=3e5, unit_dry_weight=19., poissons_ratio=0.3)
+    sp = sm.SoilProfile()
+    sp.add_layer(0, sl1)
+    sp.add_layer(3.2, sl2)
+    sp.add_layer(8.7, sl3)
+    sp.height = 30
+    sp.x_angles = [0.0, 0.0, 0.0]
+    tds = sm.TwoDSystem(width=40, height=20)
+    tds.add_sp(sp, x=0)
+    tds.x_surf = np.linspace(0, 40, 11)
+    tds.y_surf = np.array([0, 0.55, 0.13, 0.67, 0.44, 0.35, 0.74, 0.63, 0.69, 0.13, 0.43])
+    fc = mesh2d_vary_y.FiniteElementVary2DMeshConstructor(tds, 0.5, record_stats=True)
+    counts = fc.get_stage_report()[2]['counts']
+    assert counts['slopes'] == len(fc.sds)
+    for xc in fc.xcs_sorted:
+        assert sum(fc.y_blocks[xc]) == counts['n_rows']
+        assert min(fc.y_blocks[xc][:-1]) >= 1
+    # the gentle layer slopes are all consistent with the grid
+    for constraint in fc.slope_constraints:
+        assert constraint['slope'][1][0] > -3.
+    assert fc.femesh.get_quality_report()['n_inverted'] == 0
+
+
 if __name__ == '__main__':
     test_remove_close_items()